@@ -0,0 +1,128 @@
+"""
+Creates movies directly from zip and tar archives of images, without extracting them.
+
+The archive is read sequentially and each compressed image is piped straight into the encoder,
+so no temporary files (or image list file) are written.
+Frames are used in the order they are stored in the archive.
+"""
+import doctest
+import logging
+import os
+import tarfile
+import zipfile
+
+import encoders
+import image_helper
+
+
+logger = logging.getLogger(__name__)
+
+_ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+
+def is_archive_file_name(file_name):
+    """
+    >>> is_archive_file_name('Captures/2016-12-13.tar.gz')
+    True
+    >>> is_archive_file_name('Captures/2016-12-13.ZIP')
+    True
+    >>> is_archive_file_name('Captures/run 1.jpg')
+    False
+    """
+    return file_name.lower().endswith(_ARCHIVE_EXTENSIONS)
+
+
+def iterate_archive_images(archive_path):
+    """Yields (member-name, image-bytes) for each JPEG or PNG image in the archive, in archive order.
+    Other members (directories, text files, ...) are skipped.
+    Tar archives (including compressed ones) are streamed, so only one image is held in memory at a time.
+    """
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for member in archive.infolist():
+                if not member.is_dir() and _is_image_member_name(member.filename):
+                    yield member.filename, archive.read(member)
+    else:
+        with tarfile.open(archive_path, mode='r|*') as archive:
+            for member in archive:
+                if member.isfile() and _is_image_member_name(member.name):
+                    yield member.name, archive.extractfile(member).read()
+
+
+def _is_image_member_name(member_name):
+    """
+    >>> _is_image_member_name('2016-12-13/run 1.jpg')
+    True
+    >>> _is_image_member_name('2016-12-13/notes.txt')
+    False
+    >>> _is_image_member_name('__MACOSX/2016-12-13/._run 1.jpg')
+    False
+    """
+    if os.path.basename(member_name).startswith('._'):
+        # macOS resource forks.
+        return False
+    encoding, error_message = image_helper.get_image_encoding_from_file_name(member_name)
+    return encoding != image_helper.ImageEncoding.unknown
+
+
+def get_movie_path(archive_path, encoder):
+    """The movie is written next to the archive, and named after it.
+
+    >>> archive_path = os.path.join('Captures', '2016-12-13.tar.gz')
+    >>> get_movie_path(archive_path, encoders.MEncoderBackend()) == os.path.join('Captures', '2016-12-13.avi')
+    True
+    """
+    directory, file_name = os.path.split(archive_path)
+    lower_file_name = file_name.lower()
+    for extension in _ARCHIVE_EXTENSIONS:
+        if lower_file_name.endswith(extension):
+            file_name = file_name[:-len(extension)]
+            break
+    return encoder.get_default_movie_path(directory, file_name)
+
+
+def create_movie_from_archive(archive_path, frames_per_second, width=None, height=None, encoder=None, progress_callback=None, cancel_event=None):
+    """Returns the path to the created movie or None on failure.
+    All of the images in the archive must have the same encoding.
+    encoder is the encoders.EncoderBackend to use (default: encoders.get_encoder()).
+    progress_callback is optionally called with progress.Progress reports (without a total, which isn't known up front).
+    Setting cancel_event (a threading.Event) stops the encode and removes the partial movie.
+    """
+    encoder = encoder or encoders.get_encoder()
+    images = iterate_archive_images(archive_path)
+    try:
+        first_member_name, first_image_data = next(images)
+    except StopIteration:
+        logger.error("No images found in '{}'.".format(archive_path))
+        return
+    except (OSError, tarfile.TarError, zipfile.BadZipFile) as error:
+        logger.error("Unable to read '{}': {}".format(archive_path, error))
+        return
+
+    image_encoding, error_message = image_helper.get_image_encoding_from_file_name(first_member_name)
+    logger.info("Streaming {} images from '{}'.".format(image_encoding, archive_path))
+
+    def get_image_datas():
+        yield first_image_data
+        for member_name, image_data in images:
+            encoding, error_message = image_helper.get_image_encoding_from_file_name(member_name)
+            if encoding != image_encoding:
+                raise ValueError("Mixed image encodings: '{}' has encoding '{}', but '{}' has encoding '{}'.".format(
+                    first_member_name,
+                    image_encoding,
+                    member_name,
+                    encoding))
+            yield image_data
+
+    return encoder.create_movie_from_image_stream(
+        get_image_datas(),
+        image_encoding,
+        frames_per_second,
+        get_movie_path(archive_path, encoder),
+        width,
+        height,
+        output_line_handler=encoders.get_output_line_handler(None, progress_callback),
+        cancel_event=cancel_event)
+
+if __name__ == '__main__':
+    doctest.testmod()
@@ -0,0 +1,319 @@
+"""
+Times the frame-handling paths on synthetic frame sequences, so that changes to them can be checked for regressions.
+
+Examples:
+    benchmark.py
+    benchmark.py --frames 5000 --width 1280 --height 720 --formats jpeg --output results.json
+    benchmark.py --benchmarks probe_headers detect_encoding_with_contents
+
+A sequence of synthetic frames is generated for each format (PNG with the standard library, JPEG with Pillow),
+and each benchmark is run --repeat times on it; the fastest run is reported.
+create_movie_from_images runs the MEncoder backend with stub_mencoder.py standing in for MEncoder
+(unless --mencoder is given), so it measures everything around the encode itself, and works without MEncoder.
+
+The results are written as JSON.  For each benchmark and format, frames_per_second is the number of frames
+handled per second, and megabytes_per_second is the size of the data handled (the frames, or the list file
+for the list-file benchmarks) per second.  Probing only reads the frame headers, so its megabytes_per_second
+is an effective rate.  The frames are usually in the OS file cache, so the results show CPU rather than disk time.
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import shlex
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+import encoders
+import ffmpeg
+import image_helper
+import mencoder
+
+# Pillow is optional.  It is only needed for JPEG frames.
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ['jpeg', 'png']
+
+# Writing every frame separately would make generating long sequences slow,
+# so the sequence cycles through this many different frames.
+_DISTINCT_FRAME_COUNT = 8
+
+_FRAMES_PER_SECOND = 24
+
+
+def create_png_data(width, height, seed=0):
+    """Returns the bytes of an RGB PNG of width x height with a diagonal pattern that depends on seed.
+    Only the standard library is used.
+
+    >>> image_helper.get_image_info_from_image_data(create_png_data(64, 48))
+    ('image/png', 64, 48)
+    """
+    row_size = 3 * width
+    pattern = bytes((7 * index + 31 * seed) % 256 for index in range(row_size + height))
+    # Each row starts with its filter type (0: none).
+    raw_data = b''.join(b'\0' + pattern[row:row + row_size] for row in range(height))
+
+    def chunk(chunk_type, data):
+        return struct.pack('>L', len(data)) + chunk_type + data + struct.pack('>L', zlib.crc32(chunk_type + data))
+
+    header = struct.pack('>LLBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (b'\211PNG\r\n\032\n'
+            + chunk(b'IHDR', header)
+            + chunk(b'IDAT', zlib.compress(raw_data, 6))
+            + chunk(b'IEND', b''))
+
+
+def create_jpeg_data(width, height, seed=0):
+    """Returns the bytes of a noisy JPEG of width x height, with an EXIF capture time that depends on seed.
+    Requires Pillow.
+    """
+    noise = Image.effect_noise((width, height), 32 + seed)
+    gradient = Image.linear_gradient('L').resize((width, height))
+    image = Image.merge('RGB', (noise, gradient, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+
+    exif = Image.Exif()
+    exif.get_ifd(0x8769)[0x9003] = '2020:01:01 00:00:{:02}'.format(seed % 60)  # DateTimeOriginal
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=90, exif=exif.tobytes())
+    return output.getvalue()
+
+
+def generate_frames(directory, frame_count, width, height, image_format):
+    """Writes frame_count synthetic frames in image_format ('jpeg' or 'png') to directory.
+    Returns their file names, in order.
+    """
+    create_data = create_jpeg_data if image_format == 'jpeg' else create_png_data
+    frame_datas = [create_data(width, height, seed) for seed in range(min(frame_count, _DISTINCT_FRAME_COUNT))]
+
+    extension = '.jpg' if image_format == 'jpeg' else '.png'
+    image_file_names = []
+    for index in range(frame_count):
+        image_file_name = os.path.join(directory, 'frame{:06}{}'.format(index, extension))
+        with open(image_file_name, 'wb') as image_file:
+            image_file.write(frame_datas[index % len(frame_datas)])
+        image_file_names.append(image_file_name)
+    return image_file_names
+
+
+def create_stub_mencoder(directory):
+    """Writes an executable to directory that runs stub_mencoder.py with this Python, and returns its path."""
+    stub_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub_mencoder.py')
+    if sys.platform == 'win32':
+        wrapper_path = os.path.join(directory, 'mencoder.bat')
+        with open(wrapper_path, 'w') as wrapper_file:
+            wrapper_file.write('@"{}" "{}" %*\n'.format(sys.executable, stub_path))
+    else:
+        wrapper_path = os.path.join(directory, 'mencoder')
+        with open(wrapper_path, 'w') as wrapper_file:
+            wrapper_file.write('#!/bin/sh\nexec {} {} "$@"\n'.format(shlex.quote(sys.executable), shlex.quote(stub_path)))
+        os.chmod(wrapper_path, 0o755)
+    return wrapper_path
+
+
+def _probe_headers(image_file_names, workspace_directory):
+    for info in image_helper.probe_images(image_file_names):
+        pass
+
+
+def _get_capture_times(image_file_names, workspace_directory):
+    image_helper.get_capture_times(image_file_names)
+
+
+def _detect_encoding(image_file_names, workspace_directory):
+    image_helper.get_image_encoding_from_file_names(image_file_names)
+
+
+def _detect_encoding_with_contents(image_file_names, workspace_directory):
+    encoding, error_message = image_helper.get_image_encoding_from_file_names(image_file_names, check_contents=True)
+    if encoding == image_helper.ImageEncoding.unknown:
+        raise RuntimeError(error_message)
+
+
+def _write_mencoder_list(image_file_names, workspace_directory):
+    mencoder.write_image_file_names(os.path.join(workspace_directory, 'FileNames.txt'), image_file_names)
+
+
+def _write_ffmpeg_list(image_file_names, workspace_directory):
+    ffmpeg.write_image_file_names(os.path.join(workspace_directory, 'FileNames.txt'), image_file_names, _FRAMES_PER_SECOND)
+
+
+def _create_movie_from_images(image_file_names, workspace_directory):
+    movie_path = encoders.MEncoderBackend().create_movie_from_images(
+        image_file_names,
+        _FRAMES_PER_SECOND,
+        movie_path=os.path.join(workspace_directory, 'TimeLapse.avi'),
+        working_directory=workspace_directory)
+    if not movie_path:
+        raise RuntimeError('Error in creating movie.')
+
+
+# name -> the function to time, called with the image file names and a directory for its output.
+BENCHMARKS = {
+    'probe_headers': _probe_headers,
+    'capture_times': _get_capture_times,
+    'detect_encoding': _detect_encoding,
+    'detect_encoding_with_contents': _detect_encoding_with_contents,
+    'write_mencoder_list': _write_mencoder_list,
+    'write_ffmpeg_list': _write_ffmpeg_list,
+    'create_movie_from_images': _create_movie_from_images,
+}
+
+# The benchmarks whose data is the list file they write, rather than the frames.
+_LIST_FILE_BENCHMARKS = {'write_mencoder_list', 'write_ffmpeg_list'}
+
+
+def run_benchmark(name, image_file_names, repeat_count, workspace_directory):
+    """Runs the benchmark called name repeat_count times and returns its result (a dict) for the fastest run."""
+    benchmark = BENCHMARKS[name]
+    seconds = min(_time(benchmark, image_file_names, workspace_directory) for _ in range(repeat_count))
+
+    if name in _LIST_FILE_BENCHMARKS:
+        byte_count = os.path.getsize(os.path.join(workspace_directory, 'FileNames.txt'))
+    else:
+        byte_count = sum(os.path.getsize(image_file_name) for image_file_name in image_file_names)
+    return {
+        'benchmark': name,
+        'frame_count': len(image_file_names),
+        'seconds': round(seconds, 6),
+        'frames_per_second': get_rate(len(image_file_names), seconds),
+        'megabytes_per_second': get_rate(byte_count / 1e6, seconds),
+    }
+
+
+def _time(benchmark, image_file_names, workspace_directory):
+    start_time = time.perf_counter()
+    benchmark(image_file_names, workspace_directory)
+    return time.perf_counter() - start_time
+
+
+def get_rate(amount, seconds):
+    """
+    >>> get_rate(100, 0.5)
+    200.0
+    >>> get_rate(100, 0) is None
+    True
+    """
+    if seconds <= 0:
+        return None
+    return round(amount / seconds, 3)
+
+
+def run_benchmarks(names, image_formats, frame_count, width, height, repeat_count, frames_directory=None):
+    """Generates the frames for each of image_formats and runs the benchmarks called names on them.
+    Returns the results (a list of dicts).
+    The frames are written to frames_directory, or to a temporary directory which is removed afterwards.
+    """
+    results = []
+    temporary_directory = tempfile.mkdtemp(prefix='TimeLapseBenchmark-')
+    try:
+        for image_format in image_formats:
+            format_directory = os.path.join(frames_directory or temporary_directory, image_format)
+            os.makedirs(format_directory, exist_ok=True)
+            logger.info('Generating {} {}x{} {} frames.'.format(frame_count, width, height, image_format))
+            image_file_names = generate_frames(format_directory, frame_count, width, height, image_format)
+
+            workspace_directory = os.path.join(temporary_directory, 'workspace')
+            os.makedirs(workspace_directory, exist_ok=True)
+            for name in names:
+                logger.info('Running {} on {} frames.'.format(name, image_format))
+                result = run_benchmark(name, image_file_names, repeat_count, workspace_directory)
+                result['format'] = image_format
+                results.append(result)
+                logger.info('{}: {:.3f}s, {} frames/s.'.format(name, result['seconds'], result['frames_per_second']))
+    finally:
+        shutil.rmtree(temporary_directory, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the frame-handling paths on synthetic frames.')
+    parser.add_argument('--frames', type=int, default=500, help='The number of frames (default: %(default)s).')
+    parser.add_argument('--width', type=int, default=1920, help='The frame width (default: %(default)s).')
+    parser.add_argument('--height', type=int, default=1080, help='The frame height (default: %(default)s).')
+    parser.add_argument(
+        '--formats',
+        nargs='+',
+        choices=FORMATS,
+        help='The frame formats (default: jpeg and png, or just png without Pillow).')
+    parser.add_argument(
+        '--benchmarks',
+        nargs='+',
+        choices=list(BENCHMARKS),
+        default=list(BENCHMARKS),
+        help='The benchmarks to run (default: all of them).')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each benchmark (default: %(default)s).')
+    parser.add_argument(
+        '--mencoder',
+        metavar='PATH',
+        help='Time create_movie_from_images with the MEncoder at PATH, instead of the stand-in encoder.')
+    parser.add_argument('--frames-directory', help='Keep the generated frames in this directory.')
+    parser.add_argument('--output', metavar='FILE', help='Write the results to FILE instead of stdout.')
+    parser.add_argument('--log-level', choices=['error', 'warning', 'info', 'debug'], default='warning')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='[%(name)s] %(levelname)s: %(message)s', level=getattr(logging, args.log_level.upper()))
+
+    image_formats = args.formats or (FORMATS if Image is not None else ['png'])
+    if 'jpeg' in image_formats and Image is None:
+        logger.error('JPEG frames require Pillow (pip install Pillow).')
+        return 2
+    if args.frames < 1 or args.repeat < 1:
+        logger.error('--frames and --repeat must be positive.')
+        return 2
+
+    stub_directory = tempfile.mkdtemp(prefix='TimeLapseStubEncoder-')
+    previous_mencoder_path = os.environ.get(mencoder.MENCODER_PATH_ENVIRONMENT_VARIABLE)
+    os.environ[mencoder.MENCODER_PATH_ENVIRONMENT_VARIABLE] = args.mencoder or create_stub_mencoder(stub_directory)
+    try:
+        results = run_benchmarks(
+            args.benchmarks,
+            image_formats,
+            args.frames,
+            args.width,
+            args.height,
+            args.repeat,
+            args.frames_directory)
+    finally:
+        if previous_mencoder_path is None:
+            del os.environ[mencoder.MENCODER_PATH_ENVIRONMENT_VARIABLE]
+        else:
+            os.environ[mencoder.MENCODER_PATH_ENVIRONMENT_VARIABLE] = previous_mencoder_path
+        shutil.rmtree(stub_directory, ignore_errors=True)
+
+    report = {
+        'parameters': {
+            'frames': args.frames,
+            'width': args.width,
+            'height': args.height,
+            'repeat': args.repeat,
+            'encoder': 'mencoder' if args.mencoder else 'stub',
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
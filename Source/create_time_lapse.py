@@ -2,22 +2,28 @@
 # http://tkinter.unpythonic.net/wiki/tkFileDialog
 # http://infohost.nmt.edu/tcc/help/pubs/tkinter/web/index.html
 import argparse
+import concurrent.futures
 import doctest
 import logging
 import os
 import pprint
-import queue
 import sys
-import threading
 import tkinter
 from tkinter import ttk
 import tkinter.filedialog
 
+import deduplicate
+import deflicker
 import directories
 import image_helper
-import mencoder
+import image_info_cache
 import platform_helper
+import prescale
+import profiling
+import render_queue
+import thumbnails
 import tkinter_widgets
+import transcode
 
 
 logger = logging.getLogger(__name__)
@@ -37,21 +43,56 @@ class TimeLapseVideoFromImagesDialog(ttk.Frame):
 
         self.window = window
         self.image_file_names = []
+        # The images in the order the file picker returned them.
+        self.selected_image_file_names = []
         self.create_movie_button = None
+        self.cancel_button = None
         self.images_list_control = None
+        self.thumbnail_strip_control = None
+        # Showing thumbnails requires Pillow.
+        self.thumbnail_loader = thumbnails.ThumbnailLoader() if thumbnails.is_available() else None
+        self.sort_by_capture_time_control = None
+        # Reading the capture times of a large selection takes a while, so the images are sorted on this thread,
+        # and the result is picked up by polling.
+        self.sort_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        # The sort that the images list is waiting for, if any.
+        self.sort_future = None
         self.frames_per_second_control = None
+        self.duration_control = None
         self.status_label = None
         self.image_scale_control = None
-        self.result_queue = None
-        self.mencoder_process = None
+        self.drop_bad_frames_control = None
+        self.drop_duplicates_control = None
+        self.prescale_control = None
+        self.deflicker_control = None
+        self.simultaneous_renders_control = None
+        self.jobs_list_control = None
+        self.image_info_cache = image_info_cache.ImageInfoCache()
+        self.render_queue = render_queue.RenderQueue(cache=self.image_info_cache)
+        # The status and message of each job the last time the jobs list was updated.
+        self.displayed_job_statuses = []
+        self.displayed_job_messages = []
+        self.is_checking_render_status = False
 
         self.init_select_images_button()
         self.init_images_list_control()
+        self.init_thumbnail_strip_control()
+        self.init_sort_by_capture_time_control()
         self.init_frames_rate_control()
+        self.init_duration_control()
         self.init_image_scale_control()
+        self.init_drop_bad_frames_control()
+        self.init_drop_duplicates_control()
+        self.init_prescale_control()
+        self.init_deflicker_control()
         self.init_create_movie_button()
+        self.init_simultaneous_renders_control()
+        self.init_jobs_list_control()
+        self.init_cancel_button()
         self.init_status_control()
 
+        window.protocol('WM_DELETE_WINDOW', self.close)
+
     def init_select_images_button(self):
         ttk.Button(
             self,
@@ -71,6 +112,17 @@ class TimeLapseVideoFromImagesDialog(ttk.Frame):
             fill=tkinter.X,
             pady=4)
 
+    def init_cancel_button(self):
+        self.cancel_button = ttk.Button(
+            self,
+            text='Cancel',
+            command=self.cancel_jobs,
+            state=tkinter.DISABLED,
+            style='TButton')
+        self.cancel_button.pack(
+            fill=tkinter.X,
+            pady=(0, 4))
+
     def _set_create_movie_button_enabled(self, is_enabled):
         if is_enabled:
             button_state = tkinter.NORMAL
@@ -79,36 +131,114 @@ class TimeLapseVideoFromImagesDialog(ttk.Frame):
         self.create_movie_button.config(state=button_state)
 
     def init_images_list_control(self):
-        # Setup a list-box and scroll bars for it.
-        # See http://effbot.org/zone/tk-scrollbar-patterns.htm for scrollbar documentation.
-
-        frame = ttk.Frame(
+        # Only the visible rows are put in the list, so that selecting a very large number of images stays fast.
+        self.images_list_control = tkinter_widgets.VirtualListControl(
             self,
+            width=80,
+            height=6,
             borderwidth=2,
             relief=tkinter.SUNKEN)
+        self.images_list_control.pack(
+            fill=tkinter.BOTH,
+            expand=True,
+            pady=(0, 4))
 
-        scrollbar_y = ttk.Scrollbar(frame)
-        scrollbar_x = ttk.Scrollbar(frame, orient=tkinter.HORIZONTAL)
-        scrollbar_y.pack(side=tkinter.RIGHT, fill=tkinter.Y)
-        scrollbar_x.pack(side=tkinter.BOTTOM, fill=tkinter.X)
+    def init_thumbnail_strip_control(self):
+        if self.thumbnail_loader is None:
+            return
+        self.thumbnail_strip_control = tkinter_widgets.ThumbnailStripControl(self, self.thumbnail_loader)
+        self.thumbnail_strip_control.pack(
+            fill=tkinter.X,
+            pady=(0, 4))
+        # Keep the thumbnails in step with the list.
+        self.images_list_control.set_scroll_callback(self.thumbnail_strip_control.scroll_to)
 
-        self.images_list_control = tkinter.Listbox(
-            frame,
-            borderwidth=0,
-            width=80,
-            height=6,
-            yscrollcommand=scrollbar_y.set,
-            xscrollcommand=scrollbar_x.set)
-        self.images_list_control.pack(fill=tkinter.BOTH, expand=True)
+    def init_sort_by_capture_time_control(self):
+        self.sort_by_capture_time_control = tkinter_widgets.CheckboxControl(
+            self,
+            'Sort by Capture Time',
+            command=self._sort_by_capture_time_changed)
+        self.sort_by_capture_time_control.pack(pady=(0, 4))
 
-        scrollbar_y.config(command=self.images_list_control.yview)
-        scrollbar_x.config(command=self.images_list_control.xview)
+    def _sort_by_capture_time_changed(self):
+        self.set_ordered_images()
 
-        frame.pack(
-            fill=tkinter.BOTH,
-            expand=True,
+    def set_ordered_images(self):
+        """Shows the selected images, sorted by capture time if that is checked.
+        The sort runs on self.sort_executor; until it finishes, the images are shown in the order they were selected,
+        and a movie can't be created.
+        """
+        if self.sort_future is not None:
+            # A newer selection or order replaces the one being sorted.
+            self.sort_future.cancel()
+            self.sort_future = None
+
+        self.set_images(list(self.selected_image_file_names))
+        if not self.sort_by_capture_time_control.is_checked() or len(self.selected_image_file_names) < 2:
+            return
+
+        self._set_create_movie_button_enabled(False)
+        self.set_status_label('Sorting {} images by capture time...'.format(len(self.selected_image_file_names)))
+        self.sort_future = self.sort_executor.submit(image_helper.sort_by_capture_time, self.selected_image_file_names)
+        self.schedule_sort_check(self.sort_future)
+
+    def check_if_sorted(self, sort_future):
+        if sort_future is not self.sort_future:
+            # Replaced by a newer sort.
+            return
+        if not sort_future.done():
+            self.schedule_sort_check(sort_future)
+            return
+
+        self.sort_future = None
+        self.set_status_label('')
+        with profiling.span('set_images', category='gui', frames=len(self.selected_image_file_names)):
+            self.set_images(sort_future.result())
+
+    def schedule_sort_check(self, sort_future):
+        sort_check_interval_milliseconds = 100
+        self.after(sort_check_interval_milliseconds, self.check_if_sorted, sort_future)
+
+    def init_jobs_list_control(self):
+        self.jobs_list_control = tkinter.Listbox(
+            self,
+            width=80,
+            height=4,
+            selectmode=tkinter.EXTENDED)
+        self.jobs_list_control.pack(
+            fill=tkinter.X,
             pady=(0, 4))
 
+    def init_simultaneous_renders_control(self):
+        frame = ttk.Frame(self)
+
+        ttk.Label(
+            frame,
+            text="Simultaneous renders:").pack(side=tkinter.LEFT)
+
+        simultaneous_renders_var = tkinter.StringVar()
+        simultaneous_renders_var.set(1)
+        self.simultaneous_renders_control = tkinter.Spinbox(
+            frame,
+            from_=1,
+            to=os.cpu_count() or 1,
+            increment=1,
+            textvariable=simultaneous_renders_var,
+            command=self._simultaneous_renders_changed,
+            width=4)
+        self.simultaneous_renders_control.pack()
+
+        frame.pack(pady=(0, 4))
+
+    def _simultaneous_renders_changed(self):
+        self.render_queue.set_max_workers(self.get_simultaneous_render_count())
+
+    def get_simultaneous_render_count(self):
+        try:
+            return max(1, int(self.simultaneous_renders_control.get()))
+        except ValueError:
+            return 1
+
     def init_frames_rate_control(self):
         frame = ttk.Frame(self)
 
@@ -129,6 +259,20 @@ class TimeLapseVideoFromImagesDialog(ttk.Frame):
 
         frame.pack(pady=4)
 
+    def init_duration_control(self):
+        self.duration_control = tkinter_widgets.LabelledEntryControl(
+            self,
+            'Duration (seconds, optional):',
+            entry_class=tkinter_widgets.IntegerEntry,
+            entry_args={'width': 6})
+        self.duration_control.pack(pady=(0, 4))
+
+    def get_duration_seconds(self):
+        """Returns the target movie duration, or None to use every frame."""
+        if self.duration_control.is_empty():
+            return None
+        return int(self.duration_control.get_text())
+
     def init_status_control(self):
         self.status_label = ttk.Label(self)
         self.status_label.pack()
@@ -139,6 +283,28 @@ class TimeLapseVideoFromImagesDialog(ttk.Frame):
         self.image_scale_control.disable()
         self.image_scale_control.pack(pady=(0, 4))
 
+    def init_drop_bad_frames_control(self):
+        self.drop_bad_frames_control = tkinter_widgets.CheckboxControl(self, 'Drop Bad Frames')
+        self.drop_bad_frames_control.pack(pady=(0, 4))
+
+    def init_drop_duplicates_control(self):
+        # Comparing the frames requires Pillow and NumPy.
+        state = tkinter.NORMAL if deduplicate.is_available() else tkinter.DISABLED
+        self.drop_duplicates_control = tkinter_widgets.CheckboxControl(self, 'Drop Duplicate Frames', state=state)
+        self.drop_duplicates_control.pack(pady=(0, 4))
+
+    def init_prescale_control(self):
+        # Scaling the frames ahead of time requires Pillow.
+        state = tkinter.NORMAL if prescale.is_available() else tkinter.DISABLED
+        self.prescale_control = tkinter_widgets.CheckboxControl(self, 'Cache Scaled Frames', state=state)
+        self.prescale_control.pack(pady=(0, 4))
+
+    def init_deflicker_control(self):
+        # Deflickering requires Pillow and NumPy.
+        state = tkinter.NORMAL if deflicker.is_available() else tkinter.DISABLED
+        self.deflicker_control = tkinter_widgets.CheckboxControl(self, 'Deflicker', state=state)
+        self.deflicker_control.pack(pady=(0, 4))
+
     def set_status_label(self, text):
         self.status_label.config(text=text)
 
@@ -150,25 +316,32 @@ class TimeLapseVideoFromImagesDialog(ttk.Frame):
         """Bring up a dialog to allow the user to select one or more images.
         Return a list of the selected image file names.
         """
-        files = tkinter.filedialog.askopenfilenames(
-            parent=self.window,
-            title="Select Images",
-            filetypes=[("Image", ".jpg"), ("Image", ".jpeg"), ("Image", ".png"), ("All Files", ".*")])
+        with profiling.span('file_dialog', category='gui'):
+            files = tkinter.filedialog.askopenfilenames(
+                parent=self.window,
+                title="Select Images",
+                filetypes=[("Image", ".jpg"), ("Image", ".jpeg"), ("Image", ".png"), ("All Files", ".*")])
         if not files:
             return
-        logger.debug("File picker returned \n{}.".format(pprint.pformat(files)))
-
         image_file_names = self.get_image_file_names(files)
-        logger.debug("Settings images to \n{}".format(pprint.pformat(image_file_names)))
+        # Formatting a very large selection is slow, so only do it when it will be logged.
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("File picker returned \n{}.".format(pprint.pformat(files)))
+            logger.debug("Settings images to \n{}".format(pprint.pformat(image_file_names)))
 
         self.set_status_label('')
 
-        encoding, error_message = image_helper.get_image_encoding_from_file_names(image_file_names)
+        # Mixed JPEG and PNG frames are converted to one encoding when the movie is rendered.
+        encoding, error_message = image_helper.get_image_encoding_from_file_names(
+            image_file_names,
+            allow_mixed=transcode.is_available())
         if encoding == image_helper.ImageEncoding.unknown:
             self.user_message(error_message)
             image_file_names = []
 
-        self.set_images(image_file_names)
+        self.selected_image_file_names = image_file_names
+        with profiling.span('set_images', category='gui', frames=len(image_file_names)):
+            self.set_ordered_images()
 
     def get_image_file_names(self, files):
         """The file picker returns different types on different platforms.
@@ -186,8 +359,9 @@ class TimeLapseVideoFromImagesDialog(ttk.Frame):
     def set_images(self, image_file_names):
         self.image_file_names = image_file_names
 
-        self.images_list_control.delete(0, tkinter.END)
-        self.images_list_control.insert(0, *image_file_names)
+        self.images_list_control.set_items(image_file_names)
+        if self.thumbnail_strip_control:
+            self.thumbnail_strip_control.set_items(image_file_names)
 
         if len(image_file_names) > 0:
             # Enable controls that are dependent on having selected images.
@@ -217,63 +391,118 @@ class TimeLapseVideoFromImagesDialog(ttk.Frame):
         return self.frames_per_second_control.get()
 
     def create_movie(self):
-        """Use MEncoder to create a movie from the images.
-        Run it as a separate process and start checking to see if it is running (asynchronously).
+        """Queue a render of the selected images.
+        Renders run on the render queue's threads, and the jobs list is updated by polling (asynchronously).
         """
         if not self.validate_scaled_resolution():
             return
         width, height = self.get_scaled_resolution()
 
-        self.user_message("Creating movie...")
+        duration_seconds = self.get_duration_seconds()
+        if duration_seconds is not None and duration_seconds <= 0:
+            self.user_message("The duration must be positive.")
+            return
 
         resolution_str = '<image-size>'
         if width and height:
             resolution_str = '({}x{})'.format(width, height)
 
-        logger.debug('Creating movie: images="{}", FPS=({}), resolution={}'.format(
+        logger.debug('Queueing movie: images="{}", FPS=({}), resolution={}'.format(
             self.image_file_names,
             self.get_frames_per_second(),
             resolution_str))
 
-        self.result_queue = queue.Queue()
-
-        self.mencoder_process = threading.Thread(
-            target=self.create_movie_and_store_result,
-            args=(
-                self.image_file_names,
-                self.get_frames_per_second(),
-                width,
-                height))
-        self.mencoder_process.start()
-        self.check_if_mencoder_running()
+        job = render_queue.RenderJob(
+            self.image_file_names,
+            self.get_frames_per_second(),
+            width,
+            height,
+            check_frames=True,
+            drop_bad_frames=self.drop_bad_frames_control.is_checked(),
+            duplicate_threshold=deduplicate.DEFAULT_THRESHOLD if self.drop_duplicates_control.is_checked() else None,
+            prescale_frames=self.prescale_control.is_checked(),
+            deflicker_window_size=deflicker.DEFAULT_WINDOW_SIZE if self.deflicker_control.is_checked() else None,
+            duration_seconds=duration_seconds)
+        self.render_queue.set_max_workers(self.get_simultaneous_render_count())
+        try:
+            with profiling.span('create_movie', category='gui', frames=len(self.image_file_names)):
+                self.render_queue.submit(job)
+        except ValueError as error:
+            self.user_message(str(error))
+            return
 
-    def create_movie_and_store_result(self, image_file_names, frames_per_second, width, height):
-        """Wraps CreateMovie and stores the result in a Queue.
+        self.user_message("Queued movie: {}".format(job.movie_path))
+        self.cancel_button.config(state=tkinter.NORMAL)
+        if not self.is_checking_render_status:
+            self.is_checking_render_status = True
+            self.check_if_rendering()
+
+    def check_if_rendering(self):
+        self.update_jobs_list()
+        if self.render_queue.is_busy():
+            logger.debug('Still rendering; rescheduling check.')
+            self.schedule_render_status_check()
+        else:
+            self.is_checking_render_status = False
+            self.cancel_button.config(state=tkinter.DISABLED)
+
+    def update_jobs_list(self):
+        """Shows each job's status and progress, and reports jobs that finished since the last update."""
+        jobs = list(self.render_queue.jobs)
+        for index, job in enumerate(jobs):
+            if index >= len(self.displayed_job_statuses):
+                self.displayed_job_statuses.append(None)
+                self.displayed_job_messages.append(None)
+                self.jobs_list_control.insert(tkinter.END, '')
+
+            message = job.get_status_message()
+            if message != self.displayed_job_messages[index]:
+                # Replacing an item clears its selection.
+                is_selected = self.jobs_list_control.selection_includes(index)
+                self.jobs_list_control.delete(index)
+                self.jobs_list_control.insert(index, message)
+                if is_selected:
+                    self.jobs_list_control.selection_set(index)
+                self.displayed_job_messages[index] = message
+
+            if job.status != self.displayed_job_statuses[index] and job.is_finished():
+                self.job_finished(job)
+            self.displayed_job_statuses[index] = job.status
+
+    def schedule_render_status_check(self):
+        render_status_check_interval_milliseconds = 100
+        self.after(render_status_check_interval_milliseconds, self.check_if_rendering)
+
+    def cancel_jobs(self):
+        """Stop the selected jobs, or every job if none are selected.
+        Running encoder processes are terminated and their partial outputs are removed.
         """
-        result = mencoder.create_movie_from_images(
-            image_file_names,
-            frames_per_second,
-            width,
-            height)
-        self.result_queue.put(result)
-
-    def check_if_mencoder_running(self):
-        self.mencoder_process.join(0)
-        if self.mencoder_process.is_alive():
-            logger.debug('MEncoder is still running; rescheduling check.')
-            self.schedule_mencoder_status_check()
+        jobs = list(self.render_queue.jobs)
+        selected_indexes = self.jobs_list_control.curselection()
+        if selected_indexes:
+            for index in selected_indexes:
+                self.render_queue.cancel(jobs[index])
         else:
-            result = self.result_queue.get()
-            self.mencoder_finished(result)
-
-    def schedule_mencoder_status_check(self):
-        mencoder_is_running_interval_milliseconds = 100
-        self.after(mencoder_is_running_interval_milliseconds, self.check_if_mencoder_running)
-
-    def mencoder_finished(self, result):
-        if result:
-            movie_path = result
-            self.user_message("Created movie: {}".format(movie_path))
+            self.user_message("Cancelling...")
+            self.render_queue.cancel_all()
+
+    def close(self):
+        # Don't leave orphaned encoders running after the window is gone.
+        self.render_queue.cancel_all()
+        self.render_queue.wait()
+        self.image_info_cache.close()
+        self.sort_executor.shutdown(wait=False, cancel_futures=True)
+        if self.thumbnail_loader:
+            self.thumbnail_loader.close()
+        self.window.destroy()
+
+    def job_finished(self, job):
+        if job.status == render_queue.JobStatuses.cancelled:
+            self.user_message("Cancelled: {}".format(job.name))
+        elif job.status == render_queue.JobStatuses.succeeded:
+            self.user_message("Created movie: {}".format(job.movie_path))
+        elif job.error_message:
+            self.user_message(job.error_message)
         else:
             self.user_message("Error in creating movie.")
 
@@ -292,11 +521,18 @@ def redirect_output_to_null():
 def main():
     parser = argparse.ArgumentParser(description='Create time lapse movies from series of images.')
     parser.add_argument('--log-level', choices=['error', 'warning', 'info', 'debug'], default='info')
+    parser.add_argument(
+        '--profile',
+        metavar='FILE',
+        help='Time each stage of the renders, and write the timings to FILE as a Chrome trace when the window is closed.')
     args = parser.parse_args()
 
     numeric_log_level = getattr(logging, args.log_level.upper())
     logging.basicConfig(format='[%(name)s] %(levelname)s: %(message)s', level=numeric_log_level)
 
+    if args.profile:
+        profiling.enable()
+
     if not sys.stdout:
         redirect_output_to_null()
 
@@ -318,5 +554,8 @@ def main():
 
     window.mainloop()
 
+    if args.profile:
+        profiling.write_trace(args.profile)
+
 if __name__ == '__main__':
     main()
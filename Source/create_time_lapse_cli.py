@@ -0,0 +1,615 @@
+"""
+Creates time lapse movies from the command line, without the Tk dialog.
+
+Suitable for headless machines and scripting.  This module must not import tkinter.
+
+Examples:
+    create_time_lapse_cli.py --fps 24 /captures/2016-12-13
+    create_time_lapse_cli.py --fps 30 --width 1280 --height 720 "/captures/*.jpg"
+    create_time_lapse_cli.py --fps 24 /captures/2016-12-13.tar.gz
+    create_time_lapse_cli.py --batch jobs.txt
+    create_time_lapse_cli.py --watch --jobs 2 /captures/camera-1 /captures/camera-2
+
+A zip or tar archive of images is streamed straight into the encoder, without being extracted.
+
+A batch file contains one job per line, using the same arguments as a single job.
+Blank lines and lines starting with '#' are ignored.
+All of the jobs run in the same process, one after another, or with --jobs, up to that many at once
+(highest --priority first), each with its own output name.
+
+With --watch, the directories are watched for new frames, and each one's movie is updated
+(incrementally, when the options allow it) shortly after new frames stop arriving, until interrupted.
+"""
+import argparse
+import copy
+import logging
+import os
+import shlex
+import signal
+import sys
+import threading
+import time
+
+import archive_source
+import decimation
+import deduplicate
+import deflicker
+import encoder_process
+import encoders
+import ffmpeg
+import image_helper
+import image_info_cache
+import prescale
+import profiling
+import progress
+import render_queue
+import transcode
+import watch_folder
+
+
+logger = logging.getLogger(__name__)
+
+
+class ExitCodes:
+    success = 0
+    failure = 1
+    usage_error = 2
+    cancelled = encoder_process.CANCELLED_EXIT_CODE
+
+
+# Set by SIGINT or SIGTERM to stop the running encoders (and the rest of a batch).
+cancel_event = threading.Event()
+
+
+# How often encode progress is logged.
+PROGRESS_LOG_INTERVAL_SECONDS = 5
+
+
+class _ProgressLogger:
+    """A progress callback that logs at most once every PROGRESS_LOG_INTERVAL_SECONDS.
+    job_name prefixes each message, to tell concurrent jobs apart.
+    """
+
+    def __init__(self, job_name=None):
+        self.job_name = job_name
+        self.last_log_time = None
+
+    def __call__(self, encode_progress):
+        now = time.monotonic()
+        is_complete = encode_progress.percent is not None and encode_progress.percent >= 100
+        if is_complete or self.last_log_time is None or now - self.last_log_time >= PROGRESS_LOG_INTERVAL_SECONDS:
+            self.last_log_time = now
+            message = progress.get_progress_message(encode_progress)
+            if self.job_name:
+                message = '{}: {}'.format(self.job_name, message)
+            logger.info(message)
+
+
+class _ArgumentParser(argparse.ArgumentParser):
+    """Raises ValueError instead of exiting, so that a bad batch-file line doesn't end the whole batch."""
+
+    def error(self, message):
+        raise ValueError(message)
+
+
+def create_argument_parser():
+    parser = _ArgumentParser(description='Create time lapse movies from series of images, without a GUI.')
+    parser.add_argument(
+        'images',
+        nargs='*',
+        help='Image files, directories of images, glob patterns, or a single zip or tar archive of images.')
+    parser.add_argument('--fps', type=int, default=24, help='Frames per second (default: %(default)s).')
+    parser.add_argument('--width', type=int, help='Scaled video width.  Requires --height.')
+    parser.add_argument('--height', type=int, help='Scaled video height.  Requires --width.')
+    parser.add_argument(
+        '--encoder',
+        choices=encoders.ENCODER_NAMES,
+        help='The encoder to use (default: the fastest one available).')
+    parser.add_argument(
+        '--codec',
+        choices=ffmpeg.VIDEO_CODECS,
+        help='The ffmpeg video codec (default: the fastest one that ffmpeg has, usually {}).'.format(
+            ffmpeg.DEFAULT_VIDEO_CODEC))
+    parser.add_argument(
+        '--preset',
+        choices=ffmpeg.PRESETS,
+        help='The ffmpeg speed preset (default: {}).'.format(ffmpeg.DEFAULT_PRESET))
+    parser.add_argument(
+        '--sort-by-capture-time',
+        action='store_true',
+        help='Put the frames in the order they were taken (from their EXIF data, or else their modification times), '
+             'instead of by name.')
+    parser.add_argument(
+        '--duration',
+        type=float,
+        metavar='SECONDS',
+        help='Make a movie that lasts SECONDS at --fps, by using only a subset of the frames.')
+    parser.add_argument(
+        '--frame-spacing',
+        choices=decimation.FRAME_SPACINGS,
+        default=decimation.DEFAULT_FRAME_SPACING,
+        help='How --duration picks the frames: evenly through the sequence, '
+             'or evenly in capture time (default: %(default)s).')
+    parser.add_argument(
+        '--drop-duplicates',
+        nargs='?',
+        type=int,
+        const=deduplicate.DEFAULT_THRESHOLD,
+        metavar='THRESHOLD',
+        help='Leave out frames whose perceptual hash is fewer than THRESHOLD bits (of 64) away from the previous kept frame '
+             '(default: %(const)s).  Requires Pillow and NumPy.')
+    parser.add_argument(
+        '--hash-method',
+        choices=deduplicate.HASH_METHODS,
+        default=deduplicate.DEFAULT_HASH_METHOD,
+        help='The perceptual hash used by --drop-duplicates (default: %(default)s).')
+    parser.add_argument(
+        '--deflicker',
+        nargs='?',
+        type=int,
+        const=deflicker.DEFAULT_WINDOW_SIZE,
+        metavar='WINDOW',
+        help='Even out exposure flicker by smoothing the brightness over WINDOW frames (default: %(const)s).  '
+             'Requires Pillow and NumPy.')
+    parser.add_argument(
+        '--prescale',
+        action='store_true',
+        help='Scale the frames in parallel before encoding, and cache them for later renders at the same size.  '
+             'Requires --width, --height and Pillow.')
+    parser.add_argument(
+        '--resample-filter',
+        choices=prescale.RESAMPLE_FILTERS,
+        default=prescale.DEFAULT_RESAMPLE_FILTER,
+        help='The resampling filter used by --prescale (default: %(default)s).')
+    parser.add_argument(
+        '--check-contents',
+        action='store_true',
+        help="Check every image's signature bytes against its extension before rendering.")
+    parser.add_argument(
+        '--preflight',
+        action='store_true',
+        help='Check every frame for truncation, corruption and inconsistent sizes before rendering.')
+    parser.add_argument(
+        '--drop-bad-frames',
+        action='store_true',
+        help='Leave out frames that fail the preflight check instead of failing.  Implies --preflight.')
+    parser.add_argument(
+        '--preflight-report',
+        metavar='FILE',
+        help='Write the preflight check results to FILE as JSON.  Implies --preflight.')
+    parser.add_argument(
+        '--parallel',
+        nargs='?',
+        type=int,
+        const=0,
+        metavar='WORKERS',
+        help='Encode segments of the images in parallel, with up to WORKERS encoders at once '
+             '(default: the number of cores).')
+    parser.add_argument(
+        '--frames-per-segment',
+        type=int,
+        help='The number of frames in each segment when encoding in parallel.  Implies --parallel.')
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Only encode the frames added since the last --incremental run, '
+             'and join them onto the existing movie without re-encoding it.')
+    parser.add_argument(
+        '--no-probe-cache',
+        action='store_true',
+        help='Do not use or update the persistent image info cache.')
+    parser.add_argument(
+        '--batch',
+        metavar='FILE',
+        help="Run each line of FILE as a separate job.  Use '-' to read from stdin.")
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        metavar='N',
+        help='Run up to N batch jobs at once, each with its own output name (default: one at a time, in order).')
+    parser.add_argument(
+        '--priority',
+        type=int,
+        default=0,
+        help='With --jobs, batch jobs with a higher priority are started first (default: %(default)s).')
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help='Watch the image directories, and update their movies whenever new frames arrive.')
+    parser.add_argument(
+        '--debounce',
+        type=float,
+        default=watch_folder.DEFAULT_DEBOUNCE_SECONDS,
+        metavar='SECONDS',
+        help='With --watch, render once no new frames have arrived for SECONDS (default: %(default)s).')
+    parser.add_argument(
+        '--max-delay',
+        type=float,
+        default=watch_folder.DEFAULT_MAXIMUM_DELAY_SECONDS,
+        metavar='SECONDS',
+        help='With --watch, render at most SECONDS after the first new frame, '
+             'even if frames are still arriving (default: %(default)s).')
+    parser.add_argument(
+        '--profile',
+        metavar='FILE',
+        help='Time each stage of the render, and write the timings to FILE as a Chrome trace '
+             '(for chrome://tracing or https://ui.perfetto.dev).')
+    parser.add_argument('--log-level', choices=['error', 'warning', 'info', 'debug'], default='info')
+    return parser
+
+
+def write_profile(trace_path):
+    try:
+        profiling.write_trace(trace_path)
+    except OSError as error:
+        logger.error('Unable to write the profile: {}'.format(error))
+
+
+def run_job(args):
+    """Renders a single movie.  Returns an exit code."""
+    if any(archive_source.is_archive_file_name(path) for path in args.images):
+        encoder, exit_code = get_job_encoder(args)
+        if encoder is None:
+            return exit_code
+        return run_archive_job(args, encoder)
+
+    if args.no_probe_cache:
+        return run_queued_job(args, cache=None)
+
+    with image_info_cache.ImageInfoCache() as cache:
+        try:
+            return run_queued_job(args, cache)
+        finally:
+            if cache.hits or cache.misses:
+                logger.info(cache.get_statistics_message())
+
+
+def get_job_encoder(args):
+    """Checks the job's arguments and returns (encoder, exit-code).  The encoder is None on failure."""
+    if not args.images:
+        logger.error('No images specified.')
+        return None, ExitCodes.usage_error
+    if bool(args.width) != bool(args.height):
+        logger.error('To scale the images, you must specify both the width and the height.')
+        return None, ExitCodes.usage_error
+    if args.duration is not None and args.duration <= 0:
+        logger.error('--duration must be positive.')
+        return None, ExitCodes.usage_error
+    if args.deflicker is not None and args.deflicker < 1:
+        logger.error('--deflicker must be positive.')
+        return None, ExitCodes.usage_error
+    if args.frames_per_segment is not None and args.frames_per_segment < 1:
+        logger.error('--frames-per-segment must be positive.')
+        return None, ExitCodes.usage_error
+    if args.incremental and (args.duration is not None or args.deflicker is not None
+                             or args.parallel is not None or args.frames_per_segment):
+        logger.error('--incremental cannot be combined with --duration, --deflicker or --parallel.')
+        return None, ExitCodes.usage_error
+    if args.prescale and not args.width:
+        logger.error('--prescale requires --width and --height.')
+        return None, ExitCodes.usage_error
+    if args.deflicker is not None and (args.parallel is not None or args.frames_per_segment):
+        logger.error('--deflicker cannot be combined with --parallel.')
+        return None, ExitCodes.usage_error
+
+    try:
+        encoder = encoders.get_encoder(args.encoder, video_codec=args.codec, preset=args.preset)
+    except ValueError as error:
+        logger.error(error)
+        return None, ExitCodes.failure
+    if not encoder.is_available():
+        logger.error("The '{}' encoder is not available.".format(encoder.name))
+        return None, ExitCodes.failure
+    return encoder, ExitCodes.success
+
+
+def get_job_image_file_names(args):
+    """Returns (image-file-names, exit-code).  The image file names are empty on failure."""
+    try:
+        with profiling.span('get_image_file_names_from_paths'):
+            image_file_names = image_helper.get_image_file_names_from_paths(args.images)
+    except ValueError as error:
+        logger.error(error)
+        return [], ExitCodes.usage_error
+    if not image_file_names:
+        logger.error('No images found in {}.'.format(args.images))
+        return [], ExitCodes.usage_error
+    if args.sort_by_capture_time:
+        with profiling.span('sort_by_capture_time'):
+            image_file_names = image_helper.sort_by_capture_time(image_file_names)
+    return image_file_names, ExitCodes.success
+
+
+def run_queued_job(args, cache):
+    """Renders a single movie on a render_queue.RenderQueue of its own.  Returns an exit code."""
+    job, exit_code = create_render_job(args, cache, unique_movie_path=False)
+    if job is None:
+        return exit_code
+
+    logger.info('Creating movie from {} images at {} FPS.'.format(len(job.image_file_names), args.fps))
+    queue = render_queue.RenderQueue(cache=cache)
+    queue.submit(job)
+    _wait_for_jobs(queue)
+
+    if job.status == render_queue.JobStatuses.cancelled:
+        logger.error('Cancelled.')
+    elif job.status == render_queue.JobStatuses.failed:
+        logger.error(job.error_message)
+    else:
+        logger.info('Created movie: {}'.format(job.movie_path))
+    return _JOB_EXIT_CODES[job.status]
+
+
+def run_archive_job(args, encoder):
+    if len(args.images) != 1:
+        logger.error('An archive cannot be combined with other images.')
+        return ExitCodes.usage_error
+    if args.check_contents or args.preflight or args.drop_bad_frames or args.preflight_report:
+        logger.error('Image checks are not supported for archives.')
+        return ExitCodes.usage_error
+    if args.sort_by_capture_time:
+        logger.error('--sort-by-capture-time is not supported for archives.')
+        return ExitCodes.usage_error
+
+    movie_path = archive_source.create_movie_from_archive(
+        args.images[0],
+        args.fps,
+        args.width,
+        args.height,
+        encoder=encoder,
+        progress_callback=_ProgressLogger(),
+        cancel_event=cancel_event)
+    if cancel_event.is_set():
+        logger.error('Cancelled.')
+        return ExitCodes.cancelled
+    if not movie_path:
+        logger.error('Error in creating movie.')
+        return ExitCodes.failure
+
+    logger.info('Created movie: {}'.format(movie_path))
+    return ExitCodes.success
+
+
+def run_batch(parser, batch_file, job_count=None):
+    """Runs every job in batch_file, continuing past failures.
+    With a job_count, up to that many jobs are run at once through a render_queue.RenderQueue.
+    Returns the worst exit code of all the jobs.
+    """
+    if job_count:
+        return run_queued_batch(parser, batch_file, job_count)
+
+    exit_code = ExitCodes.success
+    for line_number, line in enumerate(batch_file, start=1):
+        if cancel_event.is_set():
+            return ExitCodes.cancelled
+
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        try:
+            job_args = parser.parse_args(shlex.split(line))
+        except ValueError as error:
+            logger.error('Batch line {}: {}'.format(line_number, error))
+            job_exit_code = ExitCodes.usage_error
+        else:
+            logger.info('Batch line {}: {}'.format(line_number, line))
+            job_exit_code = run_job(job_args)
+
+        exit_code = max(exit_code, job_exit_code)
+    return exit_code
+
+
+def run_queued_batch(parser, batch_file, job_count):
+    """Checks every job in batch_file, then renders them with up to job_count at once.
+    Returns the worst exit code of all the jobs.
+    """
+    exit_code = ExitCodes.success
+    with image_info_cache.ImageInfoCache() as cache:
+        # Nothing starts until every job is queued, so that the priorities apply to the whole batch.
+        queue = render_queue.RenderQueue(0, cache=cache, status_callback=_log_job_status)
+        for line_number, line in enumerate(batch_file, start=1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            try:
+                job_args = parser.parse_args(shlex.split(line))
+            except ValueError as error:
+                logger.error('Batch line {}: {}'.format(line_number, error))
+                exit_code = max(exit_code, ExitCodes.usage_error)
+                continue
+
+            job_name = 'Batch line {}'.format(line_number)
+            job, job_exit_code = create_render_job(job_args, cache, job_name)
+            if job is None:
+                logger.error('{}: not queued.'.format(job_name))
+                exit_code = max(exit_code, job_exit_code)
+                continue
+            queue.submit(job)
+            logger.info('{}: {} will be written to {}'.format(job_name, line, job.movie_path))
+
+        queue.set_max_workers(job_count)
+        _wait_for_jobs(queue)
+
+    for job in queue.jobs:
+        exit_code = max(exit_code, _JOB_EXIT_CODES[job.status])
+    return exit_code
+
+
+_JOB_EXIT_CODES = {
+    render_queue.JobStatuses.succeeded: ExitCodes.success,
+    render_queue.JobStatuses.failed: ExitCodes.failure,
+    render_queue.JobStatuses.cancelled: ExitCodes.cancelled,
+}
+
+
+def _wait_for_jobs(queue):
+    """Waits for every job in queue to finish, cancelling them all when cancel_event is set."""
+    while not queue.wait(timeout=0.1):
+        if cancel_event.is_set():
+            queue.cancel_all()
+
+
+def create_render_job(args, cache, job_name=None, unique_movie_path=True):
+    """Checks a job's arguments and images, and returns (render_queue.RenderJob, exit-code).
+    The job is None on failure.
+    With unique_movie_path, the movie gets a name that no other file or job is using when the job is submitted;
+    otherwise it replaces the default movie in the directory of the first image.
+    """
+    encoder, exit_code = get_job_encoder(args)
+    if encoder is None:
+        return None, exit_code
+    if any(archive_source.is_archive_file_name(path) for path in args.images):
+        logger.error('Archives cannot be run with --jobs.')
+        return None, ExitCodes.usage_error
+
+    image_file_names, exit_code = get_job_image_file_names(args)
+    if not image_file_names:
+        return None, exit_code
+
+    encoding, error_message = image_helper.get_image_encoding_from_file_names(
+        image_file_names,
+        check_contents=args.check_contents,
+        cache=cache,
+        allow_mixed=transcode.is_available())
+    if encoding == image_helper.ImageEncoding.unknown:
+        logger.error(error_message)
+        return None, ExitCodes.usage_error
+
+    # Incremental and watched jobs update the same movie every time, rather than getting a new name.
+    movie_path = None
+    if args.incremental or args.watch or not unique_movie_path:
+        movie_path = encoder.get_default_movie_path(os.path.dirname(image_file_names[0]))
+    return render_queue.RenderJob(
+        image_file_names,
+        args.fps,
+        args.width,
+        args.height,
+        priority=args.priority,
+        name=job_name,
+        movie_path=movie_path,
+        encoder=encoder,
+        worker_count=args.parallel,
+        frames_per_segment=args.frames_per_segment,
+        check_frames=bool(args.preflight or args.drop_bad_frames or args.preflight_report),
+        drop_bad_frames=args.drop_bad_frames,
+        preflight_report_path=args.preflight_report,
+        duplicate_threshold=args.drop_duplicates,
+        hash_method=args.hash_method,
+        deflicker_window_size=args.deflicker,
+        duration_seconds=args.duration,
+        frame_spacing=args.frame_spacing,
+        incremental=args.incremental,
+        prescale_frames=args.prescale,
+        resample_filter=args.resample_filter,
+        progress_callback=_ProgressLogger(job_name)), ExitCodes.success
+
+
+def run_watch(args):
+    """Updates the movies of the watched directories until interrupted.
+    Returns an exit code, which is ExitCodes.success once watching has been stopped.
+    """
+    if not args.images:
+        logger.error('No directories specified.')
+        return ExitCodes.usage_error
+    for directory in args.images:
+        if not os.path.isdir(directory):
+            logger.error("'{}' is not a directory.".format(directory))
+            return ExitCodes.usage_error
+
+    # Only encode the new frames, unless an option requires encoding all of them.
+    can_update_incrementally = (args.duration is None and args.deflicker is None
+                                and args.parallel is None and not args.frames_per_segment)
+
+    with image_info_cache.ImageInfoCache() as cache:
+        def create_job(directory):
+            job_args = copy.copy(args)
+            job_args.images = [directory]
+            job_args.incremental = can_update_incrementally
+            job, exit_code = create_render_job(job_args, cache, directory)
+            if job is None:
+                # Reported on every change, so a directory that can't be rendered isn't skipped silently.
+                logger.error('{}: not rendered (exit code {}).'.format(directory, exit_code))
+            return job
+
+        watch_folder.watch_directories(
+            [os.path.abspath(directory) for directory in args.images],
+            create_job,
+            cancel_event,
+            max_workers=args.jobs or 1,
+            debounce_seconds=args.debounce,
+            maximum_delay_seconds=args.max_delay,
+            cache=cache,
+            status_callback=_log_job_status)
+    # Watching only ends when it is stopped (by SIGINT or SIGTERM), which is the normal way to end it.
+    logger.info('Stopped watching.')
+    return ExitCodes.success
+
+
+def _log_job_status(job):
+    if job.status == render_queue.JobStatuses.failed:
+        logger.error(job.get_status_message())
+    elif job.status != render_queue.JobStatuses.queued:
+        logger.info(job.get_status_message())
+
+
+def _handle_stop_signal(signal_number, frame):
+    if cancel_event.is_set():
+        # A second interrupt stops immediately.
+        raise KeyboardInterrupt()
+    logger.warning('Stopping...')
+    cancel_event.set()
+
+
+def main(argv=None):
+    parser = create_argument_parser()
+    try:
+        args = parser.parse_args(argv)
+    except ValueError as error:
+        parser.print_usage(sys.stderr)
+        print('{}: error: {}'.format(parser.prog, error), file=sys.stderr)
+        return ExitCodes.usage_error
+
+    numeric_log_level = getattr(logging, args.log_level.upper())
+    logging.basicConfig(format='[%(name)s] %(levelname)s: %(message)s', level=numeric_log_level)
+
+    signal.signal(signal.SIGINT, _handle_stop_signal)
+    signal.signal(signal.SIGTERM, _handle_stop_signal)
+
+    if args.profile:
+        profiling.enable()
+    try:
+        return run(parser, args)
+    finally:
+        if args.profile:
+            write_profile(args.profile)
+
+
+def run(parser, args):
+    """Runs the job, batch or watch that args describes.  Returns an exit code."""
+    if args.jobs is not None and not (args.batch or args.watch):
+        logger.error('--jobs requires --batch or --watch.')
+        return ExitCodes.usage_error
+    if args.watch:
+        if args.batch:
+            logger.error('--watch cannot be combined with --batch.')
+            return ExitCodes.usage_error
+        return run_watch(args)
+    if args.batch:
+        if args.images:
+            logger.error('Images cannot be combined with --batch.')
+            return ExitCodes.usage_error
+        if args.batch == '-':
+            return run_batch(parser, sys.stdin, args.jobs)
+        try:
+            with open(args.batch) as batch_file:
+                return run_batch(parser, batch_file, args.jobs)
+        except OSError as error:
+            logger.error(error)
+            return ExitCodes.usage_error
+
+    return run_job(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""
+Picks the subset of frames for a movie of a target duration, instead of encoding every frame.
+
+A movie of duration_seconds at frames_per_second shows duration_seconds * frames_per_second frames.
+When there are more frames than that, the subset is either evenly spaced through the sequence,
+or evenly spaced in time (by each frame's capture time), which keeps the pace steady when the capture interval varies.
+Only the selected frames are written to the encoder's list, so the encoder never decodes the others.
+"""
+import bisect
+import doctest
+import logging
+
+import image_helper
+
+
+logger = logging.getLogger(__name__)
+
+
+class FrameSpacings:
+    # Every n-th frame.
+    even = 'even'
+    # The frames closest to evenly spaced capture times.
+    timestamp = 'timestamp'
+
+
+FRAME_SPACINGS = [FrameSpacings.even, FrameSpacings.timestamp]
+DEFAULT_FRAME_SPACING = FrameSpacings.even
+
+
+def get_target_frame_count(duration_seconds, frames_per_second):
+    """
+    >>> get_target_frame_count(60, 24)
+    1440
+    >>> get_target_frame_count(0.01, 24)
+    1
+    """
+    return max(1, int(round(duration_seconds * frames_per_second)))
+
+
+def select_evenly_spaced_indexes(frame_count, target_count):
+    """Returns target_count indexes evenly spaced over range(frame_count), including the first and last.
+
+    >>> select_evenly_spaced_indexes(10, 4)
+    [0, 3, 6, 9]
+    >>> select_evenly_spaced_indexes(10, 1)
+    [0]
+    >>> select_evenly_spaced_indexes(3, 5)
+    [0, 1, 2]
+    """
+    if target_count >= frame_count:
+        return list(range(frame_count))
+    if target_count == 1:
+        return [0]
+    step = (frame_count - 1) / (target_count - 1)
+    return [int(round(index * step)) for index in range(target_count)]
+
+
+def select_timestamp_spaced_indexes(timestamps, target_count):
+    """Returns the indexes of the frames whose timestamps (which must be sorted) are closest to
+    target_count evenly spaced times from the first timestamp to the last.  A frame is never picked twice,
+    so fewer than target_count indexes are returned when the capture times are bunched up.
+
+    >>> select_timestamp_spaced_indexes([0, 1, 2, 3, 10, 11, 12, 20], 3)
+    [0, 4, 7]
+    >>> select_timestamp_spaced_indexes([5, 5, 5], 2)
+    [0, 2]
+    """
+    if target_count >= len(timestamps):
+        return list(range(len(timestamps)))
+    if target_count == 1:
+        return [0]
+
+    first_timestamp, last_timestamp = timestamps[0], timestamps[-1]
+    interval = (last_timestamp - first_timestamp) / (target_count - 1)
+    if interval == 0:
+        return select_evenly_spaced_indexes(len(timestamps), target_count)
+
+    indexes = []
+    for target_index in range(target_count):
+        target_timestamp = first_timestamp + target_index * interval
+        index = bisect.bisect_left(timestamps, target_timestamp)
+        if index > 0 and (index == len(timestamps) or
+                          target_timestamp - timestamps[index - 1] <= timestamps[index] - target_timestamp):
+            index -= 1
+        if not indexes or index != indexes[-1]:
+            indexes.append(index)
+    return indexes
+
+
+def get_frame_timestamps(image_file_names):
+    """Returns the capture time of each frame, in seconds: the EXIF capture time,
+    or the file modification time for frames without one (see image_helper.get_capture_times).
+    Frames that can't be read get the time of the nearest frame that can (see _fill_missing_timestamps).
+    """
+    return _fill_missing_timestamps(image_helper.get_capture_times(image_file_names))
+
+
+def decimate_images(image_file_names, duration_seconds, frames_per_second, spacing=DEFAULT_FRAME_SPACING):
+    """Returns the frames of image_file_names (in order) to use for a movie lasting duration_seconds
+    at frames_per_second.  All of the frames are returned if there aren't more than that.
+    """
+    target_count = get_target_frame_count(duration_seconds, frames_per_second)
+    if target_count >= len(image_file_names):
+        return image_file_names
+
+    if spacing == FrameSpacings.even:
+        indexes = select_evenly_spaced_indexes(len(image_file_names), target_count)
+    elif spacing == FrameSpacings.timestamp:
+        # The frames stay in their original order; the timestamps only choose between them.
+        timestamps = _get_running_maximum(get_frame_timestamps(image_file_names))
+        indexes = select_timestamp_spaced_indexes(timestamps, target_count)
+    else:
+        raise ValueError("Unknown frame spacing '{}'.".format(spacing))
+
+    logger.info('Using {} of {} frames for a {}-second movie.'.format(len(indexes), len(image_file_names), duration_seconds))
+    return [image_file_names[index] for index in indexes]
+
+
+def _fill_missing_timestamps(timestamps):
+    """Replaces each None in timestamps with the timestamp of the frame before it, or for the first frames,
+    of the first frame that has one.  A frame without a time then doesn't stretch the span of the sequence
+    (e.g. back to 1970 with a time of 0).  Returns all 0's if no frame has a time.
+
+    >>> _fill_missing_timestamps([None, None, 100, None, 160])
+    [100, 100, 100, 100, 160]
+    >>> _fill_missing_timestamps([None, None])
+    [0, 0]
+    """
+    previous_timestamp = next((timestamp for timestamp in timestamps if timestamp is not None), 0)
+    filled_timestamps = []
+    for timestamp in timestamps:
+        if timestamp is None:
+            timestamp = previous_timestamp
+        filled_timestamps.append(timestamp)
+        previous_timestamp = timestamp
+    return filled_timestamps
+
+
+def _get_running_maximum(values):
+    """Makes values non-decreasing, so that an out-of-order timestamp doesn't break the search.
+
+    >>> _get_running_maximum([1, 3, 2, 4])
+    [1, 3, 3, 4]
+    """
+    running_maximum = []
+    for value in values:
+        running_maximum.append(max(value, running_maximum[-1]) if running_maximum else value)
+    return running_maximum
+
+if __name__ == '__main__':
+    doctest.testmod()
@@ -0,0 +1,163 @@
+"""
+Drops duplicate and near-duplicate frames (e.g. the long runs of identical frames a fixed camera takes overnight),
+so that they don't cost encoding time or output size.
+
+Each frame is reduced to a 64-bit perceptual hash (dHash or aHash) of a tiny grayscale thumbnail,
+computed with NumPy in a process pool.  A frame is dropped when the Hamming distance between its hash
+and the hash of the previous kept frame is below a threshold.
+
+Pillow and NumPy are optional; without them, is_available returns False.
+"""
+import concurrent.futures
+import doctest
+import logging
+
+import encoder_process
+
+# Pillow and NumPy are optional.
+try:
+    from PIL import Image
+    import numpy
+except ImportError:
+    Image = None
+    numpy = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class HashMethods:
+    # Compares each pixel with its right-hand neighbor: robust to exposure changes.
+    dhash = 'dhash'
+    # Compares each pixel with the mean.
+    ahash = 'ahash'
+
+
+HASH_METHODS = [HashMethods.dhash, HashMethods.ahash]
+DEFAULT_HASH_METHOD = HashMethods.dhash
+
+# The hashes are HASH_SIZE x HASH_SIZE bits.
+HASH_SIZE = 8
+
+# Frames whose hash differs from the previous kept frame's in fewer bits than this are dropped.
+# Sensor noise flips a bit or two between otherwise identical frames.
+DEFAULT_THRESHOLD = 3
+
+# How many frames each call into a worker process hashes.  Hashing a frame is quick, so the batches are large.
+_BATCH_SIZE = 64
+
+
+def is_available():
+    return Image is not None and numpy is not None
+
+
+def get_hash_from_pixels(pixels, method=DEFAULT_HASH_METHOD):
+    """Returns the perceptual hash of pixels, a 2D NumPy array of grayscale values, as an int.
+    For dHash, pixels must be HASH_SIZE rows of HASH_SIZE + 1 columns; for aHash, HASH_SIZE x HASH_SIZE.
+
+    >>> gradient = numpy.tile(numpy.arange(HASH_SIZE + 1), (HASH_SIZE, 1))
+    >>> hex(get_hash_from_pixels(gradient))
+    '0xffffffffffffffff'
+    >>> get_hash_from_pixels(gradient[:, ::-1])
+    0
+    >>> hex(get_hash_from_pixels(gradient[:, :HASH_SIZE], HashMethods.ahash))
+    '0xf0f0f0f0f0f0f0f'
+    """
+    if method == HashMethods.dhash:
+        bits = pixels[:, 1:] > pixels[:, :-1]
+    elif method == HashMethods.ahash:
+        bits = pixels > pixels.mean()
+    else:
+        raise ValueError("Unknown hash method '{}'.".format(method))
+    return int.from_bytes(numpy.packbits(bits).tobytes(), 'big')
+
+
+def get_image_hash(image_file_name, method=DEFAULT_HASH_METHOD):
+    """Returns the perceptual hash of the image in image_file_name as an int."""
+    thumbnail_size = (HASH_SIZE + 1, HASH_SIZE) if method == HashMethods.dhash else (HASH_SIZE, HASH_SIZE)
+    with Image.open(image_file_name) as image:
+        # Let the JPEG decoder skip the detail that is about to be thrown away (it decodes at up to 1/8 scale).
+        image.draft('L', (thumbnail_size[0] * 8, thumbnail_size[1] * 8))
+        thumbnail = image.convert('L').resize(thumbnail_size, _get_box_resample())
+    return get_hash_from_pixels(numpy.asarray(thumbnail, dtype=numpy.int16), method)
+
+
+def get_hamming_distance(hash1, hash2):
+    """
+    >>> get_hamming_distance(0b1011, 0b0001)
+    2
+    """
+    return bin(hash1 ^ hash2).count('1')
+
+
+def select_distinct_frames(hashes, threshold=DEFAULT_THRESHOLD):
+    """Returns the indexes of the frames to keep: the first frame, and every frame whose hash is at least threshold bits
+    away from the hash of the previous kept frame.
+    Comparing with the previous kept frame (rather than the previous frame) stops a slow drift from being dropped entirely.
+
+    >>> select_distinct_frames([0b0000, 0b0001, 0b0011, 0b0111, 0b0111], threshold=2)
+    [0, 2]
+    >>> select_distinct_frames([5, 5, 5], threshold=0)
+    [0, 1, 2]
+    """
+    kept_indexes = []
+    kept_hash = None
+    for index, frame_hash in enumerate(hashes):
+        if kept_hash is None or get_hamming_distance(frame_hash, kept_hash) >= threshold:
+            kept_indexes.append(index)
+            kept_hash = frame_hash
+    return kept_indexes
+
+
+def deduplicate_images(image_file_names, threshold=DEFAULT_THRESHOLD, method=DEFAULT_HASH_METHOD, max_workers=None, cancel_event=None):
+    """Hashes image_file_names in a process pool (with max_workers processes, default: the number of cores)
+    and returns (kept-image-file-names, error-message).  The kept image file names are in their original order,
+    and are empty on failure.
+    Setting cancel_event (a threading.Event) stops hashing.
+    """
+    if not is_available():
+        return [], 'Dropping duplicate frames requires Pillow and NumPy (pip install Pillow numpy).'
+    if method not in HASH_METHODS:
+        raise ValueError("Unknown hash method '{}'.".format(method))
+
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+    futures = [
+        executor.submit(_hash_image_batch, image_file_names[start:start + _BATCH_SIZE], method)
+        for start in range(0, len(image_file_names), _BATCH_SIZE)]
+
+    hashes = []
+    try:
+        for future in futures:
+            for frame_hash, error_message in future.result():
+                if error_message:
+                    return [], error_message
+                hashes.append(frame_hash)
+            if encoder_process.is_cancelled(cancel_event):
+                return [], 'Cancelled.'
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    kept_image_file_names = [image_file_names[index] for index in select_distinct_frames(hashes, threshold)]
+    logger.info('Dropped {} of {} frames as duplicates.'.format(
+        len(image_file_names) - len(kept_image_file_names),
+        len(image_file_names)))
+    return kept_image_file_names, ''
+
+
+def _hash_image_batch(image_file_names, method):
+    """Runs in a worker process.  Returns a list of (hash, error-message)."""
+    results = []
+    for image_file_name in image_file_names:
+        try:
+            results.append((get_image_hash(image_file_name, method), ''))
+        except (OSError, ValueError) as error:
+            results.append((None, "Unable to hash '{}': {}".format(image_file_name, error)))
+    return results
+
+
+def _get_box_resample():
+    # Pillow 9.1 moved the filters into the Image.Resampling enum.
+    return getattr(Image, 'Resampling', Image).BOX
+
+if __name__ == '__main__':
+    doctest.testmod()
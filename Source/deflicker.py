@@ -0,0 +1,208 @@
+"""
+Removes auto-exposure flicker while the frames stream into the encoder.
+
+The brightness of each frame is measured (with NumPy, on a downsampled copy) in a process pool,
+smoothed with a rolling mean over a window of neighboring frames, and each frame is then scaled by
+the gain that brings it to the smoothed brightness.
+The corrected frames are produced by the process pool a few at a time and piped straight to the encoder's stdin,
+so memory use doesn't depend on the length of the sequence and no corrected copy of the frames is written to disk.
+
+Pillow and NumPy are optional; without them, is_available returns False.
+"""
+import collections
+import concurrent.futures
+import doctest
+import io
+import logging
+import os
+
+import encoder_process
+import encoders
+import image_helper
+
+# Pillow and NumPy are optional.
+try:
+    from PIL import Image
+    import numpy
+except ImportError:
+    Image = None
+    numpy = None
+
+
+logger = logging.getLogger(__name__)
+
+# The number of frames that each frame's brightness is averaged over.  Odd, so that the window is centered.
+DEFAULT_WINDOW_SIZE = 15
+
+# Limits the correction, so that a frame that is much darker or brighter than its neighbors
+# (e.g. a lights-on moment) isn't blown out or crushed.
+_MINIMUM_GAIN = 0.5
+_MAXIMUM_GAIN = 2.0
+
+# The brightness is measured on a copy decoded at (at least) this size.
+_MEASURE_SIZE = (64, 64)
+
+# Frames are measured in batches, to amortize the cost of the inter-process calls.
+_MEASURE_BATCH_SIZE = 64
+
+_JPEG_QUALITY = 95
+_PNG_COMPRESS_LEVEL = 1
+
+
+def is_available():
+    return Image is not None and numpy is not None
+
+
+def get_frame_brightness(image_file_name):
+    """Returns the mean gray level (0-255) of the image in image_file_name."""
+    with Image.open(image_file_name) as image:
+        # Let the JPEG decoder skip detail that doesn't affect the mean (it decodes at up to 1/8 scale).
+        image.draft('L', _MEASURE_SIZE)
+        image.thumbnail(_MEASURE_SIZE)
+        return float(numpy.asarray(image.convert('L'), dtype=numpy.float32).mean())
+
+
+def get_gains(brightnesses, window_size=DEFAULT_WINDOW_SIZE):
+    """Returns the gain for each frame: the rolling mean of brightnesses over window_size frames
+    (centered on the frame, and using the nearest frames at the ends) divided by the frame's brightness.
+
+    >>> [round(gain, 2) for gain in get_gains([100, 120, 100, 120, 100], window_size=3)]
+    [1.07, 0.89, 1.13, 0.89, 1.07]
+    >>> [round(gain, 2) for gain in get_gains([100, 100, 100], window_size=15)]
+    [1.0, 1.0, 1.0]
+    >>> get_gains([100, 100, 100], window_size=-3)
+    Traceback (most recent call last):
+    ...
+    ValueError: The deflicker window must be at least 1 frame, not -3.
+    """
+    _check_window_size(window_size)
+    brightnesses = numpy.asarray(brightnesses, dtype=numpy.float64)
+    half_window = window_size // 2
+    padded_brightnesses = numpy.pad(brightnesses, half_window, mode='edge')
+    window = numpy.ones(2 * half_window + 1) / (2 * half_window + 1)
+    smoothed_brightnesses = numpy.convolve(padded_brightnesses, window, mode='valid')
+    # Black frames have no brightness to correct.
+    gains = numpy.divide(
+        smoothed_brightnesses,
+        brightnesses,
+        out=numpy.ones_like(brightnesses),
+        where=brightnesses > 0)
+    return numpy.clip(gains, _MINIMUM_GAIN, _MAXIMUM_GAIN).tolist()
+
+
+def _check_window_size(window_size):
+    if window_size < 1:
+        raise ValueError('The deflicker window must be at least 1 frame, not {}.'.format(window_size))
+
+
+def measure_brightnesses(image_file_names, executor, cancel_event=None):
+    """Returns the brightness of each of image_file_names, measured in executor (a concurrent.futures.Executor).
+    Setting cancel_event (a threading.Event) stops measuring, and returns None.
+    """
+    futures = [
+        executor.submit(_measure_brightness_batch, image_file_names[start:start + _MEASURE_BATCH_SIZE])
+        for start in range(0, len(image_file_names), _MEASURE_BATCH_SIZE)]
+    brightnesses = []
+    try:
+        for future in futures:
+            brightnesses.extend(future.result())
+            if encoder_process.is_cancelled(cancel_event):
+                return None
+    finally:
+        for future in futures:
+            future.cancel()
+    return brightnesses
+
+
+def _measure_brightness_batch(image_file_names):
+    """Runs in a worker process."""
+    return [get_frame_brightness(image_file_name) for image_file_name in image_file_names]
+
+
+def iterate_deflickered_images(image_file_names, gains, executor, max_pending_count):
+    """Yields the encoded bytes of each of image_file_names with its gain applied, in order.
+    The frames are corrected in executor, with at most max_pending_count in flight (or waiting to be yielded) at once.
+    """
+    pending_futures = collections.deque()
+    try:
+        for image_file_name, gain in zip(image_file_names, gains):
+            pending_futures.append(executor.submit(apply_gain, image_file_name, gain))
+            if len(pending_futures) >= max_pending_count:
+                yield pending_futures.popleft().result()
+        while pending_futures:
+            yield pending_futures.popleft().result()
+    finally:
+        for future in pending_futures:
+            future.cancel()
+
+
+def apply_gain(image_file_name, gain):
+    """Returns the encoded bytes (with the same encoding) of the image in image_file_name, with its color values
+    multiplied by gain.  Runs in a worker process.
+    """
+    with Image.open(image_file_name) as image:
+        image_format = image.format
+        if image.mode not in ('RGB', 'RGBA', 'L'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        # A lookup table is much faster than multiplying every pixel.
+        table = numpy.clip(numpy.arange(256) * gain + 0.5, 0, 255).astype(numpy.uint8).tolist()
+        color_band_count = 1 if image.mode == 'L' else 3
+        identity_table = list(range(256)) * (len(image.getbands()) - color_band_count)
+        corrected_image = image.point(table * color_band_count + identity_table)
+
+    output = io.BytesIO()
+    if image_format == 'JPEG':
+        corrected_image.save(output, 'JPEG', quality=_JPEG_QUALITY)
+    else:
+        corrected_image.save(output, 'PNG', compress_level=_PNG_COMPRESS_LEVEL)
+    return output.getvalue()
+
+
+def create_movie_from_images(image_file_names, frames_per_second, width=None, height=None, window_size=DEFAULT_WINDOW_SIZE, encoder=None, max_workers=None, progress_callback=None, cancel_event=None, movie_path=None):
+    """Same as EncoderBackend.create_movie_from_images, but removes flicker from the frames as they are encoded.
+    window_size is the number of frames that the brightness is smoothed over.
+    max_workers is the number of worker processes (default: the number of cores).
+    encoder is the encoders.EncoderBackend to use (default: encoders.get_encoder()).
+    Returns the path to the created movie or None on failure.
+    Raises ValueError if window_size is less than 1.
+    """
+    _check_window_size(window_size)
+    if not is_available():
+        logger.error('Deflickering requires Pillow and NumPy (pip install Pillow numpy).')
+        return
+
+    encoder = encoder or encoders.get_encoder()
+    image_encoding, error_message = image_helper.get_image_encoding_from_file_names(image_file_names)
+    if image_encoding == image_helper.ImageEncoding.unknown:
+        logger.error(error_message)
+        return
+
+    max_workers = max_workers or os.cpu_count() or 1
+    movie_path = movie_path or encoder.get_default_movie_path(os.path.dirname(image_file_names[0]))
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        try:
+            brightnesses = measure_brightnesses(image_file_names, executor, cancel_event)
+        except (OSError, ValueError) as error:
+            logger.error('Unable to measure the frame brightness: {}'.format(error))
+            return
+        if brightnesses is None:
+            logger.info('Cancelled.')
+            return
+        gains = get_gains(brightnesses, window_size)
+        logger.info('Deflickering {} frames (gains {:.2f} to {:.2f}).'.format(len(gains), min(gains), max(gains)))
+
+        return encoder.create_movie_from_image_stream(
+            iterate_deflickered_images(image_file_names, gains, executor, max_pending_count=2 * max_workers),
+            image_encoding,
+            frames_per_second,
+            movie_path,
+            width,
+            height,
+            output_line_handler=encoders.get_output_line_handler(len(image_file_names), progress_callback),
+            cancel_event=cancel_event)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+if __name__ == '__main__':
+    doctest.testmod()
@@ -1,5 +1,6 @@
 import doctest
 import os
+import sys
 
 # The BUILD_CONSTANTS module only exists when using cx_Freeze.
 try:
@@ -27,5 +28,19 @@ def get_external_directory():
 def get_resources_directory():
     return os.path.join(get_root_directory(), 'Resources')
 
+
+def get_user_cache_directory():
+    """Returns the per-user directory for TimeLapse's caches.  It is created if it doesn't exist."""
+    if sys.platform == 'win32':
+        base_directory = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    elif sys.platform == 'darwin':
+        base_directory = os.path.expanduser('~/Library/Caches')
+    else:
+        base_directory = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+
+    cache_directory = os.path.join(base_directory, 'TimeLapse')
+    os.makedirs(cache_directory, exist_ok=True)
+    return cache_directory
+
 if __name__ == '__main__':
     doctest.testmod()
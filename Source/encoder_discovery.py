@@ -0,0 +1,204 @@
+"""
+Finds the encoder executables, and finds out what they can do by running them once.
+
+An executable is looked for in the given directories (e.g. the bundled External/mplayer tree) and then on the PATH;
+the result is remembered for the rest of the process.
+What an executable can do (its video codecs, and which of them can use several threads) is found by running it with
+a probe, e.g. ffmpeg -encoders.  The results are kept in encoders.json in the user cache directory,
+keyed by the executable's path, size and modification time, so the probe is only run again when the executable
+is replaced or upgraded, and later launches don't run it at all.
+"""
+import collections
+import doctest
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+
+import directories
+import profiling
+
+
+logger = logging.getLogger(__name__)
+
+# What an encoder executable can do.  video_codecs and threaded_video_codecs are sorted lists of codec names,
+# as the encoder names them; threaded_video_codecs are the ones that can encode with several threads.
+# Only video_codecs comes from the executable itself: an encoder that can't list which codecs take a threads option
+# (e.g. MEncoder) reports the ones it has that are documented to take one.
+EncoderCapabilities = collections.namedtuple('EncoderCapabilities', ['path', 'video_codecs', 'threaded_video_codecs'])
+
+# Bump this whenever the format of the cache file or the meaning of the probe results changes.
+# Cache files with a different version are ignored (and replaced).
+_CACHE_VERSION = 1
+
+_PROBE_TIMEOUT_SECONDS = 30
+
+_lock = threading.Lock()
+# (file name, directories, PATH) -> the path found by find_executable
+_executable_paths = {}
+# (path, size, modification time) -> EncoderCapabilities (or None if the probe failed), for this process.
+_capabilities_by_key = {}
+# path -> the lock held while finding out what the executable at path can do
+_probe_locks = {}
+# Held while updating the cache file, which has the entries of every executable.
+_cache_file_lock = threading.Lock()
+
+
+def get_default_cache_path():
+    return os.path.join(directories.get_user_cache_directory(), 'encoders.json')
+
+
+def find_executable(file_name, search_directories=()):
+    """Returns the path to the executable file_name in the first of search_directories that has it,
+    or else on the PATH, or None if there isn't one.  The result is remembered for the rest of the process.
+
+    >>> find_executable('no-such-encoder', [os.path.dirname(os.path.abspath(__file__))]) is None
+    True
+    """
+    key = (file_name, tuple(search_directories), os.environ.get('PATH'))
+    with _lock:
+        if key in _executable_paths:
+            return _executable_paths[key]
+
+    path = None
+    for directory in search_directories:
+        candidate_path = os.path.join(directory, file_name)
+        if os.path.isfile(candidate_path) and os.access(candidate_path, os.X_OK):
+            path = candidate_path
+            break
+    else:
+        path = shutil.which(file_name)
+
+    if path:
+        logger.debug("Found '{}' at '{}'.".format(file_name, path))
+    with _lock:
+        _executable_paths[key] = path
+    return path
+
+
+def get_capabilities(path, probe, cache_path=None):
+    """Returns the EncoderCapabilities of the executable at path, or None if it can't be run.
+
+    probe is called with path, and returns (video-codecs, threaded-video-codecs), or None if the executable
+    couldn't be run.  It is only called when the executable hasn't been probed since it last changed.
+    cache_path is the JSON file the results are kept in (default: get_default_cache_path()).
+
+    >>> import tempfile
+    >>> temporary_directory = tempfile.TemporaryDirectory()
+    >>> path = os.path.join(temporary_directory.name, 'encoder')
+    >>> with open(path, 'w') as encoder_file:
+    ...     _ = encoder_file.write('#!/bin/sh')
+    >>> cache_path = os.path.join(temporary_directory.name, 'encoders.json')
+    >>> def probe(path):
+    ...     print('Probing.')
+    ...     return ['mpeg4', 'libx264'], ['libx264']
+    >>> get_capabilities(path, probe, cache_path).video_codecs
+    Probing.
+    ['libx264', 'mpeg4']
+
+    The next launch reads the results from the cache, until the executable changes.
+    >>> _capabilities_by_key.clear()
+    >>> get_capabilities(path, probe, cache_path).threaded_video_codecs
+    ['libx264']
+    >>> os.utime(path, ns=(0, 0))
+    >>> get_capabilities(path, probe, cache_path).threaded_video_codecs
+    Probing.
+    ['libx264']
+    >>> temporary_directory.cleanup()
+    """
+    path = os.path.abspath(path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = (path, stat.st_size, stat.st_mtime_ns)
+
+    with _lock:
+        if key in _capabilities_by_key:
+            return _capabilities_by_key[key]
+        probe_lock = _probe_locks.setdefault(path, threading.Lock())
+
+    # Only this executable's lock is held while probing, so that several renders starting at once don't all run
+    # the probe, without holding up the lookups of other executables for as long as the probe takes.
+    with probe_lock:
+        with _lock:
+            if key in _capabilities_by_key:
+                return _capabilities_by_key[key]
+
+        cache_path = cache_path or get_default_cache_path()
+        entry = _read_cache(cache_path).get(path)
+        if entry and entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns:
+            capabilities = EncoderCapabilities(path, entry['video_codecs'], entry['threaded_video_codecs'])
+        else:
+            with profiling.span('probe_encoder', path=path):
+                probe_result = probe(path)
+            capabilities = None
+            if probe_result is not None:
+                video_codecs, threaded_video_codecs = probe_result
+                capabilities = EncoderCapabilities(path, sorted(video_codecs), sorted(threaded_video_codecs))
+                _add_cache_entry(cache_path, path, stat, capabilities)
+
+        with _lock:
+            _capabilities_by_key[key] = capabilities
+        return capabilities
+
+
+def run_probe_command(command):
+    """Runs command (e.g. [ffmpeg_path, '-encoders']) and returns its output (stdout and stderr),
+    or None if it couldn't be run.  The exit status is ignored, since some encoders exit with an error
+    after printing help.
+    """
+    try:
+        completed_process = subprocess.run(
+            command,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=_PROBE_TIMEOUT_SECONDS)
+    except (OSError, subprocess.SubprocessError) as error:
+        logger.warning("Unable to run '{}': {}".format(command[0], error))
+        return None
+    return completed_process.stdout.decode(errors='replace')
+
+
+def _add_cache_entry(cache_path, path, stat, capabilities):
+    # Read the cache again, since other executables may have been probed since it was read.
+    with _cache_file_lock:
+        entries = _read_cache(cache_path)
+        entries[path] = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'video_codecs': capabilities.video_codecs,
+            'threaded_video_codecs': capabilities.threaded_video_codecs,
+        }
+        # Forget executables that have been removed (e.g. the benchmarks' temporary stand-in encoders).
+        entries = {entry_path: entry for entry_path, entry in entries.items() if os.path.exists(entry_path)}
+        _write_cache(cache_path, entries)
+
+
+def _read_cache(cache_path):
+    """Returns the cached entries (path -> entry), or {} if there isn't a usable cache."""
+    try:
+        with open(cache_path) as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict) or cache.get('version') != _CACHE_VERSION:
+        return {}
+    entries = cache.get('encoders')
+    return entries if isinstance(entries, dict) else {}
+
+
+def _write_cache(cache_path, entries):
+    temporary_cache_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+    try:
+        with open(temporary_cache_path, 'w') as cache_file:
+            json.dump({'version': _CACHE_VERSION, 'encoders': entries}, cache_file, indent=1, sort_keys=True)
+        os.replace(temporary_cache_path, cache_path)
+    except OSError as error:
+        logger.warning("Unable to write the encoder cache '{}': {}".format(cache_path, error))
+
+if __name__ == '__main__':
+    doctest.testmod()
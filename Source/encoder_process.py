@@ -0,0 +1,235 @@
+"""
+Runs encoder processes (MEncoder, ffmpeg) and collects their output.
+"""
+import collections
+import contextlib
+import doctest
+import logging
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+def run_encoder_command(command, cwd=None, input_chunks=None, output_line_handler=None, cancel_event=None):
+    """command is a list of the executable and its arguments.
+    Returns the process' exit code.
+
+    input_chunks is an optional iterable of bytes that are written to the process' stdin while it runs.
+    If reading input_chunks raises, the failure is logged and a non-zero exit code is returned.
+
+    The process' output is read line by line while it runs (treating carriage returns as line breaks,
+    since encoders redraw their status line with them) and passed to output_line_handler, if given.
+    Only the last few lines are kept, so memory use doesn't grow with the length of the encode.
+
+    cancel_event is an optional threading.Event.  When it is set, the process and any children it started
+    are terminated and CANCELLED_EXIT_CODE is returned.
+    """
+    logger.debug(command)
+    logger.debug(' '.join(command))
+
+    stdin = subprocess.PIPE if input_chunks is not None else subprocess.DEVNULL
+    process = subprocess.Popen(command, cwd=cwd, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **_get_process_group_options())
+
+    input_errors = []
+    input_thread = None
+    if input_chunks is not None:
+        input_thread = threading.Thread(target=_write_process_input, args=(process, input_chunks, input_errors))
+        input_thread.start()
+
+    if cancel_event is not None:
+        threading.Thread(target=_terminate_process_when_cancelled, args=(process, cancel_event), daemon=True).start()
+
+    # Read the output while the input is being written, so that neither pipe can fill up and block the process.
+    last_lines = collections.deque(maxlen=_LAST_OUTPUT_LINE_COUNT)
+    try:
+        for line in _read_lines(process.stdout):
+            last_lines.append(line)
+            logger.debug(line)
+            if output_line_handler:
+                output_line_handler(line)
+    except BaseException:
+        # E.g. KeyboardInterrupt.  The process is in its own process group, so it wouldn't get the interrupt itself.
+        terminate_process_tree(process)
+        raise
+    finally:
+        if input_thread:
+            input_thread.join()
+        return_code = process.wait()
+
+    if is_cancelled(cancel_event):
+        logger.info('Cancelled {}.'.format(command[0]))
+        return CANCELLED_EXIT_CODE
+
+    if return_code != 0:
+        logger.info('Last output:\n{}'.format('\n'.join(last_lines)))
+    if input_errors:
+        logger.error('Failed to read the input images: {}'.format(input_errors[0]))
+        if return_code == 0:
+            return_code = 1
+    return return_code
+
+
+# Returned by run_encoder_command when the encode is cancelled (the usual exit code for SIGINT).
+CANCELLED_EXIT_CODE = 130
+
+# How often a running process checks whether it has been cancelled.
+_CANCEL_POLL_INTERVAL_SECONDS = 0.1
+
+# How long a terminated process has to exit before it is killed.
+_TERMINATE_TIMEOUT_SECONDS = 0.5
+
+
+def is_cancelled(cancel_event):
+    return cancel_event is not None and cancel_event.is_set()
+
+
+@contextlib.contextmanager
+def chain_cancel_event(cancel_event):
+    """Returns a context manager giving a new threading.Event that is set when cancel_event (which may be None) is.
+    The new event can also be set on its own, e.g. to stop the other encoders when one of them fails,
+    without cancelling the caller.  cancel_event is watched until the context exits.
+
+    >>> cancel_event = threading.Event()
+    >>> with chain_cancel_event(cancel_event) as chained_cancel_event:
+    ...     cancel_event.set()
+    ...     chained_cancel_event.wait(5)
+    True
+    >>> with chain_cancel_event(None) as chained_cancel_event:
+    ...     chained_cancel_event.set()
+    ...     cancel_event.clear()
+    >>> cancel_event.is_set()
+    False
+    """
+    chained_cancel_event = threading.Event()
+    finished_event = threading.Event()
+    if cancel_event is not None:
+        threading.Thread(
+            target=_set_when_cancelled,
+            args=(cancel_event, chained_cancel_event, finished_event),
+            daemon=True).start()
+    try:
+        yield chained_cancel_event
+    finally:
+        finished_event.set()
+
+
+def _set_when_cancelled(cancel_event, chained_cancel_event, finished_event):
+    while not finished_event.is_set():
+        if cancel_event.wait(_CANCEL_POLL_INTERVAL_SECONDS):
+            chained_cancel_event.set()
+            return
+
+
+def remove_outputs_if_cancelled(cancel_event, *file_names):
+    """Removes the partial outputs of a cancelled encode.  Returns whether it was cancelled."""
+    if not is_cancelled(cancel_event):
+        return False
+    for file_name in file_names:
+        try:
+            os.remove(file_name)
+        except OSError:
+            pass
+    return True
+
+
+def _get_process_group_options():
+    """Starts encoders in their own process group, so that the whole tree can be terminated together."""
+    if sys.platform == 'win32':
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        return {'start_new_session': True}
+
+
+def _terminate_process_when_cancelled(process, cancel_event):
+    while process.poll() is None:
+        if cancel_event.wait(_CANCEL_POLL_INTERVAL_SECONDS):
+            terminate_process_tree(process)
+            return
+
+
+def terminate_process_tree(process):
+    """Terminates process and all of its children, killing them if they don't exit promptly."""
+    if process.poll() is not None:
+        return
+
+    logger.debug('Terminating process {}.'.format(process.pid))
+    if sys.platform == 'win32':
+        subprocess.run(
+            ['taskkill', '/F', '/T', '/PID', str(process.pid)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL)
+        return
+
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    try:
+        process.wait(_TERMINATE_TIMEOUT_SECONDS)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+# The number of lines of output kept to log when the process fails.
+_LAST_OUTPUT_LINE_COUNT = 20
+
+_READ_SIZE = 64 * 1024
+
+_LINE_BREAK_PATTERN = re.compile(br'[\r\n]+')
+
+
+def _read_lines(stream):
+    """Yields the non-blank lines of text in the binary stream as they arrive.
+    Lines are split on carriage returns as well as newlines, and are truncated to _READ_SIZE bytes.
+
+    >>> import io
+    >>> list(_read_lines(io.BytesIO(b'Pos: 1f\\rPos: 2f\\r\\nDone\\n')))
+    ['Pos: 1f', 'Pos: 2f', 'Done']
+    """
+    partial_line = b''
+    while True:
+        data = stream.read1(_READ_SIZE)
+        if not data:
+            break
+        lines = _LINE_BREAK_PATTERN.split(partial_line + data)
+        partial_line = lines.pop()[-_READ_SIZE:]
+        for line in lines:
+            if line:
+                yield line.decode(errors='replace')
+    if partial_line:
+        yield partial_line.decode(errors='replace')
+
+
+def _write_process_input(process, input_chunks, errors):
+    """Writes each of input_chunks to the process' stdin, then closes it.
+    Exceptions from reading input_chunks are appended to errors.
+    If input_chunks is a generator, it is closed (so that it can release its resources) even if it wasn't used up.
+    """
+    try:
+        for chunk in input_chunks:
+            process.stdin.write(chunk)
+    except (BrokenPipeError, ConnectionResetError):
+        # The process exited early; its exit code reports the failure.
+        pass
+    except Exception as error:
+        errors.append(error)
+    finally:
+        close_input_chunks = getattr(input_chunks, 'close', None)
+        if close_input_chunks:
+            close_input_chunks()
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+
+if __name__ == '__main__':
+    doctest.testmod()
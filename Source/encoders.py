@@ -0,0 +1,243 @@
+"""
+Encoder backends that turn a list of images into a movie.
+
+Every backend has the same interface, so callers can use whichever is fastest on the current machine:
+    backend = encoders.get_encoder()
+    movie_path = backend.create_movie_from_images(image_file_names, frames_per_second, width, height)
+"""
+import copy
+import doctest
+import logging
+import os
+
+import ffmpeg
+import image_helper
+import mencoder
+import progress
+
+
+logger = logging.getLogger(__name__)
+
+
+class EncoderBackend:
+    """Base class for encoder backends.  Subclasses implement every method that raises NotImplementedError."""
+
+    name = None
+    movie_file_extension = None
+    # The most threads each encoder process may use, or None to let the encoder decide.
+    # Set it (with with_thread_count) when several encoders run at once, so together they don't use more threads
+    # than there are cores.  It doesn't change the movie.
+    thread_count = None
+
+    def is_available(self):
+        raise NotImplementedError()
+
+    def with_thread_count(self, thread_count):
+        """Returns a copy of this backend whose encoder processes use at most thread_count threads.
+
+        >>> encoder = MEncoderBackend().with_thread_count(2)
+        >>> encoder.thread_count, MEncoderBackend().thread_count
+        (2, None)
+        """
+        encoder = copy.copy(self)
+        encoder.thread_count = thread_count
+        return encoder
+
+    def get_options(self):
+        """Returns the options that change the movie this backend creates (e.g. the video codec), as a dict.
+
+        >>> FFmpegBackend('libx264', 'fast').with_thread_count(2).get_options()
+        {'preset': 'fast', 'video_codec': 'libx264'}
+        """
+        return {name: value for name, value in sorted(vars(self).items()) if name != 'thread_count'}
+
+    def create_movie_from_images(self, image_file_names, frames_per_second, width=None, height=None, progress_callback=None, cancel_event=None, movie_path=None, working_directory=None):
+        """image_file_names should be a list of images whose length is at least 1.
+        The movie is created at movie_path (default: the default movie path in the directory of the first image).
+        Intermediate files are written to working_directory (default: the directory of the first image).
+        progress_callback is optionally called with progress.Progress reports while encoding (on another thread).
+        Setting cancel_event (a threading.Event) stops the encode and removes its partial outputs.
+        Returns the path to the created movie or None on failure.
+        """
+        image_encoding, error_message = image_helper.get_image_encoding_from_file_names(image_file_names)
+        if image_encoding == image_helper.ImageEncoding.unknown:
+            logger.error(error_message)
+            return
+
+        input_directory = os.path.dirname(image_file_names[0])
+        return self.encode_images_to_movie(
+            image_file_names,
+            frames_per_second,
+            image_encoding,
+            movie_path or self.get_default_movie_path(input_directory),
+            os.path.join(working_directory or input_directory, 'FileNames.txt'),
+            width,
+            height,
+            output_line_handler=get_output_line_handler(len(image_file_names), progress_callback),
+            cancel_event=cancel_event)
+
+    def get_default_movie_path(self, directory, base_name='TimeLapse'):
+        return os.path.join(directory, base_name + self.movie_file_extension)
+
+    def encode_images_to_movie(self, image_file_names, frames_per_second, image_encoding, movie_path, file_name_list_file_name, width=None, height=None, output_line_handler=None, cancel_event=None):
+        """output_line_handler is optionally called with each line of the encoder's output while it runs.
+        Setting cancel_event (a threading.Event) stops the encode and removes its partial outputs.
+        """
+        raise NotImplementedError()
+
+    def create_movie_from_image_stream(self, image_datas, image_encoding, frames_per_second, movie_path, width=None, height=None, output_line_handler=None, cancel_event=None):
+        raise NotImplementedError()
+
+    def concatenate_movies(self, movie_paths, output_movie_path, cancel_event=None):
+        raise NotImplementedError()
+
+
+class MEncoderBackend(EncoderBackend):
+    """The bundled MEncoder, encoding MPEG-4 Part 2 into AVI."""
+
+    name = 'mencoder'
+    movie_file_extension = '.avi'
+
+    def is_available(self):
+        return mencoder.is_available()
+
+    def encode_images_to_movie(self, image_file_names, frames_per_second, image_encoding, movie_path, file_name_list_file_name, width=None, height=None, output_line_handler=None, cancel_event=None):
+        return mencoder.encode_images_to_movie(
+            image_file_names,
+            frames_per_second,
+            image_encoding,
+            movie_path,
+            file_name_list_file_name,
+            width,
+            height,
+            thread_count=self.thread_count,
+            output_line_handler=output_line_handler,
+            cancel_event=cancel_event)
+
+    def create_movie_from_image_stream(self, image_datas, image_encoding, frames_per_second, movie_path, width=None, height=None, output_line_handler=None, cancel_event=None):
+        return mencoder.create_movie_from_image_stream(
+            image_datas,
+            image_encoding,
+            frames_per_second,
+            movie_path,
+            width,
+            height,
+            thread_count=self.thread_count,
+            output_line_handler=output_line_handler,
+            cancel_event=cancel_event)
+
+    def concatenate_movies(self, movie_paths, output_movie_path, cancel_event=None):
+        return mencoder.concatenate_movies(movie_paths, output_movie_path, cancel_event)
+
+
+class FFmpegBackend(EncoderBackend):
+    """A locally installed ffmpeg, encoding H.264, H.265 or MPEG-4 into MP4."""
+
+    name = 'ffmpeg'
+    movie_file_extension = '.mp4'
+
+    def __init__(self, video_codec=ffmpeg.DEFAULT_VIDEO_CODEC, preset=ffmpeg.DEFAULT_PRESET):
+        if preset not in ffmpeg.PRESETS:
+            raise ValueError("Unknown preset '{}'.".format(preset))
+        self.video_codec = video_codec
+        self.preset = preset
+
+    def is_available(self):
+        return ffmpeg.is_available()
+
+    def encode_images_to_movie(self, image_file_names, frames_per_second, image_encoding, movie_path, file_name_list_file_name, width=None, height=None, output_line_handler=None, cancel_event=None):
+        return ffmpeg.encode_images_to_movie(
+            image_file_names,
+            frames_per_second,
+            image_encoding,
+            movie_path,
+            file_name_list_file_name,
+            width,
+            height,
+            video_codec=self.video_codec,
+            preset=self.preset,
+            thread_count=self.thread_count,
+            output_line_handler=output_line_handler,
+            cancel_event=cancel_event)
+
+    def create_movie_from_image_stream(self, image_datas, image_encoding, frames_per_second, movie_path, width=None, height=None, output_line_handler=None, cancel_event=None):
+        return ffmpeg.create_movie_from_image_stream(
+            image_datas,
+            image_encoding,
+            frames_per_second,
+            movie_path,
+            width,
+            height,
+            video_codec=self.video_codec,
+            preset=self.preset,
+            thread_count=self.thread_count,
+            output_line_handler=output_line_handler,
+            cancel_event=cancel_event)
+
+    def concatenate_movies(self, movie_paths, output_movie_path, cancel_event=None):
+        return ffmpeg.concatenate_movies(movie_paths, output_movie_path, cancel_event)
+
+
+def get_thread_budget(concurrent_encoder_count, thread_count=None):
+    """Returns how many threads each of concurrent_encoder_count encoders running at once may use,
+    sharing thread_count threads (default: one per core) between them.
+
+    >>> get_thread_budget(4, 16)
+    4
+    >>> get_thread_budget(3, 8)
+    2
+    >>> get_thread_budget(8, 2)
+    1
+    """
+    return max(1, (thread_count or os.cpu_count() or 1) // max(1, concurrent_encoder_count))
+
+
+def get_output_line_handler(total_frames, progress_callback):
+    """Returns an output line handler that reports progress to progress_callback, or None if it is None."""
+    if progress_callback is None:
+        return None
+    return progress.ProgressTracker(total_frames, progress_callback).get_line_handler()
+
+
+# In order of preference: x264 is both faster and better quality than MEncoder's MPEG-4 Part 2 encoder.
+_ENCODER_CLASSES = [FFmpegBackend, MEncoderBackend]
+
+ENCODER_NAMES = [encoder_class.name for encoder_class in _ENCODER_CLASSES]
+
+
+def get_encoder(name=None, video_codec=None, preset=None):
+    """Returns the encoder backend called name, or the most preferred available one if name is None.
+    video_codec and preset only apply to the ffmpeg backend; they default to the fastest codec that the installed
+    ffmpeg has (see ffmpeg.get_fastest_video_codec) and ffmpeg.DEFAULT_PRESET.
+    Raises ValueError if there is no such backend or no backend is available.
+
+    >>> get_encoder('mencoder').name
+    'mencoder'
+    >>> get_encoder('ffmpeg', preset='slow').preset
+    'slow'
+    >>> get_encoder('other')
+    Traceback (most recent call last):
+    ...
+    ValueError: Unknown encoder 'other'.
+    """
+    if name is not None:
+        for encoder_class in _ENCODER_CLASSES:
+            if encoder_class.name == name:
+                return _create_encoder(encoder_class, video_codec, preset)
+        raise ValueError("Unknown encoder '{}'.".format(name))
+
+    for encoder_class in _ENCODER_CLASSES:
+        encoder = _create_encoder(encoder_class, video_codec, preset)
+        if encoder.is_available():
+            logger.debug("Using the '{}' encoder.".format(encoder.name))
+            return encoder
+    raise ValueError('No encoder is available.  Install ffmpeg or MEncoder.')
+
+
+def _create_encoder(encoder_class, video_codec, preset):
+    if encoder_class is FFmpegBackend:
+        return FFmpegBackend(video_codec or ffmpeg.get_fastest_video_codec(), preset or ffmpeg.DEFAULT_PRESET)
+    return encoder_class()
+
+if __name__ == '__main__':
+    doctest.testmod()
@@ -0,0 +1,323 @@
+"""
+Defines methods to use a locally installed ffmpeg (https://ffmpeg.org/) to encode H.264 or H.265 movies
+(or MPEG-4 Part 2, with builds that have neither).
+
+ffmpeg documentation: https://ffmpeg.org/ffmpeg.html.
+H.264 presets: https://trac.ffmpeg.org/wiki/Encode/H.264.
+"""
+import doctest
+import logging
+import os
+
+import encoder_discovery
+import encoder_process
+import image_helper
+import profiling
+
+
+logger = logging.getLogger(__name__)
+
+
+class VideoCodecs:
+    h264 = 'libx264'
+    h265 = 'libx265'
+    # ffmpeg's built-in encoder, which every build has.
+    mpeg4 = 'mpeg4'
+
+
+VIDEO_CODECS = [VideoCodecs.h264, VideoCodecs.h265, VideoCodecs.mpeg4]
+
+# The codecs get_fastest_video_codec picks from, in order of preference: x264 is the fastest for its quality,
+# the built-in MPEG-4 encoder is fast but needs far more bits for the same quality, and x265 is much slower.
+_VIDEO_CODECS_BY_SPEED = [VideoCodecs.h264, VideoCodecs.mpeg4, VideoCodecs.h265]
+
+# x264 and x265 run their own thread pools, which ffmpeg -encoders doesn't flag.
+_INTERNALLY_THREADED_VIDEO_CODECS = [VideoCodecs.h264, VideoCodecs.h265]
+
+# x264/x265 speed presets, from fastest to slowest.
+PRESETS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow']
+
+DEFAULT_VIDEO_CODEC = VideoCodecs.h264
+DEFAULT_PRESET = 'veryfast'
+
+# Constant rate factor: the quality to encode at (lower is better; 23 is x264's default).
+DEFAULT_CRF = 20
+
+# The quantizer for the MPEG-4 encoder, which has no constant rate factor (lower is better; 2 to 31).
+_MPEG4_QUALITY = 3
+
+
+def is_available():
+    return get_ffmpeg_path() is not None
+
+
+def get_ffmpeg_path():
+    """Returns the path to ffmpeg on the PATH, or None if it isn't installed."""
+    return encoder_discovery.find_executable('ffmpeg')
+
+
+def get_capabilities():
+    """Returns ffmpeg's encoder_discovery.EncoderCapabilities, or None if it isn't installed or can't be run."""
+    ffmpeg_path = get_ffmpeg_path()
+    if not ffmpeg_path:
+        return None
+    return encoder_discovery.get_capabilities(ffmpeg_path, _probe_ffmpeg)
+
+
+def get_fastest_video_codec():
+    """Returns the fastest of VIDEO_CODECS that ffmpeg has, preferring ones that encode with several threads.
+    Returns DEFAULT_VIDEO_CODEC if ffmpeg isn't installed.
+    """
+    capabilities = get_capabilities()
+    if capabilities is None:
+        return DEFAULT_VIDEO_CODEC
+    return select_fastest_video_codec(capabilities.video_codecs, capabilities.threaded_video_codecs)
+
+
+def select_fastest_video_codec(video_codecs, threaded_video_codecs):
+    """
+    >>> select_fastest_video_codec(['libx264', 'libx265', 'mpeg4'], ['libx264', 'libx265', 'mpeg4'])
+    'libx264'
+    >>> select_fastest_video_codec(['libx265', 'mpeg4'], ['libx265'])
+    'libx265'
+    >>> select_fastest_video_codec(['mpeg4'], [])
+    'mpeg4'
+    >>> select_fastest_video_codec([], [])
+    'libx264'
+    """
+    available_video_codecs = [
+        video_codec for video_codec in _VIDEO_CODECS_BY_SPEED if video_codec in video_codecs]
+    if not available_video_codecs:
+        return DEFAULT_VIDEO_CODEC
+    # sorted is stable, so the threaded codecs stay in order of speed.
+    return sorted(available_video_codecs, key=lambda video_codec: video_codec not in threaded_video_codecs)[0]
+
+
+def _probe_ffmpeg(ffmpeg_path):
+    output = encoder_discovery.run_probe_command([ffmpeg_path, '-hide_banner', '-encoders'])
+    if output is None:
+        return None
+    return parse_video_encoders(output)
+
+
+def parse_video_encoders(encoders_output):
+    """Returns (video-codecs, threaded-video-codecs) from the output of ffmpeg -encoders.
+
+    >>> parse_video_encoders('''Encoders:
+    ...  V..... = Video
+    ...  .F.... = Frame-level multithreading
+    ...  ..S... = Slice-level multithreading
+    ...  ------
+    ...  V.S... mpeg4                MPEG-4 part 2
+    ...  V....D libx264              libx264 H.264 / AVC / MPEG-4 AVC / MPEG-4 part 10 (codec h264)
+    ...  VF.... png                  PNG (Portable Network Graphics) image
+    ...  A....D aac                  AAC (Advanced Audio Coding)''')
+    (['mpeg4', 'libx264', 'png'], ['mpeg4', 'libx264', 'png'])
+    """
+    video_codecs = []
+    threaded_video_codecs = []
+    lines = iter(encoders_output.splitlines())
+    for line in lines:
+        if line.strip().startswith('---'):
+            break
+    for line in lines:
+        fields = line.split(None, 2)
+        if len(fields) < 2 or not fields[0].startswith('V'):
+            continue
+        flags, video_codec = fields[0], fields[1]
+        video_codecs.append(video_codec)
+        if 'F' in flags[1:3] or 'S' in flags[1:3] or video_codec in _INTERNALLY_THREADED_VIDEO_CODECS:
+            threaded_video_codecs.append(video_codec)
+    return video_codecs, threaded_video_codecs
+
+
+def encode_images_to_movie(image_file_names, frames_per_second, image_encoding, movie_path, file_name_list_file_name, width=None, height=None, video_codec=DEFAULT_VIDEO_CODEC, preset=DEFAULT_PRESET, thread_count=None, output_line_handler=None, cancel_event=None):
+    """Encodes image_file_names (which must all have image_encoding) into movie_path,
+    using file_name_list_file_name for the list of images passed to ffmpeg.
+    thread_count is the most threads ffmpeg's encoder may use (default: ffmpeg decides).
+    output_line_handler is optionally called with each line of ffmpeg's output while it runs.
+    Setting cancel_event (a threading.Event) stops ffmpeg and removes the partial movie and the list file.
+    Returns the path to the created movie or None on failure.
+    """
+    with profiling.span('write_image_file_names', frames=len(image_file_names)):
+        write_image_file_names(file_name_list_file_name, image_file_names, frames_per_second)
+
+    ffmpeg_args = [
+        '-f',
+        'concat',
+        '-safe',
+        '0',
+        '-i',
+        file_name_list_file_name,
+        *_get_output_args(movie_path, frames_per_second, width, height, video_codec, preset, thread_count)
+        ]
+
+    exit_status = _run_ffmpeg_command(ffmpeg_args, output_line_handler=output_line_handler, cancel_event=cancel_event)
+    if encoder_process.remove_outputs_if_cancelled(cancel_event, movie_path, file_name_list_file_name):
+        return
+    return _get_movie_path_from_exit_status(movie_path, exit_status)
+
+
+def create_movie_from_image_stream(image_datas, image_encoding, frames_per_second, movie_path, width=None, height=None, video_codec=DEFAULT_VIDEO_CODEC, preset=DEFAULT_PRESET, thread_count=None, output_line_handler=None, cancel_event=None):
+    """Creates a movie from compressed images that are piped to ffmpeg's stdin, instead of being read from files.
+    image_datas is an iterable of the encoded image bytes (all with image_encoding), in frame order.
+    Returns the path to the created movie or None on failure.
+    """
+    ffmpeg_args = [
+        '-f',
+        'image2pipe',
+        '-framerate',
+        '{}'.format(frames_per_second),
+        '-c:v',
+        _get_image_decoder_str(image_encoding),
+        '-i',
+        '-',
+        *_get_output_args(movie_path, frames_per_second, width, height, video_codec, preset, thread_count)
+        ]
+
+    exit_status = _run_ffmpeg_command(
+        ffmpeg_args,
+        input_chunks=image_datas,
+        output_line_handler=output_line_handler,
+        cancel_event=cancel_event)
+    if encoder_process.remove_outputs_if_cancelled(cancel_event, movie_path):
+        return
+    return _get_movie_path_from_exit_status(movie_path, exit_status)
+
+
+def concatenate_movies(movie_paths, output_movie_path, cancel_event=None):
+    """Joins movie_paths (which must have the same codec, resolution and frame rate) into output_movie_path,
+    copying the video stream without re-encoding it.
+    Returns the path to the joined movie or None on failure.
+    """
+    list_file_name = output_movie_path + '.segments.txt'
+    with open(list_file_name, 'w') as list_file:
+        list_file.write('ffconcat version 1.0\n')
+        for movie_path in movie_paths:
+            list_file.write('file {}\n'.format(_quote_concat_path(movie_path)))
+
+    ffmpeg_args = [
+        '-f',
+        'concat',
+        '-safe',
+        '0',
+        '-i',
+        list_file_name,
+        '-c',
+        'copy',
+        output_movie_path
+        ]
+
+    try:
+        exit_status = _run_ffmpeg_command(ffmpeg_args, cancel_event=cancel_event)
+    finally:
+        os.remove(list_file_name)
+    if encoder_process.remove_outputs_if_cancelled(cancel_event, output_movie_path):
+        return
+    return _get_movie_path_from_exit_status(output_movie_path, exit_status)
+
+
+def write_image_file_names(image_file_name_list_file_name, image_file_names, frames_per_second):
+    """Writes an ffconcat list that shows each image for one frame."""
+    frame_duration = '{:.6f}'.format(1 / float(frames_per_second))
+    with open(image_file_name_list_file_name, 'w') as list_file:
+        list_file.write('ffconcat version 1.0\n')
+        for image_file_name in image_file_names:
+            list_file.write('file {}\nduration {}\n'.format(_quote_concat_path(image_file_name), frame_duration))
+        # The concat demuxer ignores the duration of the last file unless it is repeated.
+        list_file.write('file {}\n'.format(_quote_concat_path(image_file_names[-1])))
+
+
+def _quote_concat_path(path):
+    """
+    >>> print(_quote_concat_path("/captures/run 1.jpg"))
+    '/captures/run 1.jpg'
+    >>> print(_quote_concat_path("/captures/Bob's run.jpg"))
+    '/captures/Bob'\\''s run.jpg'
+    """
+    return "'{}'".format(os.path.abspath(path).replace("'", "'\\''"))
+
+
+def _get_output_args(movie_path, frames_per_second, width, height, video_codec, preset, thread_count=None):
+    if width and height:
+        scale_filter = 'scale={}:{}'.format(width, height)
+    elif width or height:
+        raise ValueError('To scale the images, you must specify both the width and the height.')
+    else:
+        # 4:2:0 chroma subsampling requires even dimensions.
+        scale_filter = 'scale=trunc(iw/2)*2:trunc(ih/2)*2'
+
+    if video_codec == VideoCodecs.mpeg4:
+        # The MPEG-4 encoder has no presets or constant rate factor.
+        quality_args = ['-q:v', '{}'.format(_MPEG4_QUALITY)]
+    else:
+        quality_args = ['-preset', preset, '-crf', '{}'.format(DEFAULT_CRF)]
+
+    thread_args = []
+    if thread_count:
+        thread_args = ['-threads', '{}'.format(thread_count)]
+
+    return [
+        '-vf',
+        scale_filter,
+        '-r',
+        '{}'.format(frames_per_second),
+        '-c:v',
+        video_codec,
+        *quality_args,
+        *thread_args,
+        '-pix_fmt',
+        'yuv420p',
+        '-an',
+        '-y',
+        movie_path
+        ]
+
+
+def _get_movie_path_from_exit_status(movie_path, exit_status):
+    if exit_status == 0:
+        return os.path.realpath(movie_path)
+    else:
+        logger.error("ffmpeg failed with code {}.".format(exit_status))
+        return
+
+
+def _run_ffmpeg_command(ffmpeg_args, input_chunks=None, output_line_handler=None, cancel_event=None):
+    """ffmpeg_args is a list of arguments to pass to ffmpeg.
+    It should not contain the ffmpeg executable.
+    """
+    ffmpeg_path = get_ffmpeg_path()
+    if not ffmpeg_path:
+        logger.error('ffmpeg is not installed.')
+        return -1
+
+    command = [ffmpeg_path, '-hide_banner'] + ffmpeg_args
+    if input_chunks is None:
+        # Otherwise ffmpeg reads interactive commands from stdin.
+        command.insert(1, '-nostdin')
+    with profiling.span('ffmpeg'):
+        return encoder_process.run_encoder_command(
+            command,
+            input_chunks=input_chunks,
+            output_line_handler=output_line_handler,
+            cancel_event=cancel_event)
+
+
+def _get_image_decoder_str(encoding):
+    """
+    >>> _get_image_decoder_str(image_helper.ImageEncoding.jpeg)
+    'mjpeg'
+    >>> _get_image_decoder_str(image_helper.ImageEncoding.png)
+    'png'
+    """
+    if encoding == image_helper.ImageEncoding.jpeg:
+        return 'mjpeg'
+    elif encoding == image_helper.ImageEncoding.png:
+        return 'png'
+    elif encoding == image_helper.ImageEncoding.unknown:
+        raise ValueError("Unknown encoding.")
+    else:
+        raise ValueError("Encoding '{}' is not supported.".format(encoding))
+
+if __name__ == '__main__':
+    doctest.testmod()
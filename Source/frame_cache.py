@@ -0,0 +1,274 @@
+"""
+A content-addressed cache of derived frames (e.g. scaled or transcoded images) in the user cache directory.
+
+Each entry is a file named after a hash of the source image's contents and the parameters used to derive it,
+so a frame that has been modified or replaced never matches an old entry, and renamed or copied frames still do.
+The cache is limited in size: trim removes the least recently used entries (by modification time,
+which is updated whenever an entry is used) until it fits.
+"""
+import concurrent.futures
+import doctest
+import hashlib
+import logging
+import os
+import threading
+
+import directories
+import encoder_process
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE_BYTES = 2 * 1024 ** 3
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+# convert_frames hands frames to each worker process in groups of this many, so that the cost of a call into
+# another process (pickling the arguments and results) is paid once per group rather than once per frame.
+_CONVERT_BATCH_SIZE = 16
+
+_executors_lock = threading.Lock()
+# number of worker processes -> the process pool that convert_frames uses
+_executors = {}
+
+
+def get_default_cache_directory(name):
+    return os.path.join(directories.get_user_cache_directory(), name)
+
+
+def get_source_hash(file_name):
+    """Returns a hex digest of the contents of file_name.
+
+    >>> len(get_source_hash(__file__))
+    32
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_name, 'rb') as file:
+        while True:
+            chunk = file.read(_HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_source_hash_from_data(data):
+    """Same as get_source_hash, for contents that have already been read.
+
+    >>> with open(__file__, 'rb') as file:
+    ...     get_source_hash_from_data(file.read()) == get_source_hash(__file__)
+    True
+    """
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def get_entry_name(source_hash, parameters, extension):
+    """Returns the file name of the entry for the source with source_hash, derived with parameters
+    (a string that identifies everything that affects the derived image, e.g. its size and resampling filter).
+
+    >>> get_entry_name('0123abcd', '1280x720:lanczos', '.jpg')
+    '0123abcd-1280x720-lanczos.jpg'
+    """
+    safe_parameters = ''.join(character if character.isalnum() else '-' for character in parameters)
+    return '{}-{}{}'.format(source_hash, safe_parameters, extension)
+
+
+class FrameCache:
+    """A directory of derived frames.  Entries can be looked up and created from multiple threads or processes;
+    new entries are written to a temporary file and then renamed into place, so readers never see partial files.
+    """
+
+    def __init__(self, directory, max_size_bytes=DEFAULT_MAX_SIZE_BYTES):
+        self.directory = directory
+        self.max_size_bytes = max_size_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def get_path(self, entry_name):
+        return os.path.join(self.directory, entry_name)
+
+    def trim(self, keep_paths=()):
+        """Removes the least recently used entries until the cache is no larger than max_size_bytes.
+        Entries in keep_paths (e.g. the frames of a render that is about to start) are never removed.
+        Returns the number of entries removed.
+        """
+        keep_paths = set(os.path.normcase(os.path.abspath(path)) for path in keep_paths)
+        entries = []
+        total_size = 0
+        with os.scandir(self.directory) as directory_entries:
+            for directory_entry in directory_entries:
+                if directory_entry.name.startswith('.'):
+                    # An entry that is still being written.
+                    continue
+                try:
+                    stat = directory_entry.stat()
+                except OSError:
+                    continue
+                total_size += stat.st_size
+                entries.append((stat.st_mtime_ns, stat.st_size, directory_entry.path))
+
+        removed_count = 0
+        entries.sort()
+        for mtime_ns, size, path in entries:
+            if total_size <= self.max_size_bytes:
+                break
+            if os.path.normcase(os.path.abspath(path)) in keep_paths:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+            removed_count += 1
+
+        if removed_count:
+            logger.debug("Removed {} least recently used frames from '{}'.".format(removed_count, self.directory))
+        return removed_count
+
+
+def convert_frames(image_file_names, convert_frame, parameters, cache, extension=None, action='convert', max_workers=None, info_cache=None, cancel_event=None):
+    """Derives a frame from each of image_file_names in the shared process pool with max_workers processes
+    (see get_executor), into entries of cache keyed by the source's contents and parameters
+    (see get_entry_name).  Frames that already have an entry reuse it without being converted again.
+
+    convert_frame is called in a worker process as convert_frame(image_data, output_file_name), and must write
+    the derived frame to output_file_name, raising OSError or ValueError if it can't.  It must be picklable
+    (a module-level function, or a functools.partial of one).
+    extension is the extension of the entries (default: the extension of each source).
+    action names the conversion in error messages (e.g. 'scale').
+    info_cache is an optional image_info_cache.ImageInfoCache that remembers the sources' content hashes, so that
+    a source whose frame is already in cache isn't read at all.
+    Setting cancel_event (a threading.Event) stops converting.
+    Returns (converted-image-file-names, cached-count, error-message).  The converted image file names are
+    in the same order as image_file_names, and are empty on failure.  cached-count is how many were reused.
+    """
+    source_hashes = [None] * len(image_file_names)
+    if info_cache is not None:
+        source_hashes = [info_cache.get_source_hash(image_file_name) for image_file_name in image_file_names]
+
+    executor = get_executor(max_workers)
+    futures = []
+    converted_image_file_names = []
+    cached_count = 0
+    try:
+        for start in range(0, len(image_file_names), _CONVERT_BATCH_SIZE):
+            futures.append(executor.submit(
+                _convert_frame_batch,
+                image_file_names[start:start + _CONVERT_BATCH_SIZE],
+                source_hashes[start:start + _CONVERT_BATCH_SIZE],
+                convert_frame,
+                parameters,
+                extension,
+                action,
+                cache.directory))
+
+        for future in futures:
+            for converted_image_file_name, was_cached, error_message, source_hash_entry in future.result():
+                if error_message:
+                    return [], 0, error_message
+                if info_cache is not None and source_hash_entry is not None:
+                    info_cache.put_source_hash(image_file_names[len(converted_image_file_names)], *source_hash_entry)
+                converted_image_file_names.append(converted_image_file_name)
+                cached_count += was_cached
+            if encoder_process.is_cancelled(cancel_event):
+                return [], 0, 'Cancelled.'
+    except concurrent.futures.BrokenExecutor:
+        # A worker process died; the next conversion starts a new pool.
+        _discard_executor(executor)
+        raise
+    finally:
+        # The pool is shared, so only this call's frames are stopped.
+        for future in futures:
+            future.cancel()
+        if info_cache is not None:
+            info_cache.flush()
+
+    cache.trim(keep_paths=converted_image_file_names)
+    return converted_image_file_names, cached_count, ''
+
+
+def get_executor(max_workers=None):
+    """Returns the process pool with max_workers worker processes (default: the number of cores).
+    The pool is shared by every conversion in this process (e.g. the transcode and pre-scale of a render,
+    and the renders after it), so the worker processes are only started once.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    with _executors_lock:
+        executor = _executors.get(max_workers)
+        if executor is None:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+            _executors[max_workers] = executor
+        return executor
+
+
+def _discard_executor(executor):
+    with _executors_lock:
+        for max_workers, other_executor in list(_executors.items()):
+            if other_executor is executor:
+                del _executors[max_workers]
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _convert_frame_batch(image_file_names, source_hashes, convert_frame, parameters, extension, action, cache_directory):
+    """Runs in a worker process.  Returns a list of
+    (converted-image-file-name, was-cached, error-message, source-hash-entry), where source-hash-entry is
+    (size, modification time, source hash) for the sources whose hash wasn't in source_hashes, and otherwise None.
+    """
+    return [
+        _convert_frame(image_file_name, source_hash, convert_frame, parameters, extension, action, cache_directory)
+        for image_file_name, source_hash in zip(image_file_names, source_hashes)]
+
+
+def _convert_frame(image_file_name, source_hash, convert_frame, parameters, extension, action, cache_directory):
+    extension = extension or os.path.splitext(image_file_name)[1].lower()
+    if source_hash is not None:
+        converted_image_file_name = os.path.join(cache_directory, get_entry_name(source_hash, parameters, extension))
+        if touch_entry(converted_image_file_name):
+            return converted_image_file_name, True, '', None
+
+    source_hash_entry = None
+    try:
+        with open(image_file_name, 'rb') as image_file:
+            stat = os.fstat(image_file.fileno())
+            image_data = image_file.read()
+    except OSError as error:
+        return None, False, "Unable to read '{}': {}".format(image_file_name, error), None
+    if source_hash is None:
+        source_hash = get_source_hash_from_data(image_data)
+        source_hash_entry = (stat.st_size, stat.st_mtime_ns, source_hash)
+
+    converted_image_file_name = os.path.join(cache_directory, get_entry_name(source_hash, parameters, extension))
+    if touch_entry(converted_image_file_name):
+        return converted_image_file_name, True, '', source_hash_entry
+
+    temporary_file_name = get_temporary_path(converted_image_file_name)
+    try:
+        convert_frame(image_data, temporary_file_name)
+        os.replace(temporary_file_name, converted_image_file_name)
+    except (OSError, ValueError) as error:
+        try:
+            os.remove(temporary_file_name)
+        except OSError:
+            pass
+        return None, False, "Unable to {} '{}': {}".format(action, image_file_name, error), None
+
+    return converted_image_file_name, False, '', source_hash_entry
+
+
+def touch_entry(path):
+    """Marks the entry at path as used, so that it is the last to be trimmed.
+    Returns False if there is no such entry.
+    """
+    try:
+        os.utime(path)
+    except OSError:
+        return False
+    return True
+
+
+def get_temporary_path(path):
+    """Returns a path to write an entry to before renaming it to path.  Unique per process and thread."""
+    directory, file_name = os.path.split(path)
+    return os.path.join(directory, '.{}-{}.{}.tmp'.format(os.getpid(), threading.get_ident(), file_name))
+
+if __name__ == '__main__':
+    doctest.testmod()
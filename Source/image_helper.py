@@ -1,40 +1,87 @@
+import calendar
+import collections
+import concurrent.futures
+import datetime
 import doctest
-import io
+import glob
+import math
 import os
+import re
 import struct
+import time
+
+import profiling
+
+
+# Header information about an image file, as returned by probe_image and probe_images.
+# content_type is '' and width and height are -1 when the image could not be read or recognized.
+# size and mtime_ns are -1 when the file could not be stat'ed.
+ImageInfo = collections.namedtuple('ImageInfo', ['path', 'content_type', 'width', 'height', 'size', 'mtime_ns'])
+
+# Probing is I/O-bound (especially on network shares), so use many more threads than cores.
+DEFAULT_PROBE_WORKER_COUNT = 32
+
+# Files are handed to the probe threads in chunks to keep the per-file thread-pool overhead low.
+# Each thread gets about this many chunks, so that all of them are used and a slow chunk doesn't hold up the end.
+_PROBE_BATCHES_PER_WORKER = 4
+# Larger chunks would make the results (and so the progress) arrive in big steps.
+_MAX_PROBE_BATCH_SIZE = 64
 
 
 class ImageEncoding:
     unknown = 'unknown'
     jpeg = 'JPEG'
     png = 'PNG'
+    # Both JPEG and PNG frames (see transcode.transcode_images).
+    mixed = 'mixed'
 
 
-def get_image_encoding_from_file_names(image_file_names):
-    """
+def get_image_encoding_from_file_names(image_file_names, check_contents=False, cache=None, allow_mixed=False):
+    """Returns (ImageEncoding, error-message).
+
+    When allow_mixed is True, a mix of encodings returns ImageEncoding.mixed instead of an error
+    (for callers that convert them with transcode.transcode_images).
+
+    When check_contents is True, the signature bytes of every image are also checked (in parallel)
+    against the encoding from its extension, failing on the first (in the order of image_file_names)
+    mismatched or unreadable image.
+    cache is an optional image_info_cache.ImageInfoCache used for the content check.
+
     >>> get_image_encoding_from_file_names(["Foo1.jpg", "Foo2.jpg"])
     ('JPEG', '')
     >>> get_image_encoding_from_file_names(["Foo1.png"])
     ('PNG', '')
     >>> get_image_encoding_from_file_names(["Foo1.jpg", "Foo2.png"])
     ('unknown', "Mixed image encodings: 'Foo1.jpg' has encoding 'JPEG', but 'Foo2.png' has encoding 'PNG'.")
+    >>> get_image_encoding_from_file_names(["Foo1.jpg", "Foo2.png"], allow_mixed=True)
+    ('mixed', '')
+    >>> get_image_encoding_from_file_names(["Foo1.jpg", "Foo2.png", "Foo3.bar"], allow_mixed=True)
+    ('unknown', "Unknown file extension 'bar'.")
     >>> get_image_encoding_from_file_names(["Foo1.bar", "Foo2.jpg"])
     ('unknown', "Unknown file extension 'bar'.")
     """
     if len(image_file_names) < 1:
         raise ValueError("You must pass in at least 1 image.")
 
+    with profiling.span('get_image_encoding_from_file_names', frames=len(image_file_names), check_contents=check_contents):
+        return _get_image_encoding_from_file_names(image_file_names, check_contents, cache, allow_mixed)
+
+
+def _get_image_encoding_from_file_names(image_file_names, check_contents, cache, allow_mixed):
     first_image_file_name = image_file_names[0]
     first_encoding, error_message = get_image_encoding_from_file_name(first_image_file_name)
     if first_encoding == ImageEncoding.unknown:
         return first_encoding, error_message
 
     # Validate that there are not multiple encodings in the different files.
+    encoding = first_encoding
     for otherImageFileName in image_file_names[1:]:
         other_encoding, error_message = get_image_encoding_from_file_name(otherImageFileName)
         if other_encoding == ImageEncoding.unknown:
             return other_encoding, error_message
-        if other_encoding != first_encoding:
+        if other_encoding != first_encoding and allow_mixed:
+            encoding = ImageEncoding.mixed
+        elif other_encoding != first_encoding:
             error_message = "Mixed image encodings: '{}' has encoding '{}', but '{}' has encoding '{}'.".format(
                 first_image_file_name,
                 first_encoding,
@@ -42,7 +89,76 @@ def get_image_encoding_from_file_names(image_file_names):
                 other_encoding)
             return ImageEncoding.unknown, error_message
 
-    return first_encoding, ''
+    if check_contents:
+        error_message = _check_image_contents_match_encoding(image_file_names, encoding, cache)
+        if error_message:
+            return ImageEncoding.unknown, error_message
+
+    return encoding, ''
+
+
+_CONTENT_TYPE_ENCODINGS = {
+    'image/jpeg': ImageEncoding.jpeg,
+    'image/png': ImageEncoding.png,
+}
+
+
+def get_image_encoding_from_content_type(content_type):
+    """
+    >>> get_image_encoding_from_content_type('image/png')
+    'PNG'
+    >>> get_image_encoding_from_content_type('image/gif')
+    'unknown'
+    """
+    return _CONTENT_TYPE_ENCODINGS.get(content_type, ImageEncoding.unknown)
+
+
+def _check_image_contents_match_encoding(image_file_names, expected_encoding, cache):
+    """Returns an error message for the first image (in the order of image_file_names) whose contents don't have
+    expected_encoding, or '' if they all do.
+    When expected_encoding is ImageEncoding.mixed, each image is checked against the encoding from its own extension.
+
+    >>> import tempfile
+    >>> temporary_directory = tempfile.TemporaryDirectory()
+    >>> image_file_names = [os.path.join(temporary_directory.name, name) for name in ['1.png', '2.png', '3.png']]
+    >>> for image_file_name in image_file_names[1:]:
+    ...     with open(image_file_name, 'wb') as image_file:
+    ...         _ = image_file.write(b'Not an image.')
+    >>> print(_check_image_contents_match_encoding(image_file_names[::-1], ImageEncoding.png, None).replace(
+    ...     temporary_directory.name + os.sep, ''))
+    '3.png' is not a readable image.
+    >>> temporary_directory.cleanup()
+    """
+    # image file name -> the error message for it
+    error_messages = {}
+    for info in probe_images(image_file_names, cache=cache):
+        error_message = _get_image_contents_error_message(info, expected_encoding)
+        if error_message:
+            error_messages[info.path] = error_message
+
+    # The images are probed in parallel, so report the first bad one in the selection rather than the first found.
+    for image_file_name in image_file_names:
+        if image_file_name in error_messages:
+            return error_messages[image_file_name]
+    return ''
+
+
+def _get_image_contents_error_message(info, expected_encoding):
+    if info.size < 0:
+        return "Unable to read image '{}'.".format(info.path)
+    if not info.content_type:
+        return "'{}' is not a readable image.".format(info.path)
+
+    extension_encoding = expected_encoding
+    if extension_encoding == ImageEncoding.mixed:
+        extension_encoding, error_message = get_image_encoding_from_file_name(info.path)
+    encoding = get_image_encoding_from_content_type(info.content_type)
+    if encoding != extension_encoding:
+        return "'{}' has the extension for encoding '{}', but its contents are '{}'.".format(
+            info.path,
+            extension_encoding,
+            info.content_type)
+    return ''
 
 
 def get_image_encoding_from_file_name(image_file_name):
@@ -83,6 +199,45 @@ def get_image_encoding_from_extension(extension):
         return ImageEncoding.unknown, "Unknown file extension '{}'.".format(stripped_extension)
 
 
+def get_image_file_names_from_paths(paths):
+    """Expands a list of image files, directories and glob patterns into a list of image file names.
+
+    Directories and glob patterns are expanded to the images they contain, in natural sort order
+    (so 'run 2.jpg' comes before 'run 10.jpg').  Explicitly listed files are kept in the given order.
+    Raises ValueError if a path does not exist or a pattern matches nothing.
+    """
+    image_file_names = []
+    for path in paths:
+        if os.path.isdir(path):
+            file_names = [os.path.join(path, name) for name in os.listdir(path)]
+            image_file_names.extend(sorted(
+                (file_name for file_name in file_names if is_image_file_name(file_name)),
+                key=natural_sort_key))
+        elif os.path.isfile(path):
+            image_file_names.append(path)
+        elif glob.has_magic(path):
+            matches = [file_name for file_name in glob.glob(path) if os.path.isfile(file_name)]
+            if not matches:
+                raise ValueError("No files match '{}'.".format(path))
+            image_file_names.extend(sorted(matches, key=natural_sort_key))
+        else:
+            raise ValueError("No such file or directory '{}'.".format(path))
+    return image_file_names
+
+
+def is_image_file_name(file_name):
+    encoding, error_message = get_image_encoding_from_file_name(file_name)
+    return encoding != ImageEncoding.unknown
+
+
+def natural_sort_key(file_name):
+    """
+    >>> sorted(['run 10.jpg', 'run 2.jpg', 'run 1.jpg'], key=natural_sort_key)
+    ['run 1.jpg', 'run 2.jpg', 'run 10.jpg']
+    """
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', file_name)]
+
+
 def get_image_info_from_image_data(data):
     """Given either the full image binary data or just the header,
     returns (content_type, width, height).
@@ -125,42 +280,593 @@ def get_image_info_from_image_data(data):
         height = int(h)
 
     # handle JPEGs
-    elif (size >= 2) and data.startswith(b'\377\330'):
+    elif (size >= 2) and data.startswith(_JPEG_START_OF_IMAGE):
         content_type = 'image/jpeg'
-        jpeg = io.BytesIO(data)
-        jpeg.read(2)
-        b = jpeg.read(1)
-        try:
-            (w, h) = (-1, -1)
-
-            while b and ord(b) != 0xDA:
-                while ord(b) != 0xFF:
-                    b = jpeg.read(1)
-                while ord(b) == 0xFF:
-                    b = jpeg.read(1)
-                if 0xC0 <= ord(b) <= 0xC3:
-                    jpeg.read(3)
-                    h, w = struct.unpack(">HH", jpeg.read(4))
-                    break
-                else:
-                    jpeg.read(int(struct.unpack(">H", jpeg.read(2))[0])-2)
-                b = jpeg.read(1)
-
-            if w >= 0 and h >= 0:
-                width = int(w)
-                height = int(h)
-        except struct.error:
-            pass
-        except ValueError:
-            pass
+        width, height, _ = _get_jpeg_size_from_data(data, len(_JPEG_START_OF_IMAGE))
 
     return content_type, width, height
 
 
+_JPEG_START_OF_IMAGE = b'\377\330'
+
+# Start-of-frame markers (SOF0-SOF15) hold the image size.
+# 0xC4 (DHT), 0xC8 (JPG) and 0xCC (DAC) are in the same range but are not frame headers.
+_JPEG_START_OF_FRAME_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# Markers that have no length field (TEM, RST0-RST7, SOI).
+_JPEG_STANDALONE_MARKERS = frozenset([0x01, *range(0xD0, 0xD9)])
+
+_JPEG_START_OF_SCAN = 0xDA
+_JPEG_END_OF_IMAGE = 0xD9
+
+# The number of bytes read at a time when probing an image file's header.
+_PROBE_CHUNK_SIZE = 4096
+
+
+def _get_jpeg_size_from_data(data, offset):
+    """Walks the JPEG markers in data, starting at offset, looking for a start-of-frame header.
+    Returns (width, height, offset).
+
+    When a frame header is found, width and height are set and offset is the position of its length field.
+    Otherwise width and height are -1 and offset is where the walk has to resume once more data is available,
+    which may be past the end of data when a segment extends beyond it.
+    The offset is -1 when the data has no frame header (e.g. the scan data or end of image was reached).
+
+    >>> app0 = b'\\xff\\xe0\\x00\\x10' + bytes(14)
+    >>> sof2 = b'\\xff\\xc2\\x00\\x11\\x08\\x00\\x78\\x00\\xa0' + bytes(10)
+    >>> _get_jpeg_size_from_data(app0 + sof2, 0)
+    (160, 120, 20)
+    >>> _get_jpeg_size_from_data(app0 + sof2[:6], 0)
+    (-1, -1, 18)
+    >>> _get_jpeg_size_from_data(app0[:6], 0)
+    (-1, -1, 18)
+    >>> _get_jpeg_size_from_data(b'\\xff\\xd0\\xff\\xff\\xda\\x00\\x08', 0)
+    (-1, -1, -1)
+    """
+    marker, offset = _find_jpeg_segment_from_data(data, offset, _JPEG_START_OF_FRAME_MARKERS)
+    if marker is None:
+        return -1, -1, offset
+
+    # Length (2 bytes), sample precision (1 byte), height (2 bytes), width (2 bytes).
+    if offset + 7 > len(data):
+        # Resume from the 0xFF byte in front of the marker.
+        return -1, -1, offset - 2
+    height, width = struct.unpack_from('>HH', data, offset + 3)
+    return width, height, offset
+
+
+def _find_jpeg_segment_from_data(data, offset, markers):
+    """Walks the JPEG markers in data, starting at offset, looking for a segment with one of markers.
+    Returns (marker, offset).
+
+    When a segment is found, offset is the position of its length field.
+    Otherwise marker is None and offset is where the walk has to resume once more data is available,
+    which may be past the end of data when a segment extends beyond it.
+    The offset is -1 when the data has no such segment (e.g. the scan data or end of image was reached).
+
+    >>> app0 = b'\\xff\\xe0\\x00\\x10' + bytes(14)
+    >>> app1 = b'\\xff\\xe1\\x00\\x08Exif\\x00\\x00'
+    >>> _find_jpeg_segment_from_data(app0 + app1, 0, {_JPEG_APP1})
+    (225, 20)
+    >>> _find_jpeg_segment_from_data(app0 + app1[:1], 0, {_JPEG_APP1})
+    (None, 18)
+    """
+    size = len(data)
+    while True:
+        marker_start = data.find(b'\377', offset)
+        if marker_start < 0:
+            return None, size
+
+        # Markers may be preceded by any number of 0xFF fill bytes.
+        offset = marker_start
+        while offset < size and data[offset] == 0xFF:
+            offset += 1
+        if offset >= size:
+            return None, marker_start
+
+        marker = data[offset]
+        offset += 1
+        if marker == 0x00 or marker in _JPEG_STANDALONE_MARKERS:
+            continue
+        if marker in (_JPEG_START_OF_SCAN, _JPEG_END_OF_IMAGE):
+            return None, -1
+
+        if marker in markers:
+            return marker, offset
+
+        if offset + 2 > size:
+            return None, marker_start
+        segment_length, = struct.unpack_from('>H', data, offset)
+        if segment_length < 2:
+            return None, -1
+        offset += segment_length
+        if offset > size:
+            return None, offset
+
+
+def _iterate_jpeg_segments_from_file(file, data, markers, header_size):
+    """Walks the markers of the JPEG in the binary file object, yielding (marker, header-offset, header)
+    for each segment with one of markers, where header is up to header_size bytes of the segment,
+    starting at its length field, and header-offset is the position of the header in the file.
+    data is the start of the file, which has already been read.
+
+    Only the segment headers are read, in small chunks; everything else is skipped over.
+    """
+    data_file_offset = 0
+    offset = len(_JPEG_START_OF_IMAGE)
+    while True:
+        marker, offset = _find_jpeg_segment_from_data(data, offset, markers)
+        if marker is not None:
+            segment_header_size = header_size
+            if offset + 2 <= len(data):
+                # Don't read past the end of a short segment.
+                segment_length, = struct.unpack_from('>H', data, offset)
+                segment_header_size = min(header_size, max(segment_length, 2))
+            if offset + segment_header_size > len(data) and offset > 0:
+                # Read the rest of the header.
+                data_file_offset += offset
+                file.seek(data_file_offset)
+                data = file.read(max(segment_header_size, _PROBE_CHUNK_SIZE))
+                offset = 0
+            header = data[offset:offset + segment_header_size]
+            yield marker, data_file_offset + offset, header
+            if len(header) < 2:
+                return
+            segment_length, = struct.unpack_from('>H', header)
+            offset += max(segment_length, 2)
+            if offset < len(data):
+                continue
+        elif offset < 0:
+            return
+        elif offset == 0:
+            # No progress was made on a freshly read chunk, so the file is truncated.
+            return
+
+        # Continue the walk from offset, skipping over any part of the file that hasn't been read.
+        data_file_offset += offset
+        file.seek(data_file_offset)
+        data = file.read(_PROBE_CHUNK_SIZE)
+        if not data:
+            return
+        offset = 0
+
+
 def get_image_info_from_image(filename):
     with open(filename, 'rb') as file:
-        data = file.read()
-        return get_image_info_from_image_data(data)
+        return get_image_info_from_file(file)
+
+
+def get_image_info_from_file(file):
+    """Returns (content_type, width, height) for the image in the binary file object.
+
+    Only the image header is read, in small chunks.
+    JPEG segments that come before the frame header (e.g. EXIF data) are skipped over rather than read.
+    """
+    data = file.read(_PROBE_CHUNK_SIZE)
+    content_type, width, height = get_image_info_from_image_data(data)
+    if content_type != 'image/jpeg' or width >= 0:
+        return content_type, width, height
+
+    # Length (2 bytes), sample precision (1 byte), height (2 bytes), width (2 bytes).
+    for marker, header_offset, header in _iterate_jpeg_segments_from_file(file, data, _JPEG_START_OF_FRAME_MARKERS, 7):
+        if len(header) == 7:
+            height, width = struct.unpack_from('>HH', header, 3)
+        break
+
+    return content_type, width, height
+
+
+def get_capture_time(file_name):
+    """Returns when the JPEG in file_name was taken, in seconds, from its EXIF DateTimeOriginal and SubSecTimeOriginal
+    (falling back on DateTimeDigitized, then DateTime).  Returns None if the file has no capture time
+    (e.g. it isn't a JPEG, has no EXIF data, or can't be read).
+
+    Only the EXIF header is read: usually just the first few KB of the file.
+    EXIF times have no time zone, so they are returned as if they were UTC.  Only compare them with each other.
+    """
+    try:
+        with open(file_name, 'rb') as file:
+            return get_capture_time_from_file(file)
+    except OSError:
+        return None
+
+
+def get_capture_time_from_file(file):
+    """Returns the capture time of the JPEG in the binary file object (see get_capture_time), or None."""
+    data = file.read(_PROBE_CHUNK_SIZE)
+    if not data.startswith(_JPEG_START_OF_IMAGE):
+        return None
+
+    for marker, header_offset, header in _iterate_jpeg_segments_from_file(file, data, {_JPEG_APP1}, _PROBE_CHUNK_SIZE):
+        # Skip other APP1 segments (e.g. XMP).
+        if header[2:2 + len(_EXIF_HEADER)] != _EXIF_HEADER:
+            continue
+        segment_length, = struct.unpack_from('>H', header)
+        try:
+            return get_capture_time_from_exif_data(header[2 + len(_EXIF_HEADER):])
+        except ValueError:
+            if len(header) >= segment_length:
+                return None
+
+        # Something that the capture time needs lies past the header (e.g. after a large maker note),
+        # so read the whole segment.
+        file.seek(header_offset)
+        segment = file.read(segment_length)
+        try:
+            return get_capture_time_from_exif_data(segment[2 + len(_EXIF_HEADER):])
+        except ValueError:
+            return None
+    return None
+
+
+def get_capture_time_from_exif_data(data):
+    """Returns the capture time (see get_capture_time) from data, the TIFF structure in an EXIF segment,
+    or None if it doesn't have one.  Raises ValueError if data is truncated or invalid.
+
+    >>> exif = _create_exif_data({0x9003: b'2021:06:01 12:30:15\\0', 0x9291: b'25\\0'})
+    >>> get_capture_time_from_exif_data(exif)
+    1622550615.25
+    >>> get_capture_time_from_exif_data(exif[:40])
+    Traceback (most recent call last):
+      ...
+    ValueError: Truncated EXIF data.
+    >>> get_capture_time_from_exif_data(_create_exif_data({})) is None
+    True
+    """
+    byte_order, ifd0_offset = _read_exif_header(data)
+    ifd0 = _read_exif_ifd(data, ifd0_offset, byte_order, _EXIF_CAPTURE_TIME_TAG_SET)
+
+    exif_ifd = {}
+    if _EXIF_IFD_POINTER_TAG in ifd0:
+        exif_ifd = _read_exif_ifd(data, ifd0[_EXIF_IFD_POINTER_TAG], byte_order, _EXIF_CAPTURE_TIME_TAG_SET)
+
+    for ifd, date_time_tag, sub_second_tag in _EXIF_CAPTURE_TIME_TAGS:
+        capture_time = _parse_exif_date_time(ifd0 if ifd == 0 else exif_ifd, date_time_tag, sub_second_tag)
+        if capture_time is not None:
+            return capture_time
+    return None
+
+
+def get_exif_thumbnail(file_name):
+    """Returns the JPEG thumbnail embedded in the EXIF data of the JPEG in file_name, as bytes,
+    or None if it doesn't have one (or can't be read).
+    Only the EXIF segment is read, and nothing is decoded.
+    """
+    try:
+        with open(file_name, 'rb') as file:
+            return get_exif_thumbnail_from_file(file)
+    except OSError:
+        return None
+
+
+def get_exif_thumbnail_from_file(file):
+    """Returns the EXIF thumbnail of the JPEG in the binary file object (see get_exif_thumbnail), or None."""
+    data = file.read(_PROBE_CHUNK_SIZE)
+    if not data.startswith(_JPEG_START_OF_IMAGE):
+        return None
+
+    for marker, header_offset, header in _iterate_jpeg_segments_from_file(file, data, {_JPEG_APP1}, _PROBE_CHUNK_SIZE):
+        if header[2:2 + len(_EXIF_HEADER)] != _EXIF_HEADER:
+            continue
+        # The thumbnail is usually at the end of the segment, so read all of it.
+        segment_length, = struct.unpack_from('>H', header)
+        segment = header
+        if len(header) < segment_length:
+            file.seek(header_offset)
+            segment = file.read(segment_length)
+        try:
+            return get_exif_thumbnail_from_exif_data(segment[2 + len(_EXIF_HEADER):])
+        except ValueError:
+            return None
+    return None
+
+
+def get_exif_thumbnail_from_exif_data(data):
+    """Returns the JPEG thumbnail (as bytes) described by IFD 1 of data, the TIFF structure in an EXIF segment,
+    or None if it doesn't have one.  Raises ValueError if data is truncated or invalid.
+
+    >>> thumbnail = _JPEG_START_OF_IMAGE + bytes(10)
+    >>> get_exif_thumbnail_from_exif_data(_create_exif_data({}, thumbnail)) == thumbnail
+    True
+    >>> get_exif_thumbnail_from_exif_data(_create_exif_data({})) is None
+    True
+    """
+    byte_order, ifd0_offset = _read_exif_header(data)
+    ifd1_offset = _read_next_exif_ifd_offset(data, ifd0_offset, byte_order)
+    if ifd1_offset == 0:
+        return None
+
+    ifd1 = _read_exif_ifd(data, ifd1_offset, byte_order, _EXIF_THUMBNAIL_TAG_SET)
+    thumbnail_offset = ifd1.get(_EXIF_THUMBNAIL_OFFSET_TAG)
+    thumbnail_length = ifd1.get(_EXIF_THUMBNAIL_LENGTH_TAG)
+    if not thumbnail_offset or not thumbnail_length:
+        return None
+    if thumbnail_offset + thumbnail_length > len(data):
+        raise ValueError('Truncated EXIF data.')
+    thumbnail = data[thumbnail_offset:thumbnail_offset + thumbnail_length]
+    if not thumbnail.startswith(_JPEG_START_OF_IMAGE):
+        return None
+    return thumbnail
+
+
+def get_capture_times(image_file_names, max_workers=DEFAULT_PROBE_WORKER_COUNT):
+    """Returns the capture time (see get_capture_time) of each of image_file_names, reading them in a thread pool.
+    Frames without one get their file modification time (as local time, to match EXIF times) instead,
+    or None if they can't be read.
+    """
+    capture_times = dict(run_batches_in_parallel(image_file_names, _get_capture_time_batch, max_workers))
+    return [capture_times[file_name] for file_name in image_file_names]
+
+
+def sort_by_capture_time(image_file_names, max_workers=DEFAULT_PROBE_WORKER_COUNT):
+    """Returns image_file_names sorted by capture time (see get_capture_times).
+    Frames with the same capture time stay in their original order, and frames that can't be read go last.
+    """
+    capture_times = get_capture_times(image_file_names, max_workers)
+    order = sorted(
+        range(len(image_file_names)),
+        key=lambda index: (capture_times[index] is None, capture_times[index] or 0))
+    return [image_file_names[index] for index in order]
+
+
+def _get_capture_time_batch(image_file_names):
+    results = []
+    for file_name in image_file_names:
+        capture_time = get_capture_time(file_name)
+        if capture_time is None:
+            try:
+                modification_time = os.stat(file_name).st_mtime
+            except OSError:
+                pass
+            else:
+                local_time = time.localtime(modification_time)
+                capture_time = calendar.timegm(local_time) + modification_time % 1
+        results.append((file_name, capture_time))
+    return results
+
+
+_JPEG_APP1 = 0xE1
+_EXIF_HEADER = b'Exif\0\0'
+
+_EXIF_IFD_POINTER_TAG = 0x8769
+_EXIF_ASCII_TYPE = 2
+_EXIF_SHORT_TYPE = 3
+_EXIF_LONG_TYPE = 4
+# (IFD, date and time tag, sub-second tag), in order of preference.  IFD 0 is the main IFD, and 1 the EXIF IFD.
+_EXIF_CAPTURE_TIME_TAGS = [
+    (1, 0x9003, 0x9291),  # DateTimeOriginal, SubSecTimeOriginal
+    (1, 0x9004, 0x9292),  # DateTimeDigitized, SubSecTimeDigitized
+    (0, 0x0132, 0x9290),  # DateTime, SubSecTime
+]
+_EXIF_CAPTURE_TIME_TAG_SET = frozenset(
+    [_EXIF_IFD_POINTER_TAG] + [tag for ifd, *tags in _EXIF_CAPTURE_TIME_TAGS for tag in tags])
+
+# In IFD 1, which describes the thumbnail.
+_EXIF_THUMBNAIL_OFFSET_TAG = 0x0201  # JPEGInterchangeFormat
+_EXIF_THUMBNAIL_LENGTH_TAG = 0x0202  # JPEGInterchangeFormatLength
+_EXIF_THUMBNAIL_TAG_SET = frozenset([_EXIF_THUMBNAIL_OFFSET_TAG, _EXIF_THUMBNAIL_LENGTH_TAG])
+
+
+def _read_exif_header(data):
+    """Returns (byte-order, IFD-0-offset) from the header of the TIFF structure in an EXIF segment.
+    The byte order is a struct format prefix.
+    """
+    byte_order = {b'II': '<', b'MM': '>'}.get(data[:2])
+    if byte_order is None or len(data) < 8:
+        raise ValueError('Invalid EXIF data.')
+    ifd0_offset, = struct.unpack_from(byte_order + 'L', data, 4)
+    return byte_order, ifd0_offset
+
+
+def _read_exif_ifd(data, offset, byte_order, tags):
+    """Returns {tag: value} for the tags in the EXIF IFD at offset in data.
+    ASCII values are returned as bytes, and SHORT and LONG values as ints.
+    """
+    entry_count = _read_exif_ifd_entry_count(data, offset, byte_order)
+
+    values = {}
+    for entry_offset in range(offset + 2, offset + 2 + 12 * entry_count, 12):
+        tag, value_type, count = struct.unpack_from(byte_order + 'HHL', data, entry_offset)
+        if tag not in tags:
+            continue
+        if value_type == _EXIF_LONG_TYPE:
+            values[tag], = struct.unpack_from(byte_order + 'L', data, entry_offset + 8)
+        elif value_type == _EXIF_SHORT_TYPE:
+            values[tag], = struct.unpack_from(byte_order + 'H', data, entry_offset + 8)
+        elif value_type == _EXIF_ASCII_TYPE:
+            # Values of up to 4 bytes are stored in the entry itself.
+            value_offset = entry_offset + 8
+            if count > 4:
+                value_offset, = struct.unpack_from(byte_order + 'L', data, entry_offset + 8)
+            if value_offset + count > len(data):
+                raise ValueError('Truncated EXIF data.')
+            values[tag] = data[value_offset:value_offset + count]
+    return values
+
+
+def _read_next_exif_ifd_offset(data, offset, byte_order):
+    """Returns the offset of the IFD after the one at offset in data, which is 0 if it's the last one."""
+    entry_count = _read_exif_ifd_entry_count(data, offset, byte_order)
+    next_offset_offset = offset + 2 + 12 * entry_count
+    if next_offset_offset + 4 > len(data):
+        raise ValueError('Truncated EXIF data.')
+    next_offset, = struct.unpack_from(byte_order + 'L', data, next_offset_offset)
+    return next_offset
+
+
+def _read_exif_ifd_entry_count(data, offset, byte_order):
+    if offset + 2 > len(data):
+        raise ValueError('Truncated EXIF data.')
+    entry_count, = struct.unpack_from(byte_order + 'H', data, offset)
+    if offset + 2 + 12 * entry_count > len(data):
+        raise ValueError('Truncated EXIF data.')
+    return entry_count
+
+
+def _parse_exif_date_time(ifd, date_time_tag, sub_second_tag):
+    """Returns the time in seconds from an EXIF date and time ('YYYY:MM:DD HH:MM:SS') and sub-second digits,
+    or None if the IFD doesn't have a valid date and time.
+
+    >>> _parse_exif_date_time({1: b'2021:06:01 12:30:15\\0', 2: b'5  \\0'}, 1, 2)
+    1622550615.5
+    >>> _parse_exif_date_time({1: b'    :  :     :  :  \\0'}, 1, 2) is None
+    True
+    """
+    value = ifd.get(date_time_tag)
+    if not isinstance(value, bytes):
+        return None
+    try:
+        date_time = datetime.datetime.strptime(value.rstrip(b'\0 ').decode('ascii'), '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+    capture_time = calendar.timegm(date_time.timetuple())
+
+    sub_second = ifd.get(sub_second_tag)
+    if isinstance(sub_second, bytes):
+        digits = sub_second.rstrip(b'\0 ').decode('ascii', 'replace')
+        if digits.isdigit():
+            capture_time += int(digits) / 10 ** len(digits)
+    return capture_time
+
+
+def _create_exif_data(values, thumbnail=b''):
+    """Returns little-endian EXIF TIFF data with an EXIF IFD holding the ASCII values ({tag: bytes}),
+    and IFD 1 pointing to thumbnail if it isn't empty, for testing.
+    """
+    exif_ifd_offset = 8 + 2 + 12 + 4
+    ifd1_offset = exif_ifd_offset + 2 + 12 * len(values) + 4
+    value_offset = ifd1_offset + (2 + 12 * 2 + 4 if thumbnail else 0)
+
+    ifd0 = struct.pack('<H', 1) + struct.pack('<HHLL', _EXIF_IFD_POINTER_TAG, _EXIF_LONG_TYPE, 1, exif_ifd_offset)
+    ifd0 += struct.pack('<L', ifd1_offset if thumbnail else 0)
+    exif_ifd = struct.pack('<H', len(values))
+    value_data = b''
+    for tag, value in sorted(values.items()):
+        if len(value) <= 4:
+            exif_ifd += struct.pack('<HHL', tag, _EXIF_ASCII_TYPE, len(value)) + value.ljust(4, b'\0')
+        else:
+            exif_ifd += struct.pack('<HHLL', tag, _EXIF_ASCII_TYPE, len(value), value_offset + len(value_data))
+            value_data += value
+    exif_ifd += bytes(4)
+
+    ifd1 = b''
+    if thumbnail:
+        ifd1 = struct.pack('<H', 2)
+        ifd1 += struct.pack('<HHLL', _EXIF_THUMBNAIL_OFFSET_TAG, _EXIF_LONG_TYPE, 1, value_offset + len(value_data))
+        ifd1 += struct.pack('<HHLL', _EXIF_THUMBNAIL_LENGTH_TAG, _EXIF_LONG_TYPE, 1, len(thumbnail))
+        ifd1 += bytes(4)
+        value_data += thumbnail
+    return b'II*\0' + struct.pack('<L', 8) + ifd0 + exif_ifd + ifd1 + value_data
+
+
+def probe_image(file_name):
+    """Returns an ImageInfo for file_name.  Never raises for unreadable files."""
+    info, was_read = _probe_image(file_name)
+    return info
+
+
+def _probe_image(file_name):
+    """Returns (ImageInfo, was-read).  was-read is False when the file couldn't be opened or read,
+    which may be temporary (e.g. a locked file or a network share that dropped), so the result shouldn't be cached.
+    """
+    try:
+        with open(file_name, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            content_type, width, height = get_image_info_from_file(file)
+    except OSError:
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            return ImageInfo(file_name, '', -1, -1, -1, -1), False
+        return ImageInfo(file_name, '', -1, -1, stat.st_size, stat.st_mtime_ns), False
+
+    return ImageInfo(file_name, content_type, width, height, stat.st_size, stat.st_mtime_ns), True
+
+
+def probe_images(image_file_names, max_workers=DEFAULT_PROBE_WORKER_COUNT, cache=None):
+    """Probes the headers of all of image_file_names using a thread pool.
+
+    This is a generator that yields an ImageInfo for each file as soon as it has been probed,
+    so the results are NOT in the same order as image_file_names.
+    Closing the generator early cancels the probes that haven't started.
+
+    cache is an optional image_info_cache.ImageInfoCache.
+    Unchanged files are returned from it without being opened, and new results are saved to it when done.
+    """
+    if cache is None:
+        yield from run_batches_in_parallel(image_file_names, _probe_image_batch, max_workers)
+        return
+
+    try:
+        yield from run_batches_in_parallel(
+            image_file_names,
+            lambda file_names: _probe_image_batch_with_cache(file_names, cache),
+            max_workers)
+    finally:
+        cache.flush()
+
+
+def _probe_image_batch(image_file_names):
+    return [probe_image(file_name) for file_name in image_file_names]
+
+
+def _probe_image_batch_with_cache(image_file_names, cache):
+    """Only caches the images that could be read, so an image that couldn't be is probed again next time.
+
+    >>> import image_info_cache
+    >>> cache = image_info_cache.ImageInfoCache(':memory:')
+    >>> unopenable_file_name = os.path.dirname(os.path.abspath(__file__))
+    >>> _probe_image_batch_with_cache([unopenable_file_name], cache)[0].content_type
+    ''
+    >>> cache.get(unopenable_file_name) is None
+    True
+    """
+    infos = []
+    for file_name in image_file_names:
+        info = cache.get(file_name)
+        if info is None:
+            info, was_read = _probe_image(file_name)
+            if was_read:
+                cache.put(info)
+        infos.append(info)
+    return infos
+
+
+def get_probe_batch_size(file_count, max_workers=DEFAULT_PROBE_WORKER_COUNT):
+    """Returns how many files to hand to each probe thread at a time, so that all max_workers threads are used.
+
+    >>> get_probe_batch_size(50, 32)
+    1
+    >>> get_probe_batch_size(500, 32)
+    4
+    >>> get_probe_batch_size(50000, 32)
+    64
+    """
+    batch_count = (max_workers or DEFAULT_PROBE_WORKER_COUNT) * _PROBE_BATCHES_PER_WORKER
+    return min(_MAX_PROBE_BATCH_SIZE, max(1, math.ceil(file_count / batch_count)))
+
+
+def run_batches_in_parallel(image_file_names, probe_batch, max_workers=DEFAULT_PROBE_WORKER_COUNT):
+    """Runs probe_batch (a function taking a list of file names and returning a list of results)
+    over image_file_names in a thread pool, yielding each result as its batch finishes.
+    Closing the generator early cancels the batches that haven't started.
+    """
+    image_file_names = list(image_file_names)
+    if not image_file_names:
+        return
+
+    batch_size = get_probe_batch_size(len(image_file_names), max_workers)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    futures = [
+        executor.submit(probe_batch, image_file_names[start:start + batch_size])
+        for start in range(0, len(image_file_names), batch_size)]
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            yield from future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
 
 
 if __name__ == '__main__':
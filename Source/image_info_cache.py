@@ -0,0 +1,275 @@
+"""
+A persistent index of image header information, so that unchanged images don't need to be re-opened,
+and of the images' content hashes (see frame_cache.get_source_hash), so that they don't need to be read again
+to look up their converted frames.
+
+Entries are keyed by the image's path, size and modification time (in nanoseconds),
+so a file that has been modified or replaced is never served from the cache.
+The index is a SQLite database in the user cache directory.
+"""
+import doctest
+import logging
+import os
+import sqlite3
+import threading
+
+import directories
+import image_helper
+
+
+logger = logging.getLogger(__name__)
+
+# Bump this whenever the schema or the meaning of the stored values changes.
+# Databases with a different version are discarded and rebuilt.
+_SCHEMA_VERSION = 2
+
+
+def get_default_database_path():
+    return os.path.join(directories.get_user_cache_directory(), 'image_info.sqlite3')
+
+
+class ImageInfoCache:
+    """Looks up and stores ImageInfo's.  Safe to use from multiple threads.
+
+    Entries are loaded from the database one directory at a time, the first time a file in that directory
+    is looked up, so that a lookup is a dictionary access rather than a query.
+    New entries are buffered in memory until flush is called.
+    Content hashes are kept in the same way, with get_source_hash and put_source_hash.
+
+    hits and misses count the image info lookups since the cache was created.
+
+    >>> cache = ImageInfoCache(':memory:')
+    >>> info = image_helper.ImageInfo(os.path.abspath(__file__), 'image/png', 4, 3, 1, 2)
+    >>> cache.put(info)
+    >>> cache.flush()
+    >>> cache.get_entry(info.path, 1, 2) == info
+    True
+    >>> cache.get_entry(info.path, 1, 3) is None
+    True
+    >>> cache.hits, cache.misses
+    (1, 1)
+    >>> cache.put_source_hash(info.path, 1, 2, '0123abcd')
+    >>> cache.get_source_hash_entry(info.path, 1, 2)
+    '0123abcd'
+    >>> cache.get_source_hash_entry(info.path, 1, 3) is None
+    True
+    >>> cache.invalidate()
+    >>> cache.get_entry(info.path, 1, 2) is None
+    True
+    >>> cache.get_source_hash_entry(info.path, 1, 2) is None
+    True
+    """
+
+    def __init__(self, database_path=None):
+        self.database_path = database_path or get_default_database_path()
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        # directory -> {file name: ImageInfo}
+        self._entries_by_directory = {}
+        self._pending_infos = []
+        # directory -> {file name: (size, modification time, source hash)}
+        self._source_hashes_by_directory = {}
+        # (path, size, modification time, source hash)
+        self._pending_source_hashes = []
+        self._connection = self._connect()
+
+    def _connect(self):
+        try:
+            return self._open_database()
+        except sqlite3.DatabaseError as error:
+            logger.warning("Discarding unreadable image info cache '{}': {}".format(self.database_path, error))
+            self._remove_database_file()
+            return self._open_database()
+
+    def _open_database(self):
+        connection = sqlite3.connect(self.database_path, timeout=30, check_same_thread=False)
+        version, = connection.execute('PRAGMA user_version').fetchone()
+        if version != _SCHEMA_VERSION:
+            connection.execute('DROP TABLE IF EXISTS image_info')
+            connection.execute('DROP TABLE IF EXISTS source_hash')
+            connection.execute('PRAGMA user_version = {}'.format(_SCHEMA_VERSION))
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS image_info ('
+            ' directory TEXT NOT NULL,'
+            ' name TEXT NOT NULL,'
+            ' size INTEGER NOT NULL,'
+            ' mtime_ns INTEGER NOT NULL,'
+            ' content_type TEXT NOT NULL,'
+            ' width INTEGER NOT NULL,'
+            ' height INTEGER NOT NULL,'
+            ' PRIMARY KEY (directory, name))')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS source_hash ('
+            ' directory TEXT NOT NULL,'
+            ' name TEXT NOT NULL,'
+            ' size INTEGER NOT NULL,'
+            ' mtime_ns INTEGER NOT NULL,'
+            ' hash TEXT NOT NULL,'
+            ' PRIMARY KEY (directory, name))')
+        connection.commit()
+        return connection
+
+    def _remove_database_file(self):
+        if self.database_path == ':memory:':
+            return
+        try:
+            os.remove(self.database_path)
+        except OSError:
+            pass
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, file_name):
+        """Returns the cached ImageInfo for file_name if the file is unchanged, otherwise None.
+        Stats the file, but doesn't open it.
+        """
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        info = self.get_entry(file_name, stat.st_size, stat.st_mtime_ns)
+        if info is not None:
+            # Keep the path as the caller spelled it.
+            info = info._replace(path=file_name)
+        return info
+
+    def get_entry(self, file_name, size, mtime_ns):
+        """Returns the cached ImageInfo for file_name if it was stored with the same size and mtime_ns, otherwise None."""
+        directory, name = os.path.split(os.path.abspath(file_name))
+        with self._lock:
+            entries = self._get_directory_entries(directory)
+            info = entries.get(name)
+            if info is not None and info.size == size and info.mtime_ns == mtime_ns:
+                self.hits += 1
+                return info
+            self.misses += 1
+            return None
+
+    def _get_directory_entries(self, directory):
+        """Must be called with the lock held."""
+        entries = self._entries_by_directory.get(directory)
+        if entries is None:
+            rows = self._connection.execute(
+                'SELECT name, size, mtime_ns, content_type, width, height FROM image_info WHERE directory = ?',
+                (directory,))
+            entries = {
+                name: image_helper.ImageInfo(os.path.join(directory, name), content_type, width, height, size, mtime_ns)
+                for name, size, mtime_ns, content_type, width, height in rows}
+            self._entries_by_directory[directory] = entries
+        return entries
+
+    def _get_directory_source_hashes(self, directory):
+        """Must be called with the lock held."""
+        source_hashes = self._source_hashes_by_directory.get(directory)
+        if source_hashes is None:
+            rows = self._connection.execute(
+                'SELECT name, size, mtime_ns, hash FROM source_hash WHERE directory = ?',
+                (directory,))
+            source_hashes = {name: (size, mtime_ns, source_hash) for name, size, mtime_ns, source_hash in rows}
+            self._source_hashes_by_directory[directory] = source_hashes
+        return source_hashes
+
+    def get_source_hash(self, file_name):
+        """Returns the cached content hash of file_name if the file is unchanged, otherwise None.
+        Stats the file, but doesn't open it.
+        """
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            return None
+        return self.get_source_hash_entry(file_name, stat.st_size, stat.st_mtime_ns)
+
+    def get_source_hash_entry(self, file_name, size, mtime_ns):
+        """Returns the cached content hash of file_name if it was stored with the same size and mtime_ns,
+        otherwise None.
+        """
+        directory, name = os.path.split(os.path.abspath(file_name))
+        with self._lock:
+            entry = self._get_directory_source_hashes(directory).get(name)
+        if entry is not None and entry[:2] == (size, mtime_ns):
+            return entry[2]
+        return None
+
+    def put_source_hash(self, file_name, size, mtime_ns, source_hash):
+        """Stores the content hash of file_name, which had size and mtime_ns when it was read."""
+        path = os.path.abspath(file_name)
+        directory, name = os.path.split(path)
+        with self._lock:
+            self._get_directory_source_hashes(directory)[name] = (size, mtime_ns, source_hash)
+            self._pending_source_hashes.append((path, size, mtime_ns, source_hash))
+
+    def put(self, info):
+        """Stores info.  Infos for files that couldn't be stat'ed are ignored."""
+        if info.size < 0:
+            return
+        info = info._replace(path=os.path.abspath(info.path))
+        directory, name = os.path.split(info.path)
+        with self._lock:
+            self._get_directory_entries(directory)[name] = info
+            self._pending_infos.append(info)
+
+    def flush(self):
+        """Writes the entries stored since the last flush to the database."""
+        with self._lock:
+            pending_infos, self._pending_infos = self._pending_infos, []
+            pending_source_hashes, self._pending_source_hashes = self._pending_source_hashes, []
+            if not pending_infos and not pending_source_hashes:
+                return
+            rows = [
+                (*os.path.split(info.path), info.size, info.mtime_ns, info.content_type, info.width, info.height)
+                for info in pending_infos]
+            source_hash_rows = [
+                (*os.path.split(path), size, mtime_ns, source_hash)
+                for path, size, mtime_ns, source_hash in pending_source_hashes]
+            with self._connection:
+                self._connection.executemany('INSERT OR REPLACE INTO image_info VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+                self._connection.executemany('INSERT OR REPLACE INTO source_hash VALUES (?, ?, ?, ?, ?)', source_hash_rows)
+        logger.debug('Image info cache: wrote {} entries; {} hits, {} misses so far.'.format(
+            len(rows) + len(source_hash_rows),
+            self.hits,
+            self.misses))
+
+    def invalidate(self, directory=None):
+        """Removes the entries for the images in directory, or every entry if directory is None."""
+        with self._lock:
+            with self._connection:
+                if directory is None:
+                    self._pending_infos = []
+                    self._entries_by_directory.clear()
+                    self._pending_source_hashes = []
+                    self._source_hashes_by_directory.clear()
+                    self._connection.execute('DELETE FROM image_info')
+                    self._connection.execute('DELETE FROM source_hash')
+                else:
+                    directory = os.path.abspath(directory)
+                    self._pending_infos = [
+                        info for info in self._pending_infos if os.path.dirname(info.path) != directory]
+                    self._entries_by_directory.pop(directory, None)
+                    self._pending_source_hashes = [
+                        entry for entry in self._pending_source_hashes if os.path.dirname(entry[0]) != directory]
+                    self._source_hashes_by_directory.pop(directory, None)
+                    self._connection.execute('DELETE FROM image_info WHERE directory = ?', (directory,))
+                    self._connection.execute('DELETE FROM source_hash WHERE directory = ?', (directory,))
+
+    def get_statistics_message(self):
+        """
+        >>> ImageInfoCache(':memory:').get_statistics_message()
+        'Image info cache: 0 hits, 0 misses.'
+        """
+        return 'Image info cache: {} hits, {} misses.'.format(self.hits, self.misses)
+
+if __name__ == '__main__':
+    doctest.testmod()
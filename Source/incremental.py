@@ -0,0 +1,273 @@
+"""
+Keeps a movie of a growing capture directory up to date by encoding only the frames added since the last run.
+
+A manifest next to the movie (TimeLapse.mp4.manifest.json) records the frames that the movie contains
+and the settings it was encoded with.  When the frames in the manifest are still the first frames of the sequence
+(unchanged, and in the same order) and the settings match, only the new frames are encoded, as a segment,
+which is then joined onto the existing movie without re-encoding it.
+Otherwise the whole movie is encoded again.
+"""
+import doctest
+import importlib.util
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import encoders
+import image_helper
+
+
+logger = logging.getLogger(__name__)
+
+# Bump this whenever the manifest format changes.  Manifests with a different version are ignored.
+_MANIFEST_VERSION = 1
+
+
+def get_manifest_path(movie_path):
+    return movie_path + '.manifest.json'
+
+
+def get_movie_settings(encoder, frames_per_second, width, height, frame_parameters=None):
+    """Returns everything (other than the frames) that affects how a movie is encoded.
+    frame_parameters describes how the frames were converted before they were encoded
+    (e.g. prescale.get_scale_parameters), or is None if they weren't.
+    A segment can only be joined onto a movie with the same settings.
+
+    >>> get_movie_settings(encoders.MEncoderBackend(), 24, None, None)
+    {'encoder': 'mencoder', 'encoder_options': {}, 'frames_per_second': 24.0, 'width': None, 'height': None, 'frame_parameters': None}
+    """
+    return {
+        'encoder': encoder.name,
+        # e.g. the ffmpeg backend's codec and preset.
+        'encoder_options': encoder.get_options(),
+        'frames_per_second': float(frames_per_second),
+        'width': width,
+        'height': height,
+        'frame_parameters': frame_parameters,
+    }
+
+
+def get_frame_record(image_file_name):
+    """Returns [path, size, modification-time], which changes if the frame is modified or replaced."""
+    stat = os.stat(image_file_name)
+    return [os.path.abspath(image_file_name), stat.st_size, stat.st_mtime_ns]
+
+
+def read_manifest(movie_path):
+    """Returns the manifest for movie_path, or None if there isn't a usable one."""
+    try:
+        with open(get_manifest_path(movie_path)) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or manifest.get('version') != _MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def write_manifest(movie_path, settings, frame_records):
+    manifest_path = get_manifest_path(movie_path)
+    temporary_manifest_path = manifest_path + '.tmp'
+    with open(temporary_manifest_path, 'w') as manifest_file:
+        json.dump({'version': _MANIFEST_VERSION, 'settings': settings, 'frames': frame_records}, manifest_file)
+    os.replace(temporary_manifest_path, manifest_path)
+
+
+def get_new_frame_count(manifest, settings, frame_records):
+    """Returns how many of the frames (from the end of frame_records) aren't in the movie yet,
+    or None if the movie has to be encoded again from the beginning.
+
+    >>> manifest = {'settings': {'fps': 24}, 'frames': [['a.jpg', 1, 2], ['b.jpg', 1, 2]]}
+    >>> get_new_frame_count(manifest, {'fps': 24}, [['a.jpg', 1, 2], ['b.jpg', 1, 2], ['c.jpg', 1, 2]])
+    1
+    >>> get_new_frame_count(manifest, {'fps': 30}, [['a.jpg', 1, 2], ['b.jpg', 1, 2], ['c.jpg', 1, 2]]) is None
+    True
+    >>> get_new_frame_count(manifest, {'fps': 24}, [['a.jpg', 1, 2], ['b.jpg', 1, 3], ['c.jpg', 1, 2]]) is None
+    True
+    """
+    if manifest is None or manifest.get('settings') != settings:
+        return None
+    encoded_frame_records = manifest.get('frames', [])
+    if not encoded_frame_records or frame_records[:len(encoded_frame_records)] != encoded_frame_records:
+        return None
+    return len(frame_records) - len(encoded_frame_records)
+
+
+def update_movie_from_images(image_file_names, frames_per_second, movie_path, width=None, height=None, encoder=None, progress_callback=None, cancel_event=None, source_image_file_names=None, frame_parameters=None):
+    """Brings the movie at movie_path up to date with image_file_names, encoding only the frames that were
+    added since it was last updated when possible.
+    source_image_file_names are the frames that image_file_names were converted from (e.g. by
+    transcode.transcode_images or prescale.prescale_images), in the same order.  The manifest records them instead
+    of the converted frames, which are given a new modification time whenever the frame cache reuses them.
+    frame_parameters describes how the frames were converted when that depends on more than the source frames
+    (e.g. prescale.get_scale_parameters), so that a change re-encodes the movie (see get_movie_settings).
+    encoder is the encoders.EncoderBackend to use (default: encoders.get_encoder()).
+    progress_callback is optionally called with progress.Progress reports for the frames being encoded.
+    Setting cancel_event (a threading.Event) stops the encode; the existing movie is left as it was.
+    Returns the path to the movie or None on failure.
+    """
+    encoder = encoder or encoders.get_encoder()
+    image_encoding, error_message = image_helper.get_image_encoding_from_file_names(image_file_names)
+    if image_encoding == image_helper.ImageEncoding.unknown:
+        logger.error(error_message)
+        return
+
+    settings = get_movie_settings(encoder, frames_per_second, width, height, frame_parameters)
+    frame_records = [
+        get_frame_record(image_file_name) for image_file_name in (source_image_file_names or image_file_names)]
+    new_frame_count = None
+    if os.path.exists(movie_path):
+        new_frame_count = get_new_frame_count(read_manifest(movie_path), settings, frame_records)
+
+    if new_frame_count == 0:
+        logger.info("'{}' is up to date.".format(movie_path))
+        return os.path.realpath(movie_path)
+
+    # Nothing is written to movie_path until the new movie is complete, so a failure leaves the old movie intact.
+    workspace_directory = tempfile.mkdtemp(prefix='TimeLapseAppend-', dir=os.path.dirname(movie_path) or None)
+    try:
+        updated_movie_path = os.path.join(workspace_directory, 'Updated' + encoder.movie_file_extension)
+        if new_frame_count is None:
+            logger.info('Encoding all {} frames.'.format(len(image_file_names)))
+            updated_movie_path = encoder.create_movie_from_images(
+                image_file_names,
+                frames_per_second,
+                width,
+                height,
+                progress_callback=progress_callback,
+                cancel_event=cancel_event,
+                movie_path=updated_movie_path,
+                working_directory=workspace_directory)
+        else:
+            logger.info('Appending {} new frames to the {} already in the movie.'.format(
+                new_frame_count,
+                len(image_file_names) - new_frame_count))
+            new_image_file_names = image_file_names[-new_frame_count:]
+            segment_path = encoder.encode_images_to_movie(
+                new_image_file_names,
+                frames_per_second,
+                image_encoding,
+                os.path.join(workspace_directory, 'Segment' + encoder.movie_file_extension),
+                os.path.join(workspace_directory, 'FileNames.txt'),
+                width,
+                height,
+                output_line_handler=encoders.get_output_line_handler(new_frame_count, progress_callback),
+                cancel_event=cancel_event)
+            if segment_path:
+                updated_movie_path = encoder.concatenate_movies([movie_path, segment_path], updated_movie_path, cancel_event)
+            else:
+                updated_movie_path = None
+
+        if not updated_movie_path:
+            return
+        os.replace(updated_movie_path, movie_path)
+        write_manifest(movie_path, settings, frame_records)
+        return os.path.realpath(movie_path)
+    finally:
+        shutil.rmtree(workspace_directory, ignore_errors=True)
+
+
+class _PrintingEncoder(encoders.EncoderBackend):
+    """An encoder for the doctests, which prints how many frames it encodes instead of encoding them."""
+
+    name = 'printing'
+    movie_file_extension = '.txt'
+
+    def encode_images_to_movie(self, image_file_names, frames_per_second, image_encoding, movie_path, file_name_list_file_name, width=None, height=None, output_line_handler=None, cancel_event=None):
+        print('Encoded {} {} frames.'.format(len(image_file_names), image_encoding))
+        with open(movie_path, 'w') as movie_file:
+            movie_file.write('{}\n'.format(len(image_file_names)))
+        return movie_path
+
+    def concatenate_movies(self, movie_paths, output_movie_path, cancel_event=None):
+        with open(output_movie_path, 'w') as output_movie_file:
+            for movie_path in movie_paths:
+                with open(movie_path) as movie_file:
+                    output_movie_file.write(movie_file.read())
+        return output_movie_path
+
+
+# Converted frames are reused from the frame cache, which gives them a new modification time,
+# so a mixed selection has to be tracked by its source frames to be updated incrementally.
+_MIXED_ENCODINGS_TEST = """
+>>> import tempfile
+>>> import frame_cache
+>>> import transcode
+>>> from PIL import Image
+>>> temporary_directory = tempfile.TemporaryDirectory()
+>>> cache = frame_cache.FrameCache(os.path.join(temporary_directory.name, 'Cache'))
+>>> movie_path = os.path.join(temporary_directory.name, 'TimeLapse.txt')
+>>> def render(source_image_file_names):
+...     image_file_names, error_message = transcode.transcode_images(source_image_file_names, max_workers=1, cache=cache)
+...     return update_movie_from_images(
+...         image_file_names,
+...         24,
+...         movie_path,
+...         encoder=_PrintingEncoder(),
+...         source_image_file_names=source_image_file_names) is not None
+>>> source_image_file_names = []
+>>> for index, extension in enumerate(['.jpg', '.png', '.jpg', '.png', '.jpg']):
+...     source_image_file_names.append(os.path.join(temporary_directory.name, '{}{}'.format(index, extension)))
+...     Image.new('RGB', (8, 8), (index, 0, 0)).save(source_image_file_names[-1])
+>>> render(source_image_file_names[:3])
+Encoded 3 JPEG frames.
+True
+>>> render(source_image_file_names)
+Encoded 2 JPEG frames.
+True
+>>> render(source_image_file_names)
+True
+>>> with open(movie_path) as movie_file:
+...     movie_file.read().split()
+['3', '2']
+>>> temporary_directory.cleanup()
+"""
+
+# Scaled frames are reused from the frame cache in the same way, so they are tracked by their source frames too,
+# and the size they were scaled to is part of the settings.
+_PRESCALED_FRAMES_TEST = """
+>>> import tempfile
+>>> import frame_cache
+>>> import prescale
+>>> from PIL import Image
+>>> temporary_directory = tempfile.TemporaryDirectory()
+>>> cache = frame_cache.FrameCache(os.path.join(temporary_directory.name, 'Cache'))
+>>> movie_path = os.path.join(temporary_directory.name, 'TimeLapse.txt')
+>>> def render(source_image_file_names, width):
+...     image_file_names, error_message = prescale.prescale_images(
+...         source_image_file_names, width, 4, max_workers=1, cache=cache)
+...     return update_movie_from_images(
+...         image_file_names,
+...         24,
+...         movie_path,
+...         encoder=_PrintingEncoder(),
+...         source_image_file_names=source_image_file_names,
+...         frame_parameters=prescale.get_scale_parameters(width, 4, prescale.DEFAULT_RESAMPLE_FILTER)) is not None
+>>> source_image_file_names = []
+>>> for index in range(3):
+...     source_image_file_names.append(os.path.join(temporary_directory.name, '{}.jpg'.format(index)))
+...     Image.new('RGB', (8, 8), (index, 0, 0)).save(source_image_file_names[-1])
+>>> render(source_image_file_names[:2], 4)
+Encoded 2 JPEG frames.
+True
+>>> render(source_image_file_names, 4)
+Encoded 1 JPEG frames.
+True
+>>> render(source_image_file_names, 4)
+True
+>>> render(source_image_file_names, 2)
+Encoded 3 JPEG frames.
+True
+>>> temporary_directory.cleanup()
+"""
+
+__test__ = {}
+# Transcoding and pre-scaling require Pillow.
+if importlib.util.find_spec('PIL') is not None:
+    __test__['mixed_encodings'] = _MIXED_ENCODINGS_TEST
+    __test__['prescaled_frames'] = _PRESCALED_FRAMES_TEST
+
+if __name__ == '__main__':
+    doctest.testmod()
@@ -7,15 +7,21 @@ MPlayer/MEncoder man page: http://tivo-mplayer.sourceforge.net/docs/mplayer-man.
 import doctest
 import logging
 import os
-import subprocess
 
 import directories
+import encoder_discovery
+import encoder_process
 import image_helper
 import platform_helper
+import profiling
 
 
 logger = logging.getLogger(__name__)
 
+# When set, the MEncoder executable to use instead of the bundled one (e.g. a system MEncoder,
+# or the benchmarks' stand-in encoder).
+MENCODER_PATH_ENVIRONMENT_VARIABLE = 'TIMELAPSE_MENCODER_PATH'
+
 
 def create_movie_from_images(image_file_names, frames_per_second, width=None, height=None):
     """image_file_names should be a list of images whose length is at least 1.
@@ -31,35 +37,118 @@ def create_movie_from_images(image_file_names, frames_per_second, width=None, he
 
 
 def _create_movie_from_images_with_image_encoding(image_file_names, frames_per_second, image_encoding, width=None, height=None):
-    image_encoding_str = _get_image_encoding_str(image_encoding)
-
     input_directory = os.path.dirname(image_file_names[0])
     movie_path = os.path.join(input_directory, 'TimeLapse.avi')
-
     file_name_list_file_name = os.path.join(input_directory, 'FileNames.txt')
-    write_image_file_names(file_name_list_file_name, image_file_names)
 
+    return encode_images_to_movie(
+        image_file_names,
+        frames_per_second,
+        image_encoding,
+        movie_path,
+        file_name_list_file_name,
+        width,
+        height)
+
+
+def encode_images_to_movie(image_file_names, frames_per_second, image_encoding, movie_path, file_name_list_file_name, width=None, height=None, thread_count=None, output_line_handler=None, cancel_event=None):
+    """Encodes image_file_names (which must all have image_encoding) into movie_path,
+    using file_name_list_file_name for the list of images passed to MEncoder.
+    thread_count is the most threads MEncoder may use (default: one per core, up to libavcodec's limit).
+    output_line_handler is optionally called with each line of MEncoder's output while it runs.
+    Setting cancel_event (a threading.Event) stops MEncoder and removes the partial movie and the list file.
+    Returns the path to the created movie or None on failure.
+    """
+    image_encoding_str = _get_image_encoding_str(image_encoding)
+    with profiling.span('write_image_file_names', frames=len(image_file_names)):
+        write_image_file_names(file_name_list_file_name, image_file_names)
+
+    mencoder_args = [
+        'mf://@{}'.format(file_name_list_file_name),
+        '-mf',
+        'type={}:fps={}'.format(image_encoding_str, frames_per_second),
+        *_get_output_args(movie_path, width, height, thread_count)
+        ]
+
+    exit_status = _run_mencoder_command(mencoder_args, output_line_handler=output_line_handler, cancel_event=cancel_event)
+    if encoder_process.remove_outputs_if_cancelled(cancel_event, movie_path, file_name_list_file_name):
+        return
+    return _get_movie_path_from_exit_status(movie_path, exit_status)
+
+
+def create_movie_from_image_stream(image_datas, image_encoding, frames_per_second, movie_path, width=None, height=None, thread_count=None, output_line_handler=None, cancel_event=None):
+    """Creates a movie from compressed images that are piped to MEncoder's stdin, instead of being read from files.
+    image_datas is an iterable of the encoded image bytes (all with image_encoding), in frame order.
+    It is consumed while MEncoder runs, so it can be a generator reading from an archive or network.
+    Returns the path to the created movie or None on failure.
+    """
+    mencoder_args = [
+        '-',
+        '-demuxer',
+        'lavf',
+        '-lavfdopts',
+        'format={}'.format(_get_image_stream_format_str(image_encoding)),
+        '-fps',
+        '{}'.format(frames_per_second),
+        '-ofps',
+        '{}'.format(frames_per_second),
+        *_get_output_args(movie_path, width, height, thread_count)
+        ]
+
+    exit_status = _run_mencoder_command(
+        mencoder_args,
+        input_chunks=image_datas,
+        output_line_handler=output_line_handler,
+        cancel_event=cancel_event)
+    if encoder_process.remove_outputs_if_cancelled(cancel_event, movie_path):
+        return
+    return _get_movie_path_from_exit_status(movie_path, exit_status)
+
+
+def concatenate_movies(movie_paths, output_movie_path, cancel_event=None):
+    """Joins movie_paths (which must have the same codec, resolution and frame rate) into output_movie_path,
+    copying the video stream without re-encoding it.
+    Returns the path to the joined movie or None on failure.
+    """
+    mencoder_args = [
+        *movie_paths,
+        '-nosound',
+        '-ovc',
+        'copy',
+        '-o',
+        '{}'.format(output_movie_path)
+        ]
+
+    exit_status = _run_mencoder_command(mencoder_args, cancel_event=cancel_event)
+    if encoder_process.remove_outputs_if_cancelled(cancel_event, output_movie_path):
+        return
+    return _get_movie_path_from_exit_status(output_movie_path, exit_status)
+
+
+def _get_output_args(movie_path, width, height, thread_count=None):
     scale_option = []
     if width and height:
         scale_option = ['-vf', 'scale={}:{}'.format(width, height)]
     elif width or height:
         raise ValueError('To scale the images, you must specify both the width and the height.')
 
-    mencoder_args = [
-        'mf://@{}'.format(file_name_list_file_name),
-        '-mf',
-        'type={}:fps={}'.format(image_encoding_str, frames_per_second),
+    lavc_options = 'vcodec=mpeg4:mbd=2:trell'
+    lavc_thread_count = _get_lavc_thread_count(thread_count)
+    if lavc_thread_count:
+        lavc_options += ':threads={}'.format(lavc_thread_count)
+
+    return [
         *scale_option,
         '-ovc',
         'lavc',
         '-lavcopts',
-        'vcodec=mpeg4:mbd=2:trell',
+        lavc_options,
         '-o',
         '{}'.format(movie_path)
         ]
 
-    exit_status = _run_mencoder_command(mencoder_args)
 
+def _get_movie_path_from_exit_status(movie_path, exit_status):
     if exit_status == 0:
         return os.path.realpath(movie_path)
     else:
@@ -79,36 +168,130 @@ def write_image_file_names(image_file_name_list_file_name, image_file_names):
         fileNameListFile.write('\n'.join(image_file_names))
 
 
-def _run_mencoder_command(mencoder_args):
+def _run_mencoder_command(mencoder_args, input_chunks=None, output_line_handler=None, cancel_event=None):
     """mencoder_args is a list of arguments to pass to MEncoder.
     It should not contain the MEncoder executable.
+
+    input_chunks is an optional iterable of bytes that are written to MEncoder's stdin while it runs.
+    MEncoder is run directly rather than through a shell, so that cancelling it terminates MEncoder itself.
     """
-    mencoder_directory = _get_mencoder_directory()
-    command = [_get_mencoder_path()] + mencoder_args
-    logger.debug(command)
-    logger.debug(' '.join(command))
+    mencoder_path = get_mencoder_path()
+    if not mencoder_path:
+        logger.error('MEncoder is not installed.')
+        return -1
+
+    command = [mencoder_path] + mencoder_args
+    with profiling.span('mencoder'):
+        return encoder_process.run_encoder_command(
+            command,
+            # The bundled MEncoder loads its DLLs and fonts from its own directory.
+            cwd=os.path.dirname(mencoder_path),
+            input_chunks=input_chunks,
+            output_line_handler=output_line_handler,
+            cancel_event=cancel_event)
+
+
+def is_available():
+    return get_mencoder_path() is not None
+
+
+def get_mencoder_path():
+    """Returns the path to MEncoder, or None if it isn't installed.
+    MENCODER_PATH_ENVIRONMENT_VARIABLE is used if it is set; otherwise the bundled MEncoder is preferred
+    to one on the PATH.
+    """
+    mencoder_path = os.environ.get(MENCODER_PATH_ENVIRONMENT_VARIABLE)
+    if mencoder_path:
+        return os.path.abspath(mencoder_path) if os.path.isfile(mencoder_path) else None
 
-    run_result = subprocess.run(command, cwd=mencoder_directory, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, shell=True)
-    logger.info(run_result.stdout)
-    return run_result.returncode
+    bundled_mencoder_directory = _get_bundled_mencoder_directory()
+    return encoder_discovery.find_executable(
+        _get_mencoder_file(),
+        [bundled_mencoder_directory] if bundled_mencoder_directory else [])
 
 
-def _get_mplayer_directory():
-    return os.path.join(directories.get_external_directory(), 'mplayer')
+def get_capabilities():
+    """Returns MEncoder's encoder_discovery.EncoderCapabilities, or None if it isn't installed or can't be run.
+    The codecs are MEncoder's -ovc codecs (e.g. lavc or x264).  The threaded ones aren't probed: they are the codecs
+    it has that are documented to take a threads option (see _THREADED_VIDEO_CODECS).
+    """
+    mencoder_path = get_mencoder_path()
+    if not mencoder_path:
+        return None
+    return encoder_discovery.get_capabilities(mencoder_path, _probe_mencoder)
+
+
+def _probe_mencoder(mencoder_path):
+    output = encoder_discovery.run_probe_command([mencoder_path, '-ovc', 'help'])
+    if output is None:
+        return None
+    video_codecs = parse_video_codecs(output)
+    return video_codecs, [video_codec for video_codec in video_codecs if video_codec in _THREADED_VIDEO_CODECS]
 
 
-def _get_mencoder_path():
-    return os.path.join(_get_mencoder_directory(), _get_mencoder_file())
+# The -ovc codecs that take a threads option (-lavcopts threads=N, -x264encopts threads=N).
+# MEncoder can't list its suboptions, so this isn't probed: a build's threaded video codecs are just the ones
+# in this list that its -ovc help lists.
+_THREADED_VIDEO_CODECS = ['lavc', 'x264']
 
+# -lavcopts threads is limited to 1-8.
+_MAX_LAVC_THREAD_COUNT = 8
 
-def _get_mencoder_directory():
+
+def parse_video_codecs(ovc_help_output):
+    """Returns the video codecs listed by mencoder -ovc help.
+
+    >>> parse_video_codecs('''MEncoder Sherpya-SVN-r37165-4.5.3 (C) 2000-2014 MPlayer Team
+    ... Available codecs:
+    ...    copy     - frame copy, without re-encoding. Doesn't work with filters.
+    ...    raw      - uncompressed video. Use fourcc option to set format explicitly.
+    ...    lavc     - libavcodec codecs - best quality!
+    ...    x264     - H.264 encoding
+    ...
+    ... Exiting... (End of file)''')
+    ['copy', 'raw', 'lavc', 'x264']
+    """
+    video_codecs = []
+    lines = iter(ovc_help_output.splitlines())
+    for line in lines:
+        if line.strip().startswith('Available codecs:'):
+            break
+    for line in lines:
+        name, separator, description = line.strip().partition(' - ')
+        if not separator:
+            break
+        video_codecs.append(name.strip())
+    return video_codecs
+
+
+def _get_lavc_thread_count(thread_count=None):
+    """Returns the number of threads for MEncoder's libavcodec encoder to use, at most thread_count
+    (default: one per core), or None if it should use a single thread.
+    """
+    thread_count = min(thread_count or os.cpu_count() or 1, _MAX_LAVC_THREAD_COUNT)
+    if thread_count <= 1:
+        return None
+    capabilities = get_capabilities()
+    if capabilities is None or 'lavc' not in capabilities.threaded_video_codecs:
+        return None
+    return thread_count
+
+
+def _get_mplayer_directory():
+    return os.path.join(directories.get_external_directory(), 'mplayer')
+
+
+def _get_bundled_mencoder_directory():
+    """Returns the directory of the bundled MEncoder for this platform."""
     platform = platform_helper.get_platform()
     if platform == platform_helper.Platforms.mac:
         platform_specific_mplayer_directory = 'Mac'
     elif platform == platform_helper.Platforms.windows:
         platform_specific_mplayer_directory = 'Windows'
+    elif platform == platform_helper.Platforms.linux:
+        platform_specific_mplayer_directory = 'Linux'
     else:
-        raise ValueError("Unknown platform.")
+        return None
 
     return os.path.join(_get_mplayer_directory(), platform_specific_mplayer_directory)
 
@@ -121,6 +304,25 @@ def _get_mencoder_file():
         return "mencoder"
 
 
+def _get_image_stream_format_str(encoding):
+    """The libavformat demuxer for a stream of concatenated images.
+
+    >>> _get_image_stream_format_str(image_helper.ImageEncoding.jpeg)
+    'mjpeg'
+    >>> _get_image_stream_format_str(image_helper.ImageEncoding.png)
+    'png_pipe'
+    """
+    if encoding == image_helper.ImageEncoding.jpeg:
+        # Concatenated JPEGs are a Motion JPEG stream.
+        return 'mjpeg'
+    elif encoding == image_helper.ImageEncoding.png:
+        return 'png_pipe'
+    elif encoding == image_helper.ImageEncoding.unknown:
+        raise ValueError("Unknown encoding.")
+    else:
+        raise ValueError("Encoding '{}' is not supported.".format(encoding))
+
+
 def _get_image_encoding_str(encoding):
     """
     >>> _get_image_encoding_str(image_helper.ImageEncoding.jpeg)
@@ -9,6 +9,7 @@ logger = logging.getLogger(__name__)
 class Platforms:
     mac = 0
     windows = 1
+    linux = 2
 
 
 def get_platform():
@@ -16,6 +17,8 @@ def get_platform():
         return Platforms.mac
     elif sys.platform in ["Windows", "win32"]:
         return Platforms.windows
+    elif sys.platform.startswith("linux"):
+        return Platforms.linux
     else:
         logger.error("Unknown platform '{}'.  Attempting to continue assuming Windows.".format(sys.platform))
         return Platforms.windows
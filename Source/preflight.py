@@ -0,0 +1,203 @@
+"""
+Checks every frame before encoding, so that a bad frame fails fast instead of part way through a long encode.
+
+Each frame is checked (in parallel) for being readable, having a recognized image header,
+having the same size as the rest of the frames and ending with a valid trailer (which catches truncated files).
+Only the header and the last few bytes of each file are read.
+"""
+import collections
+import doctest
+import json
+import logging
+import os
+
+import image_helper
+
+
+logger = logging.getLogger(__name__)
+
+
+class FrameProblems:
+    unreadable = 'unreadable'
+    unrecognized = 'unrecognized'
+    truncated = 'truncated'
+    mismatched_size = 'mismatched-size'
+
+
+# The number of bytes at the end of each file that are searched for the image trailer.
+# JPEGs from some cameras have padding or extra data after the end-of-image marker.
+_TRAILER_SEARCH_SIZE = 1024
+
+_JPEG_END_OF_IMAGE = b'\377\331'
+_PNG_END_CHUNK = b'IEND\256B`\202'
+
+
+# path is the frame's file name, problem is a FrameProblems value and detail is a human-readable explanation.
+BadFrame = collections.namedtuple('BadFrame', ['path', 'problem', 'detail'])
+
+
+class PreflightReport:
+    """The result of check_images.
+
+    image_file_names are the frames that passed, in their original order.
+    width and height are the size that most frames have (-1 if no frame could be read).
+    """
+
+    def __init__(self, frame_count, image_file_names, bad_frames, width, height):
+        self.frame_count = frame_count
+        self.image_file_names = image_file_names
+        self.bad_frames = bad_frames
+        self.width = width
+        self.height = height
+
+    def is_ok(self):
+        return not self.bad_frames
+
+    def to_dict(self):
+        return {
+            'frame_count': self.frame_count,
+            'good_frame_count': len(self.image_file_names),
+            'width': self.width,
+            'height': self.height,
+            'bad_frames': [bad_frame._asdict() for bad_frame in self.bad_frames],
+        }
+
+    def write_json(self, report_path):
+        with open(report_path, 'w') as report_file:
+            json.dump(self.to_dict(), report_file, indent=2)
+
+    def get_summary_message(self):
+        """
+        >>> PreflightReport(3, ['a.jpg', 'b.jpg'], [BadFrame('c.jpg', 'truncated', '')], 4, 3).get_summary_message()
+        "1 of 3 frames failed the preflight check; the first is 'c.jpg' (truncated)."
+        >>> PreflightReport(2, ['a.jpg', 'b.jpg'], [], 4, 3).get_summary_message()
+        'All 2 frames passed the preflight check.'
+        """
+        if self.is_ok():
+            return 'All {} frames passed the preflight check.'.format(self.frame_count)
+        first_bad_frame = self.bad_frames[0]
+        detail = first_bad_frame.problem
+        if first_bad_frame.detail:
+            detail = '{}: {}'.format(detail, first_bad_frame.detail)
+        return "{} of {} frames failed the preflight check; the first is '{}' ({}).".format(
+            len(self.bad_frames),
+            self.frame_count,
+            first_bad_frame.path,
+            detail)
+
+
+def check_images(image_file_names, max_workers=image_helper.DEFAULT_PROBE_WORKER_COUNT, cache=None):
+    """Checks all of image_file_names in parallel and returns a PreflightReport.
+
+    cache is an optional image_info_cache.ImageInfoCache used for the image headers.
+    """
+    results = {}
+    for info, problem, detail in image_helper.run_batches_in_parallel(
+            image_file_names,
+            lambda file_names: [_check_image(file_name, cache) for file_name in file_names],
+            max_workers):
+        results[info.path] = (info, problem, detail)
+    if cache is not None:
+        cache.flush()
+
+    size_counts = collections.Counter(
+        (info.width, info.height) for info, problem, detail in results.values() if not problem)
+    if size_counts:
+        (width, height), count = size_counts.most_common(1)[0]
+    else:
+        width, height = -1, -1
+
+    good_image_file_names = []
+    bad_frames = []
+    for file_name in image_file_names:
+        info, problem, detail = results[file_name]
+        if not problem and (info.width, info.height) != (width, height):
+            problem = FrameProblems.mismatched_size
+            detail = '{}x{} instead of {}x{}'.format(info.width, info.height, width, height)
+
+        if problem:
+            bad_frames.append(BadFrame(file_name, problem, detail))
+        else:
+            good_image_file_names.append(file_name)
+
+    return PreflightReport(len(image_file_names), good_image_file_names, bad_frames, width, height)
+
+
+def _check_image(file_name, cache):
+    """Returns (ImageInfo, problem, detail), where problem is '' if the image is OK."""
+    info = cache.get(file_name) if cache is not None else None
+    try:
+        with open(file_name, 'rb') as file:
+            if info is None:
+                stat = os.fstat(file.fileno())
+                content_type, width, height = image_helper.get_image_info_from_file(file)
+                info = image_helper.ImageInfo(file_name, content_type, width, height, stat.st_size, stat.st_mtime_ns)
+                if cache is not None:
+                    cache.put(info)
+
+            if not info.content_type or info.width <= 0 or info.height <= 0:
+                return info, FrameProblems.unrecognized, 'no image header found'
+
+            file.seek(max(0, info.size - _TRAILER_SEARCH_SIZE))
+            tail = file.read(_TRAILER_SEARCH_SIZE)
+    except OSError as error:
+        info = image_helper.ImageInfo(file_name, '', -1, -1, -1, -1)
+        return info, FrameProblems.unreadable, str(error)
+
+    if not _has_valid_trailer(info.content_type, tail):
+        return info, FrameProblems.truncated, 'no end-of-image trailer'
+    return info, '', ''
+
+
+def _has_valid_trailer(content_type, tail):
+    """
+    >>> _has_valid_trailer('image/jpeg', b'\\x12\\x34\\xff\\xd9')
+    True
+    >>> _has_valid_trailer('image/jpeg', b'\\x12\\x34\\xff\\x00')
+    False
+    >>> _has_valid_trailer('image/png', b'\\x00\\x00\\x00\\x00IEND\\xaeB`\\x82')
+    True
+    >>> _has_valid_trailer('image/png', b'\\x00\\x00\\x00\\x00IEND\\xaeB`\\x82\\x00\\x00')
+    True
+    >>> _has_valid_trailer('image/png', b'\\x00\\x00\\x00\\x00IDAT')
+    False
+    """
+    if content_type == 'image/jpeg':
+        return _JPEG_END_OF_IMAGE in tail
+    elif content_type == 'image/png':
+        # Like a JPEG's end marker, the IEND chunk may be followed by bytes that some cameras and editors append.
+        return _PNG_END_CHUNK in tail
+    else:
+        # There is no cheap check for other formats.
+        return True
+
+
+def get_valid_image_file_names(image_file_names, drop_bad_frames=False, report_path=None, cache=None):
+    """Runs the preflight check on image_file_names.
+    Returns (image-file-names, error-message).
+
+    When there are bad frames, they are either dropped from the returned image file names (if drop_bad_frames is True)
+    or an empty list and an error message are returned.
+    When report_path is set, a JSON report is written to it.
+    """
+    report = check_images(image_file_names, cache=cache)
+    if report_path:
+        report.write_json(report_path)
+
+    summary_message = report.get_summary_message()
+    if report.is_ok():
+        logger.info(summary_message)
+        return report.image_file_names, ''
+
+    if not drop_bad_frames:
+        return [], summary_message
+
+    logger.warning(summary_message)
+    for bad_frame in report.bad_frames:
+        logger.warning("Dropping '{}' ({}: {}).".format(bad_frame.path, bad_frame.problem, bad_frame.detail))
+    if not report.image_file_names:
+        return [], 'None of the frames passed the preflight check.'
+    return report.image_file_names, ''
+
+if __name__ == '__main__':
+    doctest.testmod()
@@ -0,0 +1,114 @@
+"""
+Scales frames to the movie resolution before encoding, in parallel, and caches the results.
+
+The encoders scale with a single-threaded filter, and do it again on every render.
+Instead, the frames are resized with Pillow in a process pool (one process per core), into a frame_cache.FrameCache
+keyed by (source contents, size, resampling filter), so a later render at the same resolution
+(e.g. at a different frame rate or with a different codec) reuses them without decoding or resizing anything.
+
+Pillow is optional; without it, is_available returns False and the encoders scale as before.
+"""
+import doctest
+import functools
+import io
+import logging
+
+import frame_cache
+
+# Pillow is optional.
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+logger = logging.getLogger(__name__)
+
+RESAMPLE_FILTERS = ['lanczos', 'bicubic', 'bilinear']
+DEFAULT_RESAMPLE_FILTER = 'lanczos'
+
+CACHE_DIRECTORY_NAME = 'ScaledFrames'
+
+# Bump this whenever the way frames are scaled or saved changes, so that old entries aren't reused.
+_SCALER_VERSION = 1
+
+_JPEG_QUALITY = 95
+# Favor speed: the scaled PNGs are only read once or twice by the encoder.
+_PNG_COMPRESS_LEVEL = 1
+
+
+def is_available():
+    return Image is not None
+
+
+def get_default_cache():
+    return frame_cache.FrameCache(frame_cache.get_default_cache_directory(CACHE_DIRECTORY_NAME))
+
+
+def get_scale_parameters(width, height, resample_filter):
+    """
+    >>> get_scale_parameters(1280, 720, 'lanczos')
+    '1280x720:lanczos:v1'
+    """
+    return '{}x{}:{}:v{}'.format(width, height, resample_filter, _SCALER_VERSION)
+
+
+def prescale_images(image_file_names, width, height, resample_filter=DEFAULT_RESAMPLE_FILTER, max_workers=None, cache=None, info_cache=None, cancel_event=None):
+    """Scales image_file_names to width x height, reusing any frames that have already been scaled.
+    max_workers is the number of worker processes (default: the number of cores).
+    cache is the frame_cache.FrameCache to use (default: get_default_cache()).
+    info_cache is an optional image_info_cache.ImageInfoCache (see frame_cache.convert_frames).
+    Setting cancel_event (a threading.Event) stops scaling.
+    Returns (scaled-image-file-names, error-message).  The scaled image file names are in the same order
+    and have the same encodings as image_file_names, and are empty on failure.
+    """
+    if not is_available():
+        return [], 'Pre-scaling requires Pillow (pip install Pillow).'
+    if resample_filter not in RESAMPLE_FILTERS:
+        raise ValueError("Unknown resampling filter '{}'.".format(resample_filter))
+
+    # The scaled images keep the sources' extensions (and so their encodings).
+    scaled_image_file_names, cached_count, error_message = frame_cache.convert_frames(
+        image_file_names,
+        functools.partial(_scale_image, width=width, height=height, resample_filter=resample_filter),
+        get_scale_parameters(width, height, resample_filter),
+        cache or get_default_cache(),
+        action='scale',
+        max_workers=max_workers,
+        info_cache=info_cache,
+        cancel_event=cancel_event)
+    if error_message:
+        return [], error_message
+
+    logger.info('Pre-scaled {} frames to {}x{} ({} were already scaled).'.format(
+        len(scaled_image_file_names),
+        width,
+        height,
+        cached_count))
+    return scaled_image_file_names, ''
+
+
+def _scale_image(image_data, scaled_image_file_name, width, height, resample_filter):
+    """Runs in a worker process."""
+    with Image.open(io.BytesIO(image_data)) as image:
+        image_format = image.format
+        if image_format == 'JPEG':
+            # Let the JPEG decoder skip detail that would be scaled away anyway (it decodes at 1/2, 1/4 or 1/8 scale).
+            image.draft('RGB', (width, height))
+        if image.mode not in ('RGB', 'RGBA', 'L'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        scaled_image = image.resize((width, height), _get_resample(resample_filter))
+
+    if image_format == 'JPEG':
+        scaled_image.save(scaled_image_file_name, 'JPEG', quality=_JPEG_QUALITY)
+    else:
+        scaled_image.save(scaled_image_file_name, 'PNG', compress_level=_PNG_COMPRESS_LEVEL)
+
+
+def _get_resample(resample_filter):
+    # Pillow 9.1 moved the filters into the Image.Resampling enum.
+    resampling = getattr(Image, 'Resampling', Image)
+    return getattr(resampling, resample_filter.upper())
+
+if __name__ == '__main__':
+    doctest.testmod()
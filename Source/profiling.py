@@ -0,0 +1,138 @@
+"""
+Times the stages of a render, and writes them as a Chrome trace (https://ui.perfetto.dev or chrome://tracing).
+
+Wrap a stage in a span:
+    with profiling.span('write_image_file_names', frames=len(image_file_names)):
+        ...
+
+Spans do nothing until enable is called (e.g. by --profile), and cost little more than a function call until then.
+Once enabled, each span is recorded with its start time, duration and thread, and write_trace writes them all out.
+Spans in worker processes (e.g. the deduplicate and prescale process pools) are not recorded;
+they show up as the span around the pool in the parent process.
+"""
+import doctest
+import json
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# The recorded trace events, or None when profiling is disabled.
+_events = None
+# thread id -> name, for the threads that recorded events (which may have finished by the time the trace is written).
+_thread_names = {}
+_events_lock = threading.Lock()
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start_time = None
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        end_time = time.perf_counter()
+        event = {
+            'name': self.name,
+            'cat': self.category,
+            'ph': 'X',
+            'ts': _get_microseconds(self.start_time),
+            'dur': _get_microseconds(end_time) - _get_microseconds(self.start_time),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+        }
+        if exception_type is not None:
+            self.args['error'] = exception_type.__name__
+        if self.args:
+            event['args'] = self.args
+        _add_event(event)
+        return False
+
+
+def enable():
+    """Starts recording spans, discarding any that were recorded before."""
+    global _events
+    with _events_lock:
+        _events = []
+        _thread_names.clear()
+
+
+def disable():
+    global _events
+    with _events_lock:
+        _events = None
+
+
+def is_enabled():
+    return _events is not None
+
+
+def span(name, category='render', **args):
+    """Returns a context manager that records the time spent in it as a span called name.
+    args are shown with the span in the trace viewer, and must be JSON-serializable.
+
+    >>> enable()
+    >>> with span('encode', frames=10):
+    ...     pass
+    >>> [(event['name'], event['args']) for event in get_events() if event['ph'] == 'X']
+    [('encode', {'frames': 10})]
+    >>> disable()
+    >>> span('encode') is _NULL_SPAN
+    True
+    """
+    if _events is None:
+        return _NULL_SPAN
+    return _Span(name, category, args)
+
+
+def get_events():
+    """Returns the recorded trace events, including the names of the threads they were recorded on."""
+    with _events_lock:
+        events = list(_events or [])
+        thread_names = dict(_thread_names)
+
+    metadata_events = [
+        {'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': thread_id, 'args': {'name': thread_name}}
+        for thread_id, thread_name in sorted(thread_names.items())]
+    return metadata_events + events
+
+
+def write_trace(path):
+    """Writes the recorded spans to path as Chrome trace JSON."""
+    with open(path, 'w') as trace_file:
+        json.dump({'traceEvents': get_events(), 'displayTimeUnit': 'ms'}, trace_file)
+    logger.info("Wrote the profile to '{}'.".format(path))
+
+
+def _add_event(event):
+    thread_name = threading.current_thread().name
+    with _events_lock:
+        if _events is not None:
+            _events.append(event)
+            _thread_names[event['tid']] = thread_name
+
+
+def _get_microseconds(seconds):
+    return int(seconds * 1000000)
+
+if __name__ == '__main__':
+    doctest.testmod()
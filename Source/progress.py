@@ -0,0 +1,132 @@
+"""
+Tracks encode progress by parsing the encoders' output as it is produced.
+"""
+import collections
+import doctest
+import re
+import threading
+import time
+
+
+# frames_done and total_frames are frame counts (total_frames is None when it isn't known).
+# frames_per_second is the average encoding throughput so far.
+# percent is None when total_frames isn't known, and eta_seconds is also None when nothing has been encoded yet.
+Progress = collections.namedtuple('Progress', ['frames_done', 'total_frames', 'frames_per_second', 'percent', 'eta_seconds'])
+
+# MEncoder:  "Pos:   4.2s    101f (25%) 23.45fps Trem:   0min   1mb  A-V:0.000 [1234:0]"
+# ffmpeg:    "frame=  101 fps= 45 q=28.0 size=     256kB time=00:00:04.20 bitrate= 499.3kbits/s speed=1.9x"
+_FRAME_COUNT_PATTERNS = [
+    re.compile(r'\s(\d+)f\s'),
+    re.compile(r'^frame=\s*(\d+)'),
+]
+
+
+def parse_frame_count(line):
+    """Returns the number of frames encoded so far from a line of encoder output, or None.
+
+    >>> parse_frame_count('Pos:   4.2s    101f (25%) 23.45fps Trem:   0min   1mb  A-V:0.000 [1234:0]')
+    101
+    >>> parse_frame_count('frame=  101 fps= 45 q=28.0 size=     256kB time=00:00:04.20 bitrate= 499.3kbits/s')
+    101
+    >>> parse_frame_count('Opening video filter: [scale w=1280 h=720]') is None
+    True
+    """
+    for pattern in _FRAME_COUNT_PATTERNS:
+        match = pattern.search(line)
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def get_progress_message(progress):
+    """
+    >>> get_progress_message(Progress(250, 1000, 50.0, 25.0, 15.0))
+    'Encoded 250 of 1000 frames (25%), 50.0 frames/s, 0:15 remaining.'
+    >>> get_progress_message(Progress(0, 1000, 0.0, 0.0, None))
+    'Encoded 0 of 1000 frames (0%), 0.0 frames/s.'
+    >>> get_progress_message(Progress(250, None, 50.0, None, None))
+    'Encoded 250 frames, 50.0 frames/s.'
+    """
+    if progress.percent is None:
+        return 'Encoded {} frames, {:.1f} frames/s.'.format(progress.frames_done, progress.frames_per_second)
+    if progress.eta_seconds is None:
+        return 'Encoded {} of {} frames ({:.0f}%), {:.1f} frames/s.'.format(
+            progress.frames_done,
+            progress.total_frames,
+            progress.percent,
+            progress.frames_per_second)
+
+    minutes, seconds = divmod(int(round(progress.eta_seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        eta = '{}:{:02}:{:02}'.format(hours, minutes, seconds)
+    else:
+        eta = '{}:{:02}'.format(minutes, seconds)
+    return 'Encoded {} of {} frames ({:.0f}%), {:.1f} frames/s, {} remaining.'.format(
+        progress.frames_done,
+        progress.total_frames,
+        progress.percent,
+        progress.frames_per_second,
+        eta)
+
+
+class ProgressTracker:
+    """Combines the frame counts parsed from one or more encoder processes into Progress reports.
+
+    callback is called with a Progress at most once every minimum_interval_seconds (and once when complete).
+    It is called on the thread that reads the encoder output, not the thread that created the tracker.
+
+    Each encoder process that contributes frames (e.g. each segment of a segmented encode)
+    reports through its own line handler, from get_line_handler.
+    """
+
+    def __init__(self, total_frames, callback, minimum_interval_seconds=0.25):
+        self.total_frames = total_frames
+        self.callback = callback
+        self.minimum_interval_seconds = minimum_interval_seconds
+
+        self._lock = threading.Lock()
+        self._frames_done_by_part = {}
+        self._start_time = time.monotonic()
+        self._last_report_time = None
+        self._is_complete = False
+
+    def get_line_handler(self, part=0):
+        """Returns a function that takes a line of encoder output for the given part of the encode."""
+        def handle_line(line):
+            frame_count = parse_frame_count(line)
+            if frame_count is not None:
+                self.set_frames_done(frame_count, part)
+        return handle_line
+
+    def set_frames_done(self, frames_done, part=0):
+        with self._lock:
+            self._frames_done_by_part[part] = frames_done
+            now = time.monotonic()
+            total_frames_done = sum(self._frames_done_by_part.values())
+            if self._is_complete:
+                return
+            self._is_complete = self.total_frames is not None and total_frames_done >= self.total_frames
+            if not self._is_complete and self._last_report_time is not None \
+                    and now - self._last_report_time < self.minimum_interval_seconds:
+                return
+            self._last_report_time = now
+            progress = self._get_progress(total_frames_done, now)
+
+        self.callback(progress)
+
+    def _get_progress(self, frames_done, now):
+        elapsed_seconds = now - self._start_time
+        frames_per_second = frames_done / elapsed_seconds if elapsed_seconds > 0 else 0.0
+
+        percent = None
+        eta_seconds = None
+        if self.total_frames:
+            frames_done = min(frames_done, self.total_frames)
+            percent = 100 * frames_done / self.total_frames
+            if frames_per_second > 0:
+                eta_seconds = (self.total_frames - frames_done) / frames_per_second
+        return Progress(frames_done, self.total_frames, frames_per_second, percent, eta_seconds)
+
+if __name__ == '__main__':
+    doctest.testmod()
@@ -0,0 +1,411 @@
+"""
+Runs a queue of time lapse renders, several at a time.
+
+Each job writes its intermediate files (the image list, segments, ...) to its own temporary workspace
+and gets its own output name, so jobs on the same directory don't overwrite each other.
+Jobs with a higher priority are started first; jobs with the same priority run in the order they were submitted.
+
+    render_queue = RenderQueue(max_workers=2)
+    for directory in directories:
+        render_queue.submit(RenderJob(image_helper.get_image_file_names_from_paths([directory]), 24))
+    render_queue.wait()
+"""
+import doctest
+import heapq
+import itertools
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+import decimation
+import deduplicate
+import deflicker
+import encoder_process
+import encoders
+import image_helper
+import incremental
+import preflight
+import prescale
+import profiling
+import progress
+import segmented_encoding
+import transcode
+
+
+logger = logging.getLogger(__name__)
+
+
+class JobStatuses:
+    queued = 'queued'
+    running = 'running'
+    succeeded = 'succeeded'
+    failed = 'failed'
+    cancelled = 'cancelled'
+
+
+_FINISHED_STATUSES = (JobStatuses.succeeded, JobStatuses.failed, JobStatuses.cancelled)
+
+
+class RenderJob:
+    """A movie to render from image_file_names.
+
+    movie_path is where to write the movie (default: a name in the directory of the first image
+    that no other file or job is using, assigned when the job is submitted).
+    encoder is the encoders.EncoderBackend to use (default: the queue's encoder).
+    When worker_count or frames_per_segment is given, segments are encoded in parallel (see segmented_encoding);
+    a worker_count of 0 uses one encoder per core.
+    When check_frames is set, the frames are checked with preflight.get_valid_image_file_names first.
+    When duplicate_threshold is given, duplicate frames are dropped with deduplicate.deduplicate_images,
+    using hash_method.
+    When duration_seconds is given, only enough frames for a movie of that length are used,
+    picked by decimation.decimate_images with frame_spacing.
+    When incremental is set, only the frames added since the job last ran are encoded
+    and joined onto the movie at movie_path (see incremental.update_movie_from_images);
+    it can't be combined with duration_seconds, deflicker_window_size, worker_count or frames_per_segment.
+    When prescale_frames is set (and width and height are given), the frames are scaled with
+    prescale.prescale_images, using resample_filter, before they are encoded.
+    Selections that mix JPEG and PNG frames are converted to one encoding with transcode.transcode_images.
+    When deflicker_window_size is given, flicker is removed with deflicker.create_movie_from_images
+    (which can't be combined with encoding segments in parallel).
+    progress_callback is optionally called with progress.Progress reports (on the encoding thread).
+    Raises ValueError if options that can't be combined are given.
+
+    status is a JobStatuses value.  progress is the latest progress.Progress (or None),
+    and error_message explains why the job failed.
+
+    >>> RenderJob(['/captures/run 1/0001.jpg'], 24, incremental=True, duration_seconds=10)
+    Traceback (most recent call last):
+    ...
+    ValueError: An incremental render cannot be combined with a duration, deflickering or encoding segments in parallel.
+    >>> RenderJob(['/captures/run 1/0001.jpg'], 24, deflicker_window_size=9, worker_count=0)
+    Traceback (most recent call last):
+    ...
+    ValueError: Deflickering cannot be combined with encoding segments in parallel.
+    """
+
+    def __init__(self, image_file_names, frames_per_second, width=None, height=None, priority=0, name=None, movie_path=None, encoder=None, worker_count=None, frames_per_segment=None, check_frames=False, drop_bad_frames=False, preflight_report_path=None, duplicate_threshold=None, hash_method=deduplicate.DEFAULT_HASH_METHOD, prescale_frames=False, resample_filter=prescale.DEFAULT_RESAMPLE_FILTER, deflicker_window_size=None, duration_seconds=None, frame_spacing=decimation.DEFAULT_FRAME_SPACING, incremental=False, progress_callback=None):
+        is_segmented = worker_count is not None or bool(frames_per_segment)
+        # Decimation picks different frames as new ones arrive, deflickering smooths over the neighbouring frames,
+        # and the new frames are encoded as a single segment, so none of these can be applied to just the new frames.
+        if incremental and (duration_seconds is not None or deflicker_window_size is not None or is_segmented):
+            raise ValueError(
+                'An incremental render cannot be combined with a duration, deflickering or encoding segments in parallel.')
+        if deflicker_window_size is not None and is_segmented:
+            raise ValueError('Deflickering cannot be combined with encoding segments in parallel.')
+
+        self.image_file_names = image_file_names
+        self.frames_per_second = frames_per_second
+        self.width = width
+        self.height = height
+        self.priority = priority
+        self.name = name or os.path.dirname(image_file_names[0])
+        self.movie_path = movie_path
+        self.encoder = encoder
+        self.worker_count = worker_count
+        self.frames_per_segment = frames_per_segment
+        self.check_frames = check_frames
+        self.drop_bad_frames = drop_bad_frames
+        self.preflight_report_path = preflight_report_path
+        self.duplicate_threshold = duplicate_threshold
+        self.hash_method = hash_method
+        self.prescale_frames = prescale_frames
+        self.resample_filter = resample_filter
+        self.deflicker_window_size = deflicker_window_size
+        self.duration_seconds = duration_seconds
+        self.frame_spacing = frame_spacing
+        self.incremental = incremental
+        self.progress_callback = progress_callback
+
+        self.status = JobStatuses.queued
+        self.progress = None
+        self.error_message = ''
+        self.cancel_event = threading.Event()
+
+    def is_finished(self):
+        return self.status in _FINISHED_STATUSES
+
+    def get_status_message(self):
+        """
+        >>> job = RenderJob(['/captures/run 1/0001.jpg'], 24)
+        >>> job.get_status_message()
+        '/captures/run 1: queued'
+        >>> job.status = JobStatuses.failed
+        >>> job.error_message = 'ffmpeg failed.'
+        >>> job.get_status_message()
+        '/captures/run 1: failed (ffmpeg failed.)'
+        """
+        if self.status == JobStatuses.running and self.progress is not None:
+            detail = progress.get_progress_message(self.progress)
+        elif self.status == JobStatuses.succeeded:
+            detail = self.movie_path
+        elif self.status == JobStatuses.failed:
+            detail = self.error_message
+        else:
+            detail = ''
+        if detail:
+            return '{}: {} ({})'.format(self.name, self.status, detail)
+        return '{}: {}'.format(self.name, self.status)
+
+    def _set_progress(self, encode_progress):
+        self.progress = encode_progress
+        if self.progress_callback:
+            self.progress_callback(encode_progress)
+
+
+class RenderQueue:
+    """Runs submitted RenderJob's with up to max_workers at once.  Safe to use from multiple threads.
+
+    encoder is the encoders.EncoderBackend for jobs that don't specify one (default: encoders.get_encoder()).
+    cache is an optional image_info_cache.ImageInfoCache shared by the jobs' frame checks and frame conversions.
+    status_callback is optionally called with a job whenever its status changes (on the job's thread).
+    """
+
+    def __init__(self, max_workers=1, encoder=None, cache=None, status_callback=None):
+        self.max_workers = max_workers
+        self.encoder = encoder
+        self.cache = cache
+        self.status_callback = status_callback
+        self.jobs = []
+
+        self._condition = threading.Condition()
+        # (-priority, submission number, job): the highest priority, then the earliest submitted, is first.
+        self._queued_jobs = []
+        self._submission_numbers = itertools.count()
+        self._running_count = 0
+
+    def submit(self, job):
+        """Queues job, and starts it if a worker is free."""
+        with self._condition:
+            if job.movie_path is None:
+                job.movie_path = self._get_unique_movie_path(job)
+            self.jobs.append(job)
+            heapq.heappush(self._queued_jobs, (-job.priority, next(self._submission_numbers), job))
+            self._start_queued_jobs()
+        return job
+
+    def set_max_workers(self, max_workers):
+        """Changes how many jobs can run at once.  Running jobs are not stopped when it is lowered."""
+        with self._condition:
+            self.max_workers = max_workers
+            self._start_queued_jobs()
+
+    def cancel(self, job):
+        """Removes job from the queue or, if it is running, stops it and removes its partial outputs."""
+        with self._condition:
+            job.cancel_event.set()
+            if job.status != JobStatuses.queued:
+                return
+            self._queued_jobs = [entry for entry in self._queued_jobs if entry[2] is not job]
+            heapq.heapify(self._queued_jobs)
+            job.status = JobStatuses.cancelled
+            self._condition.notify_all()
+        self._notify_status_changed(job)
+
+    def cancel_all(self):
+        with self._condition:
+            jobs = list(self.jobs)
+        for job in jobs:
+            self.cancel(job)
+
+    def is_busy(self):
+        with self._condition:
+            return bool(self._queued_jobs) or self._running_count > 0
+
+    def wait(self, timeout=None):
+        """Waits for every submitted job to finish.  Returns False if timeout (in seconds) expired first."""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._queued_jobs and self._running_count == 0, timeout)
+
+    def _start_queued_jobs(self):
+        # Must be called with self._condition held.
+        while self._queued_jobs and self._running_count < self.max_workers:
+            job = heapq.heappop(self._queued_jobs)[2]
+            job.status = JobStatuses.running
+            self._running_count += 1
+            threading.Thread(target=self._run_job, args=(job,), name='RenderJob', daemon=True).start()
+
+    def _run_job(self, job):
+        self._notify_status_changed(job)
+        try:
+            with profiling.span('render', job=job.name):
+                status, error_message = self._render(job)
+        except Exception as error:
+            logger.exception("Render of '{}' failed.".format(job.name))
+            status, error_message = JobStatuses.failed, str(error)
+
+        with self._condition:
+            job.status = status
+            job.error_message = error_message
+        self._notify_status_changed(job)
+
+        with self._condition:
+            self._running_count -= 1
+            self._start_queued_jobs()
+            self._condition.notify_all()
+
+    def _render(self, job):
+        """Returns (status, error-message)."""
+        image_file_names = job.image_file_names
+        if job.check_frames:
+            with profiling.span('preflight', job=job.name):
+                image_file_names, error_message = preflight.get_valid_image_file_names(
+                    image_file_names,
+                    drop_bad_frames=job.drop_bad_frames,
+                    report_path=job.preflight_report_path,
+                    cache=self.cache)
+            if error_message:
+                return JobStatuses.failed, error_message
+
+        if job.duplicate_threshold is not None:
+            with profiling.span('deduplicate', job=job.name):
+                image_file_names, error_message = deduplicate.deduplicate_images(
+                    image_file_names,
+                    job.duplicate_threshold,
+                    job.hash_method,
+                    cancel_event=job.cancel_event)
+            if encoder_process.is_cancelled(job.cancel_event):
+                return JobStatuses.cancelled, ''
+            if error_message:
+                return JobStatuses.failed, error_message
+
+        if job.duration_seconds is not None:
+            with profiling.span('decimate', job=job.name):
+                image_file_names = decimation.decimate_images(
+                    image_file_names,
+                    job.duration_seconds,
+                    float(job.frames_per_second),
+                    job.frame_spacing)
+
+        # The frames that any converted frames (which the incremental manifest can't track) were made from.
+        source_image_file_names = image_file_names
+        frame_parameters = None
+        encoding, error_message = image_helper.get_image_encoding_from_file_names(image_file_names, allow_mixed=True)
+        if encoding == image_helper.ImageEncoding.unknown:
+            return JobStatuses.failed, error_message
+        if encoding == image_helper.ImageEncoding.mixed:
+            with profiling.span('transcode', job=job.name):
+                image_file_names, error_message = transcode.transcode_images(
+                    image_file_names,
+                    info_cache=self.cache,
+                    cancel_event=job.cancel_event)
+            if encoder_process.is_cancelled(job.cancel_event):
+                return JobStatuses.cancelled, ''
+            if error_message:
+                return JobStatuses.failed, error_message
+
+        width, height = job.width, job.height
+        if job.prescale_frames and width and height:
+            with profiling.span('prescale', job=job.name):
+                image_file_names, error_message = prescale.prescale_images(
+                    image_file_names,
+                    width,
+                    height,
+                    job.resample_filter,
+                    info_cache=self.cache,
+                    cancel_event=job.cancel_event)
+            if encoder_process.is_cancelled(job.cancel_event):
+                return JobStatuses.cancelled, ''
+            if error_message:
+                return JobStatuses.failed, error_message
+            frame_parameters = prescale.get_scale_parameters(width, height, job.resample_filter)
+            width, height = None, None
+
+        encoder = job.encoder or self.encoder or encoders.get_encoder()
+        if self.max_workers > 1:
+            # Share the cores between the jobs that run at once.
+            encoder = encoder.with_thread_count(encoders.get_thread_budget(self.max_workers, encoder.thread_count))
+
+        # Keep the workspace next to the output, rather than in the system temp directory, which may be too small.
+        workspace_directory = tempfile.mkdtemp(prefix='TimeLapseJob-', dir=os.path.dirname(job.movie_path))
+        try:
+            if job.incremental:
+                movie_path = incremental.update_movie_from_images(
+                    image_file_names,
+                    job.frames_per_second,
+                    job.movie_path,
+                    width,
+                    height,
+                    encoder=encoder,
+                    progress_callback=job._set_progress,
+                    cancel_event=job.cancel_event,
+                    source_image_file_names=source_image_file_names,
+                    frame_parameters=frame_parameters)
+            elif job.deflicker_window_size is not None:
+                movie_path = deflicker.create_movie_from_images(
+                    image_file_names,
+                    job.frames_per_second,
+                    width,
+                    height,
+                    window_size=job.deflicker_window_size,
+                    encoder=encoder,
+                    progress_callback=job._set_progress,
+                    cancel_event=job.cancel_event,
+                    movie_path=job.movie_path)
+            elif job.worker_count is not None or job.frames_per_segment:
+                movie_path = segmented_encoding.create_movie_from_images(
+                    image_file_names,
+                    job.frames_per_second,
+                    width,
+                    height,
+                    worker_count=job.worker_count,
+                    frames_per_segment=job.frames_per_segment,
+                    encoder=encoder,
+                    progress_callback=job._set_progress,
+                    cancel_event=job.cancel_event,
+                    movie_path=job.movie_path,
+                    working_directory=workspace_directory)
+            else:
+                movie_path = encoder.create_movie_from_images(
+                    image_file_names,
+                    job.frames_per_second,
+                    width,
+                    height,
+                    progress_callback=job._set_progress,
+                    cancel_event=job.cancel_event,
+                    movie_path=job.movie_path,
+                    working_directory=workspace_directory)
+        finally:
+            shutil.rmtree(workspace_directory, ignore_errors=True)
+
+        if encoder_process.is_cancelled(job.cancel_event):
+            return JobStatuses.cancelled, ''
+        if not movie_path:
+            return JobStatuses.failed, 'Error in creating movie.'
+        job.movie_path = movie_path
+        return JobStatuses.succeeded, ''
+
+    def _get_unique_movie_path(self, job):
+        # Must be called with self._condition held.
+        encoder = job.encoder or self.encoder or encoders.get_encoder()
+        reserved_paths = {other_job.movie_path for other_job in self.jobs if not other_job.is_finished()}
+        return get_unique_movie_path(
+            os.path.dirname(job.image_file_names[0]),
+            encoder.movie_file_extension,
+            reserved_paths)
+
+    def _notify_status_changed(self, job):
+        logger.debug(job.get_status_message())
+        if self.status_callback:
+            self.status_callback(job)
+
+
+def get_unique_movie_path(directory, movie_file_extension, reserved_paths=(), base_name='TimeLapse'):
+    """Returns the first of TimeLapse.avi, TimeLapse-2.avi, TimeLapse-3.avi, ... in directory
+    that isn't an existing file or in reserved_paths.
+
+    >>> directory = os.path.join('captures', 'run 1')
+    >>> get_unique_movie_path(directory, '.avi') == os.path.join(directory, 'TimeLapse.avi')
+    True
+    >>> get_unique_movie_path(directory, '.avi', {os.path.join(directory, 'TimeLapse.avi')}) == os.path.join(directory, 'TimeLapse-2.avi')
+    True
+    """
+    for number in itertools.count(1):
+        suffix = '-{}'.format(number) if number > 1 else ''
+        movie_path = os.path.join(directory, base_name + suffix + movie_file_extension)
+        if movie_path not in reserved_paths and not os.path.exists(movie_path):
+            return movie_path
+
+if __name__ == '__main__':
+    doctest.testmod()
@@ -0,0 +1,153 @@
+"""
+Encodes long image sequences in parallel, by splitting them into segments.
+
+Each segment is encoded by its own encoder process, with up to one process per core running at a time,
+and the finished segments are joined into the final movie without re-encoding.
+A single encoder doesn't keep many cores busy (MEncoder's libavcodec uses at most a few threads, and is given only
+its share of the cores when several run at once), so this scales close to linearly with the number of cores.
+"""
+import concurrent.futures
+import doctest
+import logging
+import math
+import os
+import shutil
+import tempfile
+
+import encoder_process
+import encoders
+import image_helper
+import progress
+
+
+logger = logging.getLogger(__name__)
+
+# Segments shorter than this aren't worth the overhead of starting an encoder process and joining the result.
+MINIMUM_FRAMES_PER_SEGMENT = 250
+
+
+def get_default_worker_count():
+    return os.cpu_count() or 1
+
+
+def split_into_segments(image_file_names, worker_count, frames_per_segment=None):
+    """Splits image_file_names into consecutive segments.
+    When frames_per_segment isn't given, the frames are split evenly across the workers,
+    but no segment is shorter than MINIMUM_FRAMES_PER_SEGMENT.
+
+    >>> [len(segment) for segment in split_into_segments(list(range(1000)), 4)]
+    [250, 250, 250, 250]
+    >>> [len(segment) for segment in split_into_segments(list(range(1000)), 16)]
+    [250, 250, 250, 250]
+    >>> [len(segment) for segment in split_into_segments(list(range(10)), 4, frames_per_segment=4)]
+    [4, 4, 2]
+    >>> split_into_segments(list(range(10)), 4, frames_per_segment=-2)
+    Traceback (most recent call last):
+    ...
+    ValueError: A segment must have at least 1 frame, not -2.
+    """
+    if frames_per_segment is not None and frames_per_segment < 1:
+        raise ValueError('A segment must have at least 1 frame, not {}.'.format(frames_per_segment))
+    if frames_per_segment is None:
+        frames_per_segment = max(MINIMUM_FRAMES_PER_SEGMENT, math.ceil(len(image_file_names) / worker_count))
+    return [
+        image_file_names[start:start + frames_per_segment]
+        for start in range(0, len(image_file_names), frames_per_segment)]
+
+
+def create_movie_from_images(image_file_names, frames_per_second, width=None, height=None, worker_count=None, frames_per_segment=None, encoder=None, progress_callback=None, cancel_event=None, movie_path=None, working_directory=None):
+    """Same as EncoderBackend.create_movie_from_images, but encodes segments of the images in parallel.
+    worker_count is the maximum number of encoder processes to run at once (default: the number of cores).
+    encoder is the encoders.EncoderBackend to use (default: encoders.get_encoder()).
+    progress_callback is optionally called with progress.Progress reports for all of the segments combined.
+    Setting cancel_event (a threading.Event) stops all of the encoders and removes the segments.
+    Returns the path to the created movie or None on failure.
+    Raises ValueError if frames_per_segment is less than 1.
+    """
+    encoder = encoder or encoders.get_encoder()
+
+    image_encoding, error_message = image_helper.get_image_encoding_from_file_names(image_file_names)
+    if image_encoding == image_helper.ImageEncoding.unknown:
+        logger.error(error_message)
+        return
+
+    worker_count = worker_count or get_default_worker_count()
+    segments = split_into_segments(image_file_names, worker_count, frames_per_segment)
+    if len(segments) == 1:
+        return encoder.create_movie_from_images(
+            image_file_names,
+            frames_per_second,
+            width,
+            height,
+            progress_callback,
+            cancel_event,
+            movie_path,
+            working_directory)
+
+    input_directory = os.path.dirname(image_file_names[0])
+    movie_path = movie_path or encoder.get_default_movie_path(input_directory)
+    # Share the encoder's threads between the segments that are encoded at once.
+    encoder = encoder.with_thread_count(
+        encoders.get_thread_budget(min(worker_count, len(segments)), encoder.thread_count))
+
+    # Keep the segments next to the output, rather than in the system temp directory, which may be too small.
+    segments_directory = tempfile.mkdtemp(prefix='TimeLapseSegments-', dir=working_directory or input_directory)
+    try:
+        logger.info('Encoding {} frames as {} segments with up to {} encoders.'.format(
+            len(image_file_names),
+            len(segments),
+            worker_count))
+        segment_movie_paths = _encode_segments(
+            encoder,
+            segments,
+            frames_per_second,
+            image_encoding,
+            segments_directory,
+            width,
+            height,
+            worker_count,
+            progress_callback,
+            cancel_event)
+        if not segment_movie_paths:
+            return
+        return encoder.concatenate_movies(segment_movie_paths, movie_path, cancel_event)
+    finally:
+        shutil.rmtree(segments_directory, ignore_errors=True)
+
+
+def _encode_segments(encoder, segments, frames_per_second, image_encoding, segments_directory, width, height, worker_count, progress_callback, cancel_event):
+    """Returns the segment movie paths in order, or None if any segment failed."""
+    progress_tracker = None
+    if progress_callback:
+        progress_tracker = progress.ProgressTracker(sum(len(segment) for segment in segments), progress_callback)
+
+    # Set when a segment fails, so that the encoders that are already running are stopped too.
+    with encoder_process.chain_cancel_event(cancel_event) as segments_cancel_event:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=worker_count) as executor:
+            futures = [
+                executor.submit(
+                    encoder.encode_images_to_movie,
+                    segment,
+                    frames_per_second,
+                    image_encoding,
+                    os.path.join(segments_directory, 'Segment{:05}{}'.format(index, encoder.movie_file_extension)),
+                    os.path.join(segments_directory, 'Segment{:05}.txt'.format(index)),
+                    width,
+                    height,
+                    progress_tracker.get_line_handler(index) if progress_tracker else None,
+                    segments_cancel_event)
+                for index, segment in enumerate(segments)]
+
+            for future in concurrent.futures.as_completed(futures):
+                if not future.result():
+                    if not encoder_process.is_cancelled(cancel_event):
+                        logger.error('Failed to encode a segment; cancelling the rest.')
+                    for other_future in futures:
+                        other_future.cancel()
+                    segments_cancel_event.set()
+                    return
+
+            return [future.result() for future in futures]
+
+if __name__ == '__main__':
+    doctest.testmod()
@@ -0,0 +1,94 @@
+"""
+A stand-in for MEncoder that reads its input like MEncoder does, but doesn't encode anything.
+
+The benchmarks point TIMELAPSE_MENCODER_PATH at it (see mencoder.MENCODER_PATH_ENVIRONMENT_VARIABLE), so that
+the time spent around the encoder (probing, list files, process handling and progress parsing) can be measured
+on machines without MEncoder, and without the encode itself drowning it out.
+
+It understands the three ways the mencoder module runs MEncoder:
+    stub_mencoder.py mf://@FileNames.txt -mf type=jpg:fps=24 ... -o TimeLapse.avi
+    stub_mencoder.py - -demuxer lavf ... -o TimeLapse.avi        (images piped to stdin)
+    stub_mencoder.py Segment1.avi Segment2.avi -nosound -ovc copy -o TimeLapse.avi
+Every input image is read in full, and a progress line in MEncoder's format is printed for each one.
+The output movie just records the number of frames and bytes that were read.
+"""
+import doctest
+import sys
+
+
+_READ_SIZE = 1024 * 1024
+
+
+def get_output_path(args):
+    """
+    >>> get_output_path(['mf://@FileNames.txt', '-ovc', 'lavc', '-o', 'TimeLapse.avi'])
+    'TimeLapse.avi'
+    """
+    return args[args.index('-o') + 1]
+
+
+def get_progress_line(frame_count, total_frames):
+    """Returns a progress line like MEncoder's.
+
+    >>> get_progress_line(101, 404)
+    'Pos:   4.2s    101f (25%)  0.00fps Trem:   0min   0mb  A-V:0.000 [0:0]'
+    """
+    percent = 100 * frame_count // total_frames if total_frames else 0
+    return 'Pos: {:5.1f}s {:6}f ({:2}%)  0.00fps Trem:   0min   0mb  A-V:0.000 [0:0]'.format(
+        frame_count / 24,
+        frame_count,
+        percent)
+
+
+def read_file(file_name):
+    """Reads all of file_name, and returns its size."""
+    size = 0
+    with open(file_name, 'rb') as file:
+        while True:
+            data = file.read(_READ_SIZE)
+            if not data:
+                return size
+            size += len(data)
+
+
+def main(args):
+    if args == ['-ovc', 'help']:
+        # What encoder_discovery probes.
+        print('Available codecs:')
+        print('   copy     - frame copy, without re-encoding.')
+        print('   lavc     - libavcodec codecs - best quality!')
+        return 0
+    if not args or '-o' not in args:
+        print('Usage: stub_mencoder.py INPUT... -o OUTPUT', file=sys.stderr)
+        return 1
+    output_path = get_output_path(args)
+
+    frame_count = 0
+    byte_count = 0
+    if args[0].startswith('mf://@'):
+        with open(args[0][len('mf://@'):]) as file_name_list_file:
+            image_file_names = file_name_list_file.read().splitlines()
+        for image_file_name in image_file_names:
+            byte_count += read_file(image_file_name)
+            frame_count += 1
+            print(get_progress_line(frame_count, len(image_file_names)), flush=True)
+    elif args[0] == '-':
+        # The number of frames in the stream isn't known without parsing it.
+        while True:
+            data = sys.stdin.buffer.read(_READ_SIZE)
+            if not data:
+                break
+            byte_count += len(data)
+    else:
+        for movie_path in args[:args.index('-nosound') if '-nosound' in args else 1]:
+            byte_count += read_file(movie_path)
+
+    with open(output_path, 'w') as output_file:
+        output_file.write('{} frames, {} bytes\n'.format(frame_count, byte_count))
+    print('Video stream: {} frames'.format(frame_count), flush=True)
+    return 0
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(main(sys.argv[1:]))
+    doctest.testmod()
@@ -0,0 +1,159 @@
+"""
+Loads small previews of frames for the GUI's thumbnail strip.
+
+When a JPEG has a thumbnail embedded in its EXIF data (as most camera JPEGs do), that is used, so the frame itself
+is never decoded.  Otherwise the frame is decoded at reduced size (JPEGs are decoded at up to 1/8 scale).
+Thumbnails are loaded in a thread pool (Pillow releases the GIL while decoding), and the loaded thumbnails are kept
+in a bounded least-recently-used cache, so scrolling back and forth is fast and memory use is capped.
+
+Pillow is optional; without it, is_available returns False.
+"""
+import collections
+import concurrent.futures
+import doctest
+import io
+import logging
+
+import image_helper
+
+# Pillow is optional.
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+logger = logging.getLogger(__name__)
+
+# The largest width and height of a thumbnail.
+DEFAULT_SIZE = (160, 120)
+
+# At the default size, each thumbnail takes up to about 56 KB.
+DEFAULT_MAX_CACHED_COUNT = 500
+
+DEFAULT_WORKER_COUNT = 4
+
+
+def is_available():
+    return Image is not None
+
+
+class LruCache:
+    """A dict-like cache that holds up to max_count items, dropping the least recently used ones.
+
+    >>> cache = LruCache(max_count=2)
+    >>> cache['a'] = 1
+    >>> cache['b'] = 2
+    >>> cache.get('a')
+    1
+    >>> cache['c'] = 3
+    >>> 'b' in cache, 'a' in cache, len(cache)
+    (False, True, 2)
+    """
+
+    def __init__(self, max_count):
+        self.max_count = max_count
+        self._items = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        if key not in self._items:
+            return default
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def __setitem__(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_count:
+            self._items.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        self._items.clear()
+
+
+def load_thumbnail(image_file_name, size=DEFAULT_SIZE):
+    """Returns a Pillow image of image_file_name that fits in size, or None if it can't be read."""
+    try:
+        thumbnail_data = image_helper.get_exif_thumbnail(image_file_name)
+        if thumbnail_data is not None:
+            try:
+                return _reduce(Image.open(io.BytesIO(thumbnail_data)), size)
+            except (OSError, ValueError):
+                logger.debug("Unable to read the EXIF thumbnail of '{}'.".format(image_file_name))
+
+        with Image.open(image_file_name) as image:
+            # Let the JPEG decoder skip the detail that is about to be thrown away (it decodes at up to 1/8 scale).
+            image.draft('RGB', size)
+            return _reduce(image, size)
+    except (OSError, ValueError) as error:
+        logger.debug("Unable to load a thumbnail of '{}': {}".format(image_file_name, error))
+        return None
+
+
+def _reduce(image, size):
+    image = image.convert('RGB')
+    image.thumbnail(size)
+    return image
+
+
+class ThumbnailLoader:
+    """Loads thumbnails in a thread pool, and caches them.
+
+    All of the methods must be called from the same thread (e.g. the GUI thread);
+    the loaded thumbnails are picked up from the pool by update.
+    """
+
+    def __init__(self, size=DEFAULT_SIZE, max_cached_count=DEFAULT_MAX_CACHED_COUNT, max_workers=DEFAULT_WORKER_COUNT):
+        self.size = size
+        self._cache = LruCache(max_cached_count)
+        # image file name -> the future loading it
+        self._pending_futures = {}
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+    def get(self, image_file_name):
+        """Returns the thumbnail of image_file_name (a Pillow image) if it's loaded,
+        and otherwise starts loading it and returns None.  None is also returned for unreadable images.
+        """
+        if image_file_name in self._cache:
+            return self._cache.get(image_file_name)
+        if image_file_name not in self._pending_futures:
+            self._pending_futures[image_file_name] = self._executor.submit(load_thumbnail, image_file_name, self.size)
+        return None
+
+    def is_loading(self):
+        return bool(self._pending_futures)
+
+    def update(self):
+        """Moves the thumbnails that have finished loading into the cache.
+        Returns True if there are any, in which case the thumbnails should be requested again.
+        """
+        finished_image_file_names = [
+            image_file_name for image_file_name, future in self._pending_futures.items() if future.done()]
+        for image_file_name in finished_image_file_names:
+            future = self._pending_futures.pop(image_file_name)
+            if not future.cancelled():
+                self._cache[image_file_name] = future.result()
+        return bool(finished_image_file_names)
+
+    def cancel_other_loads(self, image_file_names):
+        """Stops loading the thumbnails that aren't for image_file_names (e.g. the ones scrolled out of view)
+        and haven't started yet.
+        """
+        image_file_names = set(image_file_names)
+        for image_file_name, future in list(self._pending_futures.items()):
+            if image_file_name not in image_file_names and future.cancel():
+                del self._pending_futures[image_file_name]
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._pending_futures.clear()
+        self._cache.clear()
+
+if __name__ == '__main__':
+    doctest.testmod()
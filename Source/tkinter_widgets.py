@@ -1,8 +1,15 @@
 import doctest
 import logging
 import tkinter as tk
+import tkinter.font
 from tkinter import ttk
 
+# Pillow is optional.  It is only needed by ThumbnailStripControl.
+try:
+    from PIL import ImageTk
+except ImportError:
+    ImageTk = None
+
 
 logger = logging.getLogger(__name__)
 
@@ -377,5 +384,241 @@ class ImageScaleControl(ttk.LabelFrame):
         if not self.get_keep_aspect_ratio():
             self.height_control.enable()
 
+
+class VirtualListControl(ttk.Frame):
+    """A read-only list with scroll bars that only creates the rows that are visible.
+
+    A tk.Listbox holds a copy of every item and takes a long time to fill with a very long list,
+    so this shows a page of items (just enough to fill the list) in a Listbox and replaces them as the list is scrolled.
+    The items themselves are not copied, so the list must not be modified while it is shown.
+    """
+
+    def __init__(self, parent, width=80, height=6, **kwargs):
+        super().__init__(parent, **kwargs)
+
+        self.items = []
+        self.first_index = 0
+        self.visible_row_count = height
+        self.scroll_callback = None
+
+        scrollbar_y = ttk.Scrollbar(self, command=self.yview)
+        scrollbar_x = ttk.Scrollbar(self, orient=tk.HORIZONTAL)
+        scrollbar_y.pack(side=tk.RIGHT, fill=tk.Y)
+        scrollbar_x.pack(side=tk.BOTTOM, fill=tk.X)
+        self.scrollbar_y = scrollbar_y
+
+        self.listbox = tk.Listbox(
+            self,
+            borderwidth=0,
+            width=width,
+            height=height,
+            activestyle='none',
+            xscrollcommand=scrollbar_x.set)
+        self.listbox.pack(fill=tk.BOTH, expand=True)
+        scrollbar_x.config(command=self.listbox.xview)
+
+        # Tk lays out each listbox row as the font's line spacing, plus a pixel, plus the selection border.
+        font = tkinter.font.Font(font=self.listbox.cget('font'))
+        self.row_height = font.metrics('linespace') + 1 + 2 * int(self.listbox.cget('selectborderwidth'))
+
+        self.listbox.bind('<Configure>', self._handle_configure_event)
+        # Windows and macOS.
+        self.listbox.bind('<MouseWheel>', self._handle_mouse_wheel_event)
+        # X11.
+        self.listbox.bind('<Button-4>', lambda event: self._scroll_by(-3))
+        self.listbox.bind('<Button-5>', lambda event: self._scroll_by(3))
+        for key, row_count in [('<Up>', -1), ('<Down>', 1)]:
+            self.listbox.bind(key, lambda event, row_count=row_count: self._scroll_by(row_count))
+        for key, page_count in [('<Prior>', -1), ('<Next>', 1)]:
+            self.listbox.bind(key, lambda event, page_count=page_count: self._scroll_by(page_count * self.visible_row_count))
+
+    def set_items(self, items):
+        """Shows items (a sequence of strings), scrolled to the top."""
+        self.items = items
+        self.first_index = 0
+        self._update_rows()
+
+    def set_scroll_callback(self, callback):
+        """callback is called with the index of the first visible item whenever the list is scrolled."""
+        self.scroll_callback = callback
+
+    def yview(self, *args):
+        """Handles the vertical scroll bar's commands."""
+        self.first_index = get_scrolled_first_index(args, self.first_index, len(self.items), self.visible_row_count)
+        self._update_rows()
+        if self.scroll_callback:
+            self.scroll_callback(self.first_index)
+
+    def _scroll_by(self, row_count):
+        self.yview('scroll', row_count, 'units')
+        return 'break'
+
+    def _handle_mouse_wheel_event(self, event):
+        # Each wheel notch is a delta of 120 on Windows, and 1 on macOS.
+        notch_count = event.delta // 120 if abs(event.delta) >= 120 else event.delta
+        return self._scroll_by(-3 * notch_count)
+
+    def _handle_configure_event(self, event):
+        list_height = event.height - 2 * int(self.listbox.cget('highlightthickness'))
+        visible_row_count = max(1, list_height // self.row_height)
+        if visible_row_count != self.visible_row_count:
+            self.visible_row_count = visible_row_count
+            self.first_index = get_scrolled_first_index((), self.first_index, len(self.items), visible_row_count)
+            self._update_rows()
+
+    def _update_rows(self):
+        rows = self.items[self.first_index:self.first_index + self.visible_row_count]
+        self.listbox.delete(0, tk.END)
+        if rows:
+            self.listbox.insert(0, *rows)
+        self.scrollbar_y.set(*get_scroll_fractions(self.first_index, len(self.items), self.visible_row_count))
+
+
+def get_scrolled_first_index(command_args, first_index, item_count, visible_row_count):
+    """Returns the index of the first visible item after a scroll bar command (as passed to a yview method),
+    kept in the range that fills the list.  With no command_args, just keeps first_index in range.
+
+    >>> get_scrolled_first_index(('moveto', '0.5'), 0, 1000, 10)
+    500
+    >>> get_scrolled_first_index(('scroll', '1', 'pages'), 500, 1000, 10)
+    510
+    >>> get_scrolled_first_index(('scroll', '-3', 'units'), 1, 1000, 10)
+    0
+    >>> get_scrolled_first_index(('moveto', '1.0'), 0, 1000, 10)
+    990
+    >>> get_scrolled_first_index((), 990, 1000, 20)
+    980
+    >>> get_scrolled_first_index(('moveto', '0.5'), 0, 5, 10)
+    0
+    """
+    if command_args and command_args[0] == 'moveto':
+        first_index = int(float(command_args[1]) * item_count)
+    elif command_args and command_args[0] == 'scroll':
+        step = visible_row_count if command_args[2] == 'pages' else 1
+        first_index += int(command_args[1]) * step
+    return max(0, min(first_index, item_count - visible_row_count))
+
+
+def get_scroll_fractions(first_index, item_count, visible_row_count):
+    """Returns the (first, last) fractions of the list that are visible, for a scroll bar.
+
+    >>> get_scroll_fractions(500, 1000, 10)
+    (0.5, 0.51)
+    >>> get_scroll_fractions(0, 0, 10)
+    (0.0, 1.0)
+    """
+    if item_count == 0:
+        return 0.0, 1.0
+    return first_index / item_count, min(1.0, (first_index + visible_row_count) / item_count)
+
+
+class ThumbnailStripControl(ttk.Frame):
+    """A horizontally scrolling strip of thumbnails of a list of images, numbered from 1.
+
+    Like VirtualListControl, only the visible thumbnails are created.  They are loaded in the background by
+    thumbnail_loader (a thumbnails.ThumbnailLoader), and are shown as they arrive.
+    """
+
+    # How often to check for newly loaded thumbnails, in milliseconds.
+    _POLL_INTERVAL = 50
+    _SPACING = 4
+    _LABEL_HEIGHT = 16
+
+    def __init__(self, parent, thumbnail_loader, **kwargs):
+        super().__init__(parent, **kwargs)
+
+        self.thumbnail_loader = thumbnail_loader
+        self.thumbnail_width, self.thumbnail_height = thumbnail_loader.size
+        self.items = []
+        self.first_index = 0
+        self.visible_column_count = 1
+        # image file name -> its ImageTk.PhotoImage, for the visible thumbnails.
+        self.photo_images = {}
+        self.is_polling = False
+
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.HORIZONTAL, command=self.xview)
+        self.scrollbar.pack(side=tk.BOTTOM, fill=tk.X)
+        self.canvas = tk.Canvas(
+            self,
+            height=self.thumbnail_height + self._LABEL_HEIGHT + 2 * self._SPACING,
+            highlightthickness=0)
+        self.canvas.pack(fill=tk.BOTH, expand=True)
+
+        self.canvas.bind('<Configure>', self._handle_configure_event)
+        # Windows and macOS.
+        self.canvas.bind('<MouseWheel>', self._handle_mouse_wheel_event)
+        # X11.
+        self.canvas.bind('<Button-4>', lambda event: self.xview('scroll', -1, 'units'))
+        self.canvas.bind('<Button-5>', lambda event: self.xview('scroll', 1, 'units'))
+
+    def set_items(self, items):
+        """Shows thumbnails of items (a sequence of image file names), scrolled to the start."""
+        self.items = items
+        self.first_index = 0
+        self._update_thumbnails()
+
+    def scroll_to(self, index):
+        """Scrolls so that the thumbnail of items[index] is the first one visible (or as close as possible)."""
+        self.first_index = get_scrolled_first_index((), index, len(self.items), self.visible_column_count)
+        self._update_thumbnails()
+
+    def xview(self, *args):
+        """Handles the scroll bar's commands."""
+        self.first_index = get_scrolled_first_index(args, self.first_index, len(self.items), self.visible_column_count)
+        self._update_thumbnails()
+
+    def _handle_mouse_wheel_event(self, event):
+        # Each wheel notch is a delta of 120 on Windows, and 1 on macOS.
+        notch_count = event.delta // 120 if abs(event.delta) >= 120 else event.delta
+        self.xview('scroll', -notch_count, 'units')
+
+    def _handle_configure_event(self, event):
+        visible_column_count = max(1, event.width // (self.thumbnail_width + self._SPACING))
+        if visible_column_count != self.visible_column_count:
+            self.visible_column_count = visible_column_count
+            self.scroll_to(self.first_index)
+
+    def _update_thumbnails(self):
+        visible_items = self.items[self.first_index:self.first_index + self.visible_column_count]
+        self.thumbnail_loader.cancel_other_loads(visible_items)
+
+        self.canvas.delete(tk.ALL)
+        photo_images = {}
+        for column, image_file_name in enumerate(visible_items):
+            x = self._SPACING + column * (self.thumbnail_width + self._SPACING)
+            center_x = x + self.thumbnail_width // 2
+            center_y = self._SPACING + self.thumbnail_height // 2
+            image = self.thumbnail_loader.get(image_file_name)
+            if image is not None and ImageTk is not None:
+                photo_image = self.photo_images.get(image_file_name) or ImageTk.PhotoImage(image)
+                photo_images[image_file_name] = photo_image
+                self.canvas.create_image(center_x, center_y, image=photo_image)
+            else:
+                self.canvas.create_rectangle(
+                    x,
+                    self._SPACING,
+                    x + self.thumbnail_width,
+                    self._SPACING + self.thumbnail_height,
+                    outline='gray')
+            self.canvas.create_text(
+                center_x,
+                self._SPACING + self.thumbnail_height + self._LABEL_HEIGHT // 2,
+                text=str(self.first_index + column + 1))
+        # Tk only shows a PhotoImage while there is a reference to it.
+        self.photo_images = photo_images
+
+        self.scrollbar.set(*get_scroll_fractions(self.first_index, len(self.items), self.visible_column_count))
+        if self.thumbnail_loader.is_loading() and not self.is_polling:
+            self.is_polling = True
+            self.after(self._POLL_INTERVAL, self._check_for_loaded_thumbnails)
+
+    def _check_for_loaded_thumbnails(self):
+        self.is_polling = False
+        if self.thumbnail_loader.update():
+            self._update_thumbnails()
+        elif self.thumbnail_loader.is_loading():
+            self.is_polling = True
+            self.after(self._POLL_INTERVAL, self._check_for_loaded_thumbnails)
+
 if __name__ == '__main__':
     doctest.testmod()
@@ -0,0 +1,143 @@
+"""
+Converts a selection that mixes JPEG and PNG frames to a single encoding, in parallel, and caches the results.
+
+The encoders read the frames with a single image decoder (e.g. MEncoder's mf://@FileNames.txt -mf type=jpg),
+so every frame has to have the same encoding.  When they don't, the frames that aren't in the encoding most of them
+already have (the target encoding) are converted with Pillow in a process pool (one process per core),
+into a frame_cache.FrameCache keyed by (source contents, target encoding), so a later render reuses them
+without decoding anything.  Frames that are already in the target encoding are used as they are.
+
+Pillow is optional; without it, is_available returns False and mixed selections are rejected as before.
+"""
+import collections
+import doctest
+import functools
+import io
+import logging
+
+import frame_cache
+import image_helper
+
+# Pillow is optional.
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIRECTORY_NAME = 'TranscodedFrames'
+
+# Bump this whenever the way frames are converted or saved changes, so that old entries aren't reused.
+_TRANSCODER_VERSION = 1
+
+_JPEG_QUALITY = 95
+# The lowest compression level: writing a PNG at a higher level takes several times as long, for a file
+# that is smaller but is only ever read by the encoder.
+_PNG_COMPRESS_LEVEL = 1
+
+_EXTENSIONS = {
+    image_helper.ImageEncoding.jpeg: '.jpg',
+    image_helper.ImageEncoding.png: '.png',
+}
+
+
+def is_available():
+    return Image is not None
+
+
+def get_default_cache():
+    return frame_cache.FrameCache(frame_cache.get_default_cache_directory(CACHE_DIRECTORY_NAME))
+
+
+def get_transcode_parameters(target_encoding):
+    """
+    >>> get_transcode_parameters(image_helper.ImageEncoding.jpeg)
+    'JPEG:q95:v1'
+    >>> get_transcode_parameters(image_helper.ImageEncoding.png)
+    'PNG:v1'
+    """
+    if target_encoding == image_helper.ImageEncoding.jpeg:
+        return '{}:q{}:v{}'.format(target_encoding, _JPEG_QUALITY, _TRANSCODER_VERSION)
+    return '{}:v{}'.format(target_encoding, _TRANSCODER_VERSION)
+
+
+def get_target_encoding(image_file_names):
+    """Returns the encoding that most of image_file_names have (so the fewest frames are converted),
+    preferring JPEG on a tie.  All of image_file_names must have a known encoding.
+
+    >>> get_target_encoding(['1.png', '2.jpg', '3.png'])
+    'PNG'
+    >>> get_target_encoding(['1.png', '2.jpg'])
+    'JPEG'
+    """
+    encoding_counts = collections.Counter(
+        image_helper.get_image_encoding_from_file_name(image_file_name)[0] for image_file_name in image_file_names)
+    if encoding_counts[image_helper.ImageEncoding.png] > encoding_counts[image_helper.ImageEncoding.jpeg]:
+        return image_helper.ImageEncoding.png
+    return image_helper.ImageEncoding.jpeg
+
+
+def transcode_images(image_file_names, target_encoding=None, max_workers=None, cache=None, info_cache=None, cancel_event=None):
+    """Converts the frames of image_file_names that aren't in target_encoding (default: get_target_encoding),
+    reusing any frames that have already been converted.
+    max_workers is the number of worker processes (default: the number of cores).
+    cache is the frame_cache.FrameCache to use (default: get_default_cache()).
+    info_cache is an optional image_info_cache.ImageInfoCache (see frame_cache.convert_frames).
+    Setting cancel_event (a threading.Event) stops converting.
+    Returns (image-file-names, error-message).  The image file names are in the same order as image_file_names,
+    all have target_encoding, and are empty on failure.
+    """
+    target_encoding = target_encoding or get_target_encoding(image_file_names)
+    if target_encoding not in _EXTENSIONS:
+        raise ValueError("Unable to transcode to encoding '{}'.".format(target_encoding))
+
+    # index in image_file_names -> the frame to convert
+    source_image_file_names = {
+        index: image_file_name
+        for index, image_file_name in enumerate(image_file_names)
+        if image_helper.get_image_encoding_from_file_name(image_file_name)[0] != target_encoding}
+    if not source_image_file_names:
+        return list(image_file_names), ''
+    if not is_available():
+        return [], 'Mixed image encodings can only be converted with Pillow (pip install Pillow).'
+
+    indexes = sorted(source_image_file_names)
+    transcoded_image_file_names, cached_count, error_message = frame_cache.convert_frames(
+        [source_image_file_names[index] for index in indexes],
+        functools.partial(_transcode_image, target_encoding=target_encoding),
+        get_transcode_parameters(target_encoding),
+        cache or get_default_cache(),
+        extension=_EXTENSIONS[target_encoding],
+        max_workers=max_workers,
+        info_cache=info_cache,
+        cancel_event=cancel_event)
+    if error_message:
+        return [], error_message
+
+    logger.info('Converted {} of {} frames to {} ({} were already converted).'.format(
+        len(transcoded_image_file_names),
+        len(image_file_names),
+        target_encoding,
+        cached_count))
+
+    image_file_names = list(image_file_names)
+    for index, transcoded_image_file_name in zip(indexes, transcoded_image_file_names):
+        image_file_names[index] = transcoded_image_file_name
+    return image_file_names, ''
+
+
+def _transcode_image(image_data, transcoded_image_file_name, target_encoding):
+    """Runs in a worker process."""
+    with Image.open(io.BytesIO(image_data)) as image:
+        if target_encoding == image_helper.ImageEncoding.jpeg:
+            # JPEG has no transparency, so it is dropped.
+            image.convert('RGB').save(transcoded_image_file_name, 'JPEG', quality=_JPEG_QUALITY)
+        else:
+            if image.mode not in ('RGB', 'RGBA', 'L'):
+                image = image.convert('RGB')
+            image.save(transcoded_image_file_name, 'PNG', compress_level=_PNG_COMPRESS_LEVEL)
+
+if __name__ == '__main__':
+    doctest.testmod()
@@ -0,0 +1,238 @@
+"""
+Watches capture directories and re-renders their movies as new frames arrive.
+
+New frames are detected with inotify on Linux, and otherwise by polling each directory's modification time
+(which changes whenever a file is added, so the directory is only listed when something has changed).
+Bursts of new frames are debounced: a directory is rendered once no new frames have arrived for debounce_seconds,
+or maximum_delay_seconds after the first new frame, whichever comes first, so a camera that never stops still
+gets regular updates.  Renders run on a render_queue.RenderQueue, which caps how many run at once,
+and a directory is never rendered twice at the same time.
+"""
+import ctypes
+import ctypes.util
+import doctest
+import logging
+import os
+import select
+import struct
+import sys
+import time
+
+import image_helper
+import render_queue
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DEBOUNCE_SECONDS = 10
+DEFAULT_MAXIMUM_DELAY_SECONDS = 60
+DEFAULT_POLL_INTERVAL_SECONDS = 2
+
+# How long each wait for changes lasts, which bounds how quickly cancelling is noticed.
+_WAIT_SECONDS = 0.5
+
+
+class PollingWatcher:
+    """Detects new images by polling each directory's modification time.
+    A directory is only listed when its modification time changes, and it is only reported as changed
+    when it then contains a different number of images (so e.g. writing the movie doesn't count).
+    """
+
+    def __init__(self, directories, poll_interval_seconds=DEFAULT_POLL_INTERVAL_SECONDS):
+        self.poll_interval_seconds = poll_interval_seconds
+        # directory -> (modification time, image count)
+        self._states = {directory: self._get_state(directory, None) for directory in directories}
+        self._next_poll_time = time.monotonic()
+
+    def wait_for_changes(self, timeout):
+        """Returns the set of directories whose images changed, waiting up to timeout seconds for one."""
+        time.sleep(max(0, min(timeout, self._next_poll_time - time.monotonic())))
+        if time.monotonic() < self._next_poll_time:
+            return set()
+        self._next_poll_time = time.monotonic() + self.poll_interval_seconds
+
+        changed_directories = set()
+        for directory, state in self._states.items():
+            new_state = self._get_state(directory, state)
+            if new_state[1] != state[1]:
+                changed_directories.add(directory)
+            self._states[directory] = new_state
+        return changed_directories
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _get_state(directory, state):
+        try:
+            modification_time = os.stat(directory).st_mtime_ns
+        except OSError:
+            return None, 0
+        if state is not None and state[0] == modification_time:
+            return state
+        with os.scandir(directory) as entries:
+            image_count = sum(1 for entry in entries if image_helper.is_image_file_name(entry.name))
+        return modification_time, image_count
+
+
+class InotifyWatcher:
+    """Detects new images with Linux's inotify, without polling."""
+
+    # From <sys/inotify.h>.
+    _IN_CLOSE_WRITE = 0x00000008
+    _IN_MOVED_TO = 0x00000080
+    _IN_Q_OVERFLOW = 0x00004000
+    _IN_NONBLOCK = 0o4000
+    _IN_CLOEXEC = 0o2000000
+
+    _EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, directories):
+        self._libc = _get_inotify_libc()
+        if self._libc is None:
+            raise OSError('inotify is not available.')
+        self._fd = self._libc.inotify_init1(self._IN_NONBLOCK | self._IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed.')
+
+        # Frames are reported once they have been completely written (or moved into the directory).
+        mask = self._IN_CLOSE_WRITE | self._IN_MOVED_TO
+        self._directories_by_watch = {}
+        for directory in directories:
+            watch = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), mask)
+            if watch < 0:
+                self.close()
+                raise OSError(ctypes.get_errno(), "Unable to watch '{}'.".format(directory))
+            self._directories_by_watch[watch] = directory
+
+    def wait_for_changes(self, timeout):
+        """Returns the set of directories whose images changed, waiting up to timeout seconds for one."""
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changed_directories = set()
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                watch, mask, cookie, name_length = self._EVENT_HEADER.unpack_from(data, offset)
+                offset += self._EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + name_length].rstrip(b'\0'))
+                offset += name_length
+                if mask & self._IN_Q_OVERFLOW:
+                    # Events were lost, so assume that every directory changed.
+                    changed_directories.update(self._directories_by_watch.values())
+                elif watch in self._directories_by_watch and image_helper.is_image_file_name(name):
+                    changed_directories.add(self._directories_by_watch[watch])
+        return changed_directories
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def _get_inotify_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+def create_watcher(directories):
+    """Returns an InotifyWatcher for directories if inotify is available, and a PollingWatcher otherwise."""
+    try:
+        return InotifyWatcher(directories)
+    except OSError as error:
+        logger.debug('Polling for new frames: {}'.format(error))
+        return PollingWatcher(directories)
+
+
+class DebounceTimer:
+    """Decides when a directory with new frames is due to be rendered.
+
+    >>> timer = DebounceTimer(debounce_seconds=10, maximum_delay_seconds=60)
+    >>> timer.add_change('a', now=0)
+    >>> timer.add_change('a', now=5)
+    >>> timer.get_due_directories(now=14)
+    []
+    >>> timer.get_due_directories(now=15)
+    ['a']
+    >>> timer.remove('a')
+    >>> for now in range(0, 61, 5):
+    ...     timer.add_change('b', now=now)
+    >>> timer.get_due_directories(now=60)
+    ['b']
+    """
+
+    def __init__(self, debounce_seconds=DEFAULT_DEBOUNCE_SECONDS, maximum_delay_seconds=DEFAULT_MAXIMUM_DELAY_SECONDS):
+        self.debounce_seconds = debounce_seconds
+        self.maximum_delay_seconds = maximum_delay_seconds
+        # directory -> (time of the first change, time of the last change)
+        self._change_times = {}
+
+    def add_change(self, directory, now):
+        first_change_time, last_change_time = self._change_times.get(directory, (now, now))
+        self._change_times[directory] = (first_change_time, now)
+
+    def get_due_directories(self, now):
+        return sorted(
+            directory
+            for directory, (first_change_time, last_change_time) in self._change_times.items()
+            if now - last_change_time >= self.debounce_seconds or now - first_change_time >= self.maximum_delay_seconds)
+
+    def remove(self, directory):
+        del self._change_times[directory]
+
+
+def watch_directories(directories, create_job, cancel_event, max_workers=1, debounce_seconds=DEFAULT_DEBOUNCE_SECONDS, maximum_delay_seconds=DEFAULT_MAXIMUM_DELAY_SECONDS, cache=None, status_callback=None):
+    """Renders each of directories when it gets new frames, until cancel_event (a threading.Event) is set.
+    Every directory is rendered once at the start, to bring it up to date.
+
+    create_job is called with a directory and returns the render_queue.RenderJob to render it (or None to skip it).
+    Up to max_workers renders run at once.  cache and status_callback are passed to the render_queue.RenderQueue.
+    """
+    queue = render_queue.RenderQueue(max_workers, cache=cache, status_callback=status_callback)
+    debounce_timer = DebounceTimer(debounce_seconds, maximum_delay_seconds)
+    # directory -> the job rendering it
+    active_jobs = {}
+    for directory in directories:
+        debounce_timer.add_change(directory, now=-maximum_delay_seconds)
+
+    watcher = create_watcher(directories)
+    logger.info('Watching {} directories with {}.'.format(len(directories), type(watcher).__name__))
+    try:
+        while not cancel_event.is_set():
+            now = time.monotonic()
+            for directory in watcher.wait_for_changes(_WAIT_SECONDS):
+                debounce_timer.add_change(directory, now)
+
+            for directory, job in list(active_jobs.items()):
+                if job.is_finished():
+                    del active_jobs[directory]
+
+            now = time.monotonic()
+            for directory in debounce_timer.get_due_directories(now):
+                if directory in active_jobs:
+                    # Render again once the current render finishes.
+                    continue
+                debounce_timer.remove(directory)
+                job = create_job(directory)
+                if job is not None:
+                    active_jobs[directory] = queue.submit(job)
+    finally:
+        watcher.close()
+        queue.cancel_all()
+        queue.wait()
+
+if __name__ == '__main__':
+    doctest.testmod()